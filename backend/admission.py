@@ -0,0 +1,217 @@
+# Admission control
+# One bounded lane per upstream (Flux, Gemini text, Gemini vision, Tesseract, PDF
+# parsing): a fixed number of concurrent calls, a bounded wait queue and a maximum
+# wait, so overload turns into fast 429s instead of everything slowing down together.
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+DEFAULT_LANES = {
+    # lane: (max_concurrent, max_queue, max_wait_seconds)
+    "flux": (4, 16, 30.0),
+    "gemini_text": (8, 32, 20.0),
+    "gemini_vision": (4, 16, 20.0),
+    "tesseract": (os.cpu_count() or 1, 8, 15.0),
+    "pdf": (2, 8, 30.0),
+}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a lane's queue is full or the wait for a slot ran out"""
+
+    def __init__(self, lane, reason, retry_after):
+        super().__init__(f"{lane} is overloaded ({reason}), retry in {retry_after}s")
+        self.lane = lane
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Lane:
+    """Counting semaphore with a bounded, time-limited wait queue and gauges"""
+
+    def __init__(self, name, max_concurrent, max_queue, max_wait):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._queued = 0
+        self._waits = deque(maxlen=200)
+        self._holds = deque(maxlen=50)
+        self._stats = {"admitted": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+
+    def retry_after(self):
+        """Seconds until a slot is likely to free up, from recent hold times"""
+        with self._cond:
+            hold = sum(self._holds) / len(self._holds) if self._holds else 1.0
+            backlog = self._queued + 1
+        return min(60, max(1, math.ceil(hold * backlog / self.max_concurrent)))
+
+    def check(self):
+        """Raise AdmissionRejected now if a new caller would be turned away"""
+        with self._cond:
+            full = self._in_flight >= self.max_concurrent and self._queued >= self.max_queue
+        if full:
+            self._reject("queue_full")
+
+    def acquire(self, timeout=None):
+        """Take a slot, waiting up to max_wait (or `timeout` if shorter); raise AdmissionRejected otherwise"""
+        started = time.perf_counter()
+        max_wait = self.max_wait if timeout is None else min(self.max_wait, timeout)
+        with self._cond:
+            if self._in_flight >= self.max_concurrent:
+                if self._queued >= self.max_queue:
+                    reason = "queue_full"
+                else:
+                    reason = self._wait_for_slot(started + max_wait)
+                if reason:
+                    self._stats[f"rejected_{reason}"] += 1
+            else:
+                reason = None
+            if reason is None:
+                self._in_flight += 1
+                self._stats["admitted"] += 1
+                self._waits.append((time.perf_counter() - started) * 1000)
+        if reason:
+            raise AdmissionRejected(self.name, reason, self.retry_after())
+        return time.perf_counter()
+
+    def _wait_for_slot(self, deadline):
+        """Queue until a slot frees up (lock held); return 'timeout' if the deadline passes"""
+        self._queued += 1
+        try:
+            while self._in_flight >= self.max_concurrent:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return "timeout"
+                self._cond.wait(remaining)
+            return None
+        finally:
+            self._queued -= 1
+
+    async def acquire_async(self, timeout=None, poll_interval=0.02):
+        """acquire() for coroutines: polls for a slot instead of blocking the event loop"""
+        started = time.perf_counter()
+        deadline = started + (self.max_wait if timeout is None else min(self.max_wait, timeout))
+        queued = False
+        try:
+            while True:
+                with self._cond:
+                    if self._in_flight < self.max_concurrent:
+                        self._in_flight += 1
+                        self._stats["admitted"] += 1
+                        self._waits.append((time.perf_counter() - started) * 1000)
+                        return time.perf_counter()
+                    if not queued and self._queued >= self.max_queue:
+                        reason = "queue_full"
+                    elif queued and time.perf_counter() >= deadline:
+                        reason = "timeout"
+                    else:
+                        reason = None
+                        if not queued:
+                            self._queued += 1
+                            queued = True
+                if reason:
+                    self._reject(reason)
+                await asyncio.sleep(poll_interval)
+        finally:
+            if queued:
+                with self._cond:
+                    self._queued -= 1
+
+    def release(self, acquired_at=None):
+        with self._cond:
+            self._in_flight -= 1
+            if acquired_at is not None:
+                self._holds.append(time.perf_counter() - acquired_at)
+            self._cond.notify()
+
+    def _reject(self, reason):
+        with self._cond:
+            self._stats[f"rejected_{reason}"] += 1
+        raise AdmissionRejected(self.name, reason, self.retry_after())
+
+    def stats(self):
+        with self._cond:
+            last = self._waits[-1] if self._waits else 0.0
+            waits = sorted(self._waits)
+            stats = dict(self._stats)
+            stats.update(
+                in_flight=self._in_flight,
+                queued=self._queued,
+                max_concurrent=self.max_concurrent,
+                max_queue=self.max_queue,
+                max_wait_seconds=self.max_wait,
+            )
+        stats["wait_ms"] = {
+            "last": round(last, 1),
+            "p50": round(waits[len(waits) // 2], 1) if waits else 0.0,
+            "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 1) if waits else 0.0,
+        }
+        return stats
+
+
+class AdmissionController:
+    """Named lanes; an unknown lane (or a disabled controller) admits everything"""
+
+    def __init__(self, lanes=None, enabled=True):
+        self.enabled = enabled
+        self.lanes = {}
+        for name, (max_concurrent, max_queue, max_wait) in (lanes or {}).items():
+            self.lanes[name] = Lane(name, max_concurrent, max_queue, max_wait)
+
+    def check(self, name):
+        lane = self.lanes.get(name) if self.enabled else None
+        if lane:
+            lane.check()
+
+    def acquire(self, name, timeout=None):
+        """Take a slot in a lane, waiting at most `timeout` if given; returns a token for release()"""
+        lane = self.lanes.get(name) if self.enabled else None
+        return lane.acquire(timeout) if lane else None
+
+    def release(self, name, token=None):
+        lane = self.lanes.get(name) if self.enabled else None
+        if lane:
+            lane.release(token)
+
+    @contextmanager
+    def slot(self, name, timeout=None):
+        token = self.acquire(name, timeout)
+        try:
+            yield
+        finally:
+            self.release(name, token)
+
+    @asynccontextmanager
+    async def slot_async(self, name, timeout=None):
+        lane = self.lanes.get(name) if self.enabled else None
+        token = await lane.acquire_async(timeout) if lane else None
+        try:
+            yield
+        finally:
+            self.release(name, token)
+
+    def stats(self):
+        if not self.enabled:
+            return {"enabled": False}
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+
+def load_lanes():
+    """DEFAULT_LANES with ADMISSION_<LANE>_{CONCURRENCY,QUEUE,MAX_WAIT_SECONDS} overrides"""
+    lanes = {}
+    for name, (max_concurrent, max_queue, max_wait) in DEFAULT_LANES.items():
+        prefix = f"ADMISSION_{name.upper()}_"
+        lanes[name] = (
+            int(os.getenv(prefix + 'CONCURRENCY', str(max_concurrent))),
+            int(os.getenv(prefix + 'QUEUE', str(max_queue))),
+            float(os.getenv(prefix + 'MAX_WAIT_SECONDS', str(max_wait))),
+        )
+    return lanes
@@ -1,30 +1,46 @@
 # Hugging Face Flux API Service + Image Analysis
 # Flask backend for AI image generation and text extraction using Hugging Face models and Gemini AI
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g, has_request_context
+import json
 from flask_cors import CORS
-import requests
 import base64
+import contextvars
 import io
+import math
 import os
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
-import google.generativeai as genai
-
-try:
-    import pytesseract
-    TESSERACT_AVAILABLE = True
-except ImportError:
-    TESSERACT_AVAILABLE = False
+from urllib.parse import quote
+from contextlib import nullcontext
+from image_cache import ImageCache, make_cache_key
+from image_store import ImageStore, VariantError, VARIANT_FORMATS, VARIANT_SIZES, parse_variant, variant_etag
+from singleflight import SingleFlight, SingleFlightTimeout
+from hf_client import HuggingFaceClient
+from flux_monitor import FluxMonitor
+from image_processing import PostProcessor
+from extraction_cache import ExtractionCache, hash_stream
+from upload_buffers import (
+    UploadIOStats, detach_upload, make_upload_request_class, release_source, upload_source
+)
+from llm import LLMService, ResponseCache, create_backend
+from chunked_analysis import ChunkedAnalyzer, estimate_tokens
+from admission import AdmissionController, AdmissionRejected, load_lanes
+from deadlines import NO_DEADLINE, DeadlineExceeded, deadline_from_header
+from jobs import JobRunner, JobQueueFull, create_job_store, public_job
+from metrics import MetricsRegistry
+from providers import registry as providers
+
+from ocr import OCREngine, TESSERACT_AVAILABLE
+if not TESSERACT_AVAILABLE:
     print("⚠️  Warning: pytesseract not available. OCR will use AI only.")
 
-try:
-    import PyPDF2
-    PDF_AVAILABLE = True
-except ImportError:
-    PDF_AVAILABLE = False
+from pdf_extraction import PDFExtractor, PDF_AVAILABLE, count_pages
+from image_ingest import ImageIngest, ImageTooLarge, fit
+if not PDF_AVAILABLE:
     print("⚠️  Warning: PyPDF2 not available. PDF text extraction will not work.")
     print("   Install with: pip install PyPDF2")
 
@@ -35,33 +51,328 @@ app = Flask(__name__)
 
 # Configure CORS for production
 frontend_url = os.getenv('FRONTEND_URL', '*')
-CORS(app, origins=[frontend_url, 'http://localhost:5173', 'http://localhost:3000'])
+CORS_ORIGINS = [frontend_url, 'http://localhost:5173', 'http://localhost:3000']
+CORS(
+    app,
+    origins=CORS_ORIGINS,
+    expose_headers=['X-Image-Model', 'X-Image-Prompt', 'X-Image-Dimensions',
+                    'X-Image-Quality-Mode', 'X-Image-Cached', 'X-Image-Timestamp', 'X-Image-Id', 'ETag']
+)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
-app.config['UPLOAD_FOLDER'] = 'uploads'
 
-# Create uploads folder
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Prometheus metrics (/metrics): request and per-stage latency histograms plus
+# upstream status counters; gauges for caches and admission lanes are read at scrape time
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+metrics = MetricsRegistry(prefix='visora_')
+request_latency = metrics.histogram(
+    'request_duration_seconds', 'Time to build the HTTP response, by endpoint', ('endpoint', 'method', 'status')
+)
+stage_latency = metrics.histogram(
+    'stage_duration_seconds', 'Latency of each processing stage, by endpoint', ('endpoint', 'stage')
+)
+decode_memory = metrics.histogram(
+    'image_decode_megabytes', 'Pixel memory allocated to decode one uploaded image', ('endpoint',),
+    buckets=(1, 4, 16, 32, 64, 128, 256, 512)
+)
+upstream_responses = metrics.counter(
+    'upstream_responses_total', 'Upstream call outcomes (HTTP status for Flux attempts)', ('upstream', 'status')
+)
+
+# Endpoint label for stages timed outside a Flask request; asgi.py sets it for its native routes
+stage_endpoint = contextvars.ContextVar('stage_endpoint', default='background')
+
+def current_endpoint():
+    return (request.endpoint or 'unknown') if has_request_context() else stage_endpoint.get()
+
+def stage(name):
+    """Time one processing stage of the current endpoint"""
+    if not METRICS_ENABLED:
+        return nullcontext()
+    return stage_latency.time(endpoint=current_endpoint(), stage=name)
+
+def observe_stage(name, seconds):
+    """Record a stage duration measured elsewhere"""
+    if METRICS_ENABLED and seconds is not None:
+        stage_latency.observe(seconds, endpoint=current_endpoint(), stage=name)
+
+# Per-request deadline: X-Request-Timeout (seconds) or REQUEST_TIMEOUT_SECONDS (0 = none),
+# capped at REQUEST_TIMEOUT_MAX_SECONDS. Upstream timeouts and waits are cut to what is left.
+REQUEST_TIMEOUT_SECONDS = float(os.getenv('REQUEST_TIMEOUT_SECONDS', '120'))
+REQUEST_TIMEOUT_MAX_SECONDS = float(os.getenv('REQUEST_TIMEOUT_MAX_SECONDS', '600'))
+# Skip the Gemini vision fallback after low-confidence OCR when less than this is left
+OCR_FALLBACK_MIN_SECONDS = float(os.getenv('OCR_FALLBACK_MIN_SECONDS', '10'))
+
+def request_deadline(header_value):
+    return deadline_from_header(header_value, REQUEST_TIMEOUT_SECONDS, REQUEST_TIMEOUT_MAX_SECONDS)
+
+@app.before_request
+def start_request_deadline():
+    g.deadline = request_deadline(request.headers.get('X-Request-Timeout'))
+
+def current_deadline():
+    """The current request's deadline (none outside a request, e.g. background jobs)"""
+    return g.get('deadline', NO_DEADLINE) if has_request_context() else NO_DEADLINE
+
+def deadline_error(stage):
+    return {"error": "deadline_exceeded", "message": str(DeadlineExceeded(stage))}
+
+def deadline_exceeded_response(error):
+    return jsonify({"error": "deadline_exceeded", "message": str(error)}), 504
+
+def record_upstream(upstream, status):
+    if METRICS_ENABLED:
+        upstream_responses.inc(upstream=upstream, status=status)
+
+if METRICS_ENABLED:
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_latency(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            request_latency.observe(
+                time.perf_counter() - started,
+                endpoint=request.endpoint or 'unknown', method=request.method, status=str(response.status_code)
+            )
+        return response
+
+# Uploads stay in RAM up to UPLOAD_SPOOL_MAX_KB and spill to unique temp files beyond it;
+# nothing is written to a shared uploads/ folder
+app.request_class = make_upload_request_class(
+    spool_max_bytes=int(os.getenv('UPLOAD_SPOOL_MAX_KB', '2048')) * 1024,
+    temp_dir=os.getenv('UPLOAD_TMP_DIR') or None
+)
+upload_io_stats = UploadIOStats()
 
 # Hugging Face configuration
 HF_API_TOKEN = os.getenv('HUGGINGFACE_API_TOKEN')
-HF_API_URL = "https://api-inference.huggingface.co/models/black-forest-labs/FLUX.1-schnell"
+HF_API_URL = os.getenv('HF_API_URL', "https://api-inference.huggingface.co/models/black-forest-labs/FLUX.1-schnell")
 
 # Gemini AI configuration
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-if GEMINI_API_KEY and GEMINI_API_KEY != 'your_gemini_api_key_here':
-    genai.configure(api_key=GEMINI_API_KEY)
-    print("✅ Gemini AI configured successfully")
+GEMINI_CONFIGURED = bool(GEMINI_API_KEY and GEMINI_API_KEY != 'your_gemini_api_key_here')
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')  # gemini, or fake for offline tests/benchmarks
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash-exp')
+
+# Admission control: a bounded lane per upstream (flux, gemini_text, gemini_vision,
+# tesseract, pdf); full queues or long waits are answered with 429 + Retry-After
+admission = AdmissionController(
+    load_lanes(),
+    enabled=os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+)
+
+# One LLM client for the process: model handles are reused and identical
+# (model, prompt, content) requests are answered from the response cache
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+llm = LLMService(
+    create_backend(
+        LLM_BACKEND,
+        api_key=GEMINI_API_KEY if GEMINI_CONFIGURED else None,
+        fake_latency=float(os.getenv('LLM_FAKE_LATENCY_SECONDS', '0')),
+        fake_chunk_latency=float(os.getenv('LLM_FAKE_CHUNK_LATENCY_SECONDS', '0'))
+    ),
+    cache=ResponseCache(
+        max_items=int(os.getenv('LLM_CACHE_ITEMS', '512')),
+        ttl_seconds=int(os.getenv('LLM_CACHE_TTL_SECONDS', str(24 * 3600))),
+        sqlite_path=os.getenv('LLM_CACHE_SQLITE_PATH') or None
+    ) if LLM_CACHE_ENABLED else None,
+    default_model=GEMINI_MODEL,
+    admission=admission,
+    on_outcome=record_upstream
+)
+# Map-reduce analysis for long documents: chunks are summarised in parallel (each
+# chunk prompt is cached by the LLM service) and the summaries are merged at the end
+ANALYSIS_AUTO_CHUNK_TOKENS = int(os.getenv('ANALYSIS_AUTO_CHUNK_TOKENS', '8000'))  # 0 = only on request
+chunked_analyzer = ChunkedAnalyzer(
+    llm,
+    build_final_prompt=lambda content, prompt: build_analysis_prompt(content, prompt),
+    max_chunk_tokens=int(os.getenv('ANALYSIS_CHUNK_TOKENS', '3000')),
+    overlap_tokens=int(os.getenv('ANALYSIS_CHUNK_OVERLAP_TOKENS', '200')),
+    workers=int(os.getenv('ANALYSIS_CHUNK_WORKERS', '4'))
+)
+# Heavy SDKs (google.generativeai, pytesseract, PyPDF2, requests) are imported on first
+# use; with WARMUP_ENABLED they are preloaded in the background once requests start arriving
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'true').lower() == 'true'
+WARMUP_DELAY_SECONDS = float(os.getenv('WARMUP_DELAY_SECONDS', '1'))
+providers.add_warmup_hook(llm.warm_up)
+providers.add_warmup_hook(lambda: hf_client.session)
+
+def start_warmup():
+    """Preload providers and start the Flux keeper on background threads (no-op after the first call)"""
+    if WARMUP_ENABLED:
+        providers.warm_up(delay=WARMUP_DELAY_SECONDS)
+    if FLUX_WARM_KEEPER_ENABLED:
+        flux_monitor.start()
+
+@app.before_request
+def start_background_work():
+    start_warmup()
+
+if llm.available:
+    print(f"✅ LLM backend ready: {llm.backend.name} ({GEMINI_MODEL})")
 else:
     print("⚠️  Warning: GEMINI_API_KEY not configured properly")
     print("   Add your key to backend/.env file")
     print("   Get key from: https://makersuite.google.com/app/apikey")
 
+# Generated image cache configuration
+IMAGE_CACHE_ENABLED = os.getenv('IMAGE_CACHE_ENABLED', 'true').lower() == 'true'
+image_cache = ImageCache(
+    memory_items=int(os.getenv('IMAGE_CACHE_MEMORY_ITEMS', '128')),
+    memory_bytes=int(os.getenv('IMAGE_CACHE_MEMORY_MB', '64')) * 1024 * 1024,
+    disk_dir=os.getenv('IMAGE_CACHE_DIR', os.path.join('cache', 'images')) or None,
+    disk_bytes=int(os.getenv('IMAGE_CACHE_DISK_MB', '512')) * 1024 * 1024,
+    ttl_seconds=int(os.getenv('IMAGE_CACHE_TTL_SECONDS', str(7 * 24 * 3600))),
+) if IMAGE_CACHE_ENABLED else None
+
+# Content-addressed store of generated images; /images/<id>/<variant> serves resized
+# or re-encoded derivatives rendered on first request and kept on disk
+IMAGE_STORE_ENABLED = os.getenv('IMAGE_STORE_ENABLED', 'true').lower() == 'true'
+image_store = ImageStore(
+    os.getenv('IMAGE_STORE_DIR', os.path.join('cache', 'store')),
+    originals_bytes=int(os.getenv('IMAGE_STORE_ORIGINALS_MB', '1024')) * 1024 * 1024,
+    derivatives_bytes=int(os.getenv('IMAGE_STORE_DERIVATIVES_MB', '256')) * 1024 * 1024,
+) if IMAGE_STORE_ENABLED else None
+IMAGE_STORE_MAX_AGE_SECONDS = int(os.getenv('IMAGE_STORE_MAX_AGE_SECONDS', str(365 * 24 * 3600)))
+
+# Identical concurrent Flux generations share one upstream call
+SINGLEFLIGHT_TIMEOUT_SECONDS = float(os.getenv('SINGLEFLIGHT_TIMEOUT_SECONDS', '90'))
+flux_flight = SingleFlight()
+# Non-blocking Flux client and coalescer, set by asgi.py when serving under ASGI
+async_hf_client = None
+async_flux_flight = None
+
+def register_async_flux(client, flight):
+    """Report the ASGI path's Flux client and coalescer in /health and /metrics"""
+    global async_hf_client, async_flux_flight
+    async_hf_client, async_flux_flight = client, flight
+
+# Background generation jobs (JOB_STORE=memory or sqlite)
+job_runner = JobRunner(
+    create_job_store(
+        os.getenv('JOB_STORE', 'memory'),
+        os.getenv('JOB_SQLITE_PATH', 'jobs.db'),
+        ttl_seconds=int(os.getenv('JOB_TTL_SECONDS', '3600')),
+        lease_seconds=int(os.getenv('JOB_LEASE_SECONDS', '60'))
+    ),
+    max_workers=int(os.getenv('JOB_WORKERS', '4')),
+    max_pending=int(os.getenv('JOB_MAX_PENDING', '100'))
+)
+
+# /test-quality runs its three modes concurrently on a small dedicated pool
+QUALITY_TEST_TIMEOUT_SECONDS = float(os.getenv('QUALITY_TEST_TIMEOUT_SECONDS', '120'))
+quality_test_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('QUALITY_TEST_WORKERS', '3')),
+    thread_name_prefix='quality-test'
+)
+
+# /generate-images/batch: one pool shared by all batches; each batch keeps at most
+# BATCH_CONCURRENCY of its renders in flight
+BATCH_MAX_PROMPTS = int(os.getenv('BATCH_MAX_PROMPTS', '20'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('BATCH_WORKERS', '8')),
+    thread_name_prefix='image-batch'
+)
+
+# Post-processing profiles per quality mode (POSTPROCESS_HIGH etc.); images of at
+# least POSTPROCESS_POOL_MIN_PIXELS are enhanced in a process pool (0 disables it)
+post_processor = PostProcessor(
+    pool_min_pixels=int(os.getenv('POSTPROCESS_POOL_MIN_PIXELS', '0')),
+    pool_workers=int(os.getenv('POSTPROCESS_POOL_WORKERS', '2'))
+)
+
+# Encoder effort for generated images: fast, balanced or max (max runs PNG optimize)
+IMAGE_ENCODER_EFFORT = os.getenv('IMAGE_ENCODER_EFFORT', 'balanced')
+WEBP_QUALITY = int(os.getenv('WEBP_QUALITY', '90'))
+ENCODER_SETTINGS = {
+    "fast": {"png": {"compress_level": 1}, "webp": {"method": 0}},
+    "balanced": {"png": {"compress_level": 6}, "webp": {"method": 4}},
+    "max": {"png": {"compress_level": 9, "optimize": True}, "webp": {"method": 6}},
+}
+IMAGE_STREAM_CHUNK_BYTES = 64 * 1024
+BINARY_IMAGE_FORMATS = {"png": "image/png", "webp": "image/webp"}
+
+# PDF extraction: page ranges are parsed across a process pool for large documents
+pdf_extractor = PDFExtractor(
+    workers=int(os.getenv('PDF_EXTRACT_WORKERS', str(min(4, os.cpu_count() or 1)))),
+    pages_per_chunk=int(os.getenv('PDF_PAGES_PER_CHUNK', '25')),
+    parallel_min_pages=int(os.getenv('PDF_PARALLEL_MIN_PAGES', '40')),
+    max_pages=int(os.getenv('PDF_MAX_PAGES', '500')),
+    max_text_bytes=int(os.getenv('PDF_MAX_TEXT_MB', '20')) * 1024 * 1024
+)
+
+# OCR: preprocessing, strip tiling and the confidence needed to skip the Gemini fallback
+OCR_MIN_CONFIDENCE = float(os.getenv('OCR_MIN_CONFIDENCE', '60'))
+ocr_engine = OCREngine(
+    target_dpi=int(os.getenv('OCR_TARGET_DPI', '300')),
+    binarize=os.getenv('OCR_BINARIZE', 'true').lower() == 'true',
+    tile_height=int(os.getenv('OCR_TILE_HEIGHT', '1600')),
+    tile_overlap=int(os.getenv('OCR_TILE_OVERLAP', '120')),
+    workers=int(os.getenv('OCR_WORKERS', '0')) or None
+)
+
+# Uploaded images are sized from their header first: JPEGs above the budget are decoded
+# at 1/2-1/8 scale, other formats above it are rejected (413), and everything is reduced
+# to about INGEST_MAX_LONG_SIDE before OCR. Gemini vision gets at most VISION_MAX_LONG_SIDE.
+image_ingest = ImageIngest(
+    max_pixels=int(float(os.getenv('INGEST_MAX_MEGAPIXELS', '40')) * 1_000_000),
+    max_long_side=int(os.getenv('INGEST_MAX_LONG_SIDE', '4096'))
+)
+VISION_MAX_LONG_SIDE = int(os.getenv('VISION_MAX_LONG_SIDE', '3072'))
+
+# Extraction results cached by upload SHA-256; bump the versions when extraction changes
+IMAGE_EXTRACTOR_VERSION = "image-v3"
+PDF_EXTRACTOR_VERSION = "pdf-v1"
+PDF_NO_TEXT_ERROR = 'Could not extract text from PDF. It might be scanned or image-based.'
+EXTRACTION_CACHE_ENABLED = os.getenv('EXTRACTION_CACHE_ENABLED', 'true').lower() == 'true'
+extraction_cache = ExtractionCache(
+    os.getenv('EXTRACTION_CACHE_PATH', os.path.join('cache', 'extractions.db')),
+    max_bytes=int(os.getenv('EXTRACTION_CACHE_MB', '256')) * 1024 * 1024,
+    max_age_seconds=int(os.getenv('EXTRACTION_CACHE_MAX_AGE_SECONDS', str(30 * 24 * 3600)))
+) if EXTRACTION_CACHE_ENABLED else None
+
 # Headers for Hugging Face API
 headers = {
     "Authorization": f"Bearer {HF_API_TOKEN}",
     "Content-Type": "application/json"
 }
 
+# Shared keep-alive client for the Flux endpoint
+hf_client = HuggingFaceClient(
+    HF_API_URL, headers,
+    pool_size=int(os.getenv('HF_POOL_SIZE', '10')),
+    max_retries=int(os.getenv('HF_MAX_RETRIES', '3')),
+    backoff_base=float(os.getenv('HF_BACKOFF_BASE_SECONDS', '1.0')),
+    connect_timeout=float(os.getenv('HF_CONNECT_TIMEOUT_SECONDS', '5')),
+    read_timeout=float(os.getenv('HF_READ_TIMEOUT_SECONDS', '60')),
+    latency_budget=float(os.getenv('HF_LATENCY_BUDGET_SECONDS', '90')),
+    on_status=lambda status: record_upstream('flux', status),
+)
+
+# Flux readiness (ready / loading / down) learned from every call; while the model loads
+# requests wait up to FLUX_LOADING_MAX_WAIT_SECONDS or get a 503 without going upstream,
+# and after repeated failures they fail fast for FLUX_OPEN_SECONDS. The optional keeper
+# sends tiny warm requests during FLUX_WARM_ACTIVE_HOURS so idle periods do not unload it.
+FLUX_WARM_KEEPER_ENABLED = os.getenv('FLUX_WARM_KEEPER_ENABLED', 'false').lower() == 'true'
+FLUX_WARM_PAYLOAD = {
+    "inputs": "simple educational icon",
+    "parameters": {"width": 256, "height": 256, "num_inference_steps": 1, "guidance_scale": 0.0}
+}
+flux_monitor = FluxMonitor(
+    probe_fn=lambda: hf_client.probe(FLUX_WARM_PAYLOAD, timeout=float(os.getenv('FLUX_PROBE_TIMEOUT_SECONDS', '30'))),
+    active_hours=os.getenv('FLUX_WARM_ACTIVE_HOURS', ''),
+    probe_interval=float(os.getenv('FLUX_PROBE_INTERVAL_SECONDS', '60')),
+    idle_seconds=float(os.getenv('FLUX_WARM_IDLE_SECONDS', '240')),
+    warm_min_interval=float(os.getenv('FLUX_WARM_MIN_INTERVAL_SECONDS', '300')),
+    warm_max_per_hour=int(os.getenv('FLUX_WARM_MAX_PER_HOUR', '12')),
+    loading_max_wait=float(os.getenv('FLUX_LOADING_MAX_WAIT_SECONDS', '30')),
+    failure_threshold=int(os.getenv('FLUX_FAILURE_THRESHOLD', '3')),
+    open_seconds=float(os.getenv('FLUX_OPEN_SECONDS', '30')),
+)
+
 def enhance_prompt_for_education(prompt):
     """Advanced prompt enhancement for superior educational content"""
     educational_keywords = [
@@ -102,8 +413,8 @@ def enhance_prompt_for_education(prompt):
     
     return clean_prompt
 
-def query_huggingface_flux(prompt, width=800, height=450, quality_mode="high"):
-    """Enhanced Hugging Face Flux query with quality optimizations"""
+def build_flux_payload(prompt, width=800, height=450, quality_mode="high"):
+    """Build the Flux request payload with quality-based parameter optimization"""
     enhanced_prompt = enhance_prompt_for_education(prompt)
     
     # Quality-based parameter optimization
@@ -131,22 +442,224 @@ def query_huggingface_flux(prompt, width=800, height=450, quality_mode="high"):
             "negative_prompt": "blurry, low quality, pixelated, distorted, ugly, bad anatomy, text, watermark, logo, signature",
         }
     }
+    return payload
+
+def flux_cache_key(payload, quality_mode):
+    """Cache key for a Flux payload built by build_flux_payload"""
+    params = payload["parameters"]
+    return make_cache_key(
+        payload["inputs"], params["width"], params["height"],
+        params["num_inference_steps"], params["guidance_scale"], quality_mode
+    )
+
+# Decision steps shared by the sync Flux path below and the async one in asgi.py
+
+def flux_preflight(deadline):
+    """Check the deadline and upstream state before a Flux call; return (error, wait_seconds)"""
+    if deadline.expired():
+        return deadline_error('flux'), 0
+    # Known upstream state first: ride out a short model load, fail fast while it is down
+    action, value = flux_monitor.admit()
+    if action == "reject":
+        return value, 0
+    if action == "wait" and deadline.shorter_than(value):
+        return {"error": "model_loading", "estimated_time": round(value)}, 0
+    return None, value
+
+def flux_admission_error(e, deadline):
+    """Error dict for a Flux call turned away by admission control"""
+    if deadline.expired():
+        return deadline_error('flux queue')
+    return {"error": "overloaded", "message": str(e), "retry_after": e.retry_after}
+
+def flux_outcome(result, elapsed, deadline):
+    """Record a finished Flux call with the upstream monitor and return what the caller sees"""
+    if isinstance(result, dict) and deadline.expired():
+        return deadline_error('flux')  # cut short by us, says nothing about the upstream
+    flux_monitor.record(result, elapsed)
+    return result
+
+def flux_leader_ran_out(result, deadline):
+    """True when a coalesced call failed on the leader's deadline while ours still has time"""
+    return isinstance(result, dict) and result.get('error') == 'deadline_exceeded' and not deadline.expired()
+
+def flux_flight_error(e, deadline):
+    """Error dict for a coalesced wait that ended without a result (DeadlineExceeded or SingleFlightTimeout)"""
+    if isinstance(e, DeadlineExceeded) or deadline.expired():
+        return deadline_error('flux')
+    return {"error": "timeout", "message": str(e)}
+
+def query_huggingface_flux(prompt, width=800, height=450, quality_mode="high", payload=None, deadline=NO_DEADLINE):
+    """Enhanced Hugging Face Flux query with quality optimizations"""
+    if payload is None:
+        payload = build_flux_payload(prompt, width, height, quality_mode)
+    error, wait = flux_preflight(deadline)
+    if error:
+        return error
+    if wait:
+        time.sleep(wait)
+    
+    # Retries, model-loading waits and timeouts are handled by the pooled client,
+    # within whatever is left of the request's deadline
+    try:
+        with admission.slot('flux', timeout=deadline.remaining()):
+            started = time.perf_counter()
+            result = hf_client.generate(payload, budget=deadline.remaining())
+    except AdmissionRejected as e:
+        return flux_admission_error(e, deadline)
+    return flux_outcome(result, time.perf_counter() - started, deadline)
+
+def parse_generation_request(data):
+    """Validate generation settings from a request body; return (settings, error_body)"""
+    if not data or 'prompt' not in data:
+        return None, {
+            "error": "missing_prompt",
+            "message": "Prompt is required"
+        }
+    
+    width = data.get('width', 800)
+    height = data.get('height', 450)
+    quality_mode = data.get('quality_mode', 'high')  # standard, high, ultra
+    
+    # Validate dimensions
+    if width > 1024 or height > 1024 or width < 256 or height < 256:
+        return None, {
+            "error": "invalid_dimensions",
+            "message": "Width and height must be between 256 and 1024 pixels"
+        }
+    
+    # Validate quality mode
+    if quality_mode not in ['standard', 'high', 'ultra']:
+        quality_mode = 'high'
     
+    return {
+        "prompt": data['prompt'],
+        "width": width,
+        "height": height,
+        "quality_mode": quality_mode,
+        "bypass_cache": bool(data.get('bypass_cache', False))
+    }, None
+
+def lookup_rendered_image(cache_key, prompt, quality_mode, bypass_cache=False):
+    """Cached post-processed PNG for cache_key, or None"""
+    if not image_cache:
+        return None
+    if bypass_cache:
+        image_cache.record_bypass()
+        return None
+    with stage('cache_lookup'):
+        cached_png = image_cache.get(cache_key)
+    if cached_png is not None:
+        print(f"Cache hit for {quality_mode} quality image: {prompt}")
+    return cached_png
+
+def finish_render(result, quality_mode, cache_key):
+    """Decode, post-process, encode, cache and store raw Flux bytes; return (png_bytes, False) or an error dict"""
+    # Enhanced image processing
     try:
-        response = requests.post(HF_API_URL, headers=headers, json=payload, timeout=60)
+        # Verify it's a valid image
+        with stage('decode'):
+            image = Image.open(io.BytesIO(result))
+            image.load()
         
-        if response.status_code == 200:
-            return response.content
-        elif response.status_code == 503:
-            # Model is loading
-            return {"error": "model_loading", "estimated_time": 20}
-        else:
-            return {"error": f"API error: {response.status_code}", "details": response.text}
-            
-    except requests.exceptions.Timeout:
-        return {"error": "timeout", "message": "Request timed out"}
+        # Quality enhancement post-processing (per-mode profile; standard is untouched)
+        with stage('postprocess'):
+            image = enhance_image_quality(image, quality_mode)
+        
+        png_bytes = encode_image(image, "png")
     except Exception as e:
-        return {"error": "request_failed", "message": str(e)}
+        return {
+            "error": "image_processing_failed",
+            "message": f"Failed to process generated image: {str(e)}"
+        }
+    
+    if image_cache:
+        with stage('cache_store'):
+            image_cache.put(cache_key, png_bytes)
+    store_image(png_bytes)  # once per render, so coalesced requests find it already stored
+    return png_bytes, False
+
+def render_fresh(prompt, width, height, quality_mode, payload, cache_key, deadline, report):
+    """Query Flux, then post-process, encode, cache and store the image; return (png_bytes, False) or an error dict"""
+    report("generating", 10)
+    with stage('upstream'):
+        result = query_huggingface_flux(prompt, width, height, quality_mode, payload=payload, deadline=deadline)
+    if isinstance(result, dict) and 'error' in result:
+        return result
+    
+    # The upstream call was the expensive part; don't post-process an image nobody waits for
+    if deadline.expired():
+        return deadline_error('post-processing')
+    report("post_processing", 70)
+    return finish_render(result, quality_mode, cache_key)
+
+def render_image(prompt, width=800, height=450, quality_mode="high", bypass_cache=False, progress=None,
+                 deadline=None):
+    """Produce post-processed PNG bytes from the cache or Flux; return (png_bytes, cached) or an error dict"""
+    if deadline is None:
+        deadline = current_deadline()
+    
+    def report(stage, percent):
+        if progress:
+            progress(stage, percent)
+    
+    payload = build_flux_payload(prompt, width, height, quality_mode)
+    flight_key = flux_cache_key(payload, quality_mode)
+    cache_key = flight_key if image_cache else None
+    
+    # Serve repeated topics straight from the cache
+    cached_png = lookup_rendered_image(cache_key, prompt, quality_mode, bypass_cache)
+    if cached_png is not None:
+        return cached_png, True
+    
+    print(f"Generating {quality_mode} quality image for prompt: {prompt}")
+    # Identical concurrent requests share one Flux call and one post-process/encode/store pass
+    query = lambda: render_fresh(prompt, width, height, quality_mode, payload, cache_key, deadline, report)
+    try:
+        result = flux_flight.do(flight_key, query, timeout=deadline.timeout(SINGLEFLIGHT_TIMEOUT_SECONDS, stage='flux'))
+        if flux_leader_ran_out(result, deadline):
+            result = query()  # the shared render ran out of the leader's time, not ours
+        return result
+    except (DeadlineExceeded, SingleFlightTimeout) as e:
+        return flux_flight_error(e, deadline)
+
+def admission_rejected_response(error):
+    """429 with Retry-After for a request turned away by admission control"""
+    response = jsonify({
+        "error": "overloaded",
+        "message": str(error),
+        "lane": error.lane,
+        "retry_after": error.retry_after
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
+def image_error_response(result):
+    """Map a render_image error dict to an HTTP response"""
+    if result['error'] == 'overloaded':
+        response = jsonify(result)
+        response.headers['Retry-After'] = str(result['retry_after'])
+        return response, 429
+    if result['error'] == 'upstream_unavailable':
+        response = jsonify(result)
+        response.headers['Retry-After'] = str(result['retry_after'])
+        return response, 503
+    if result['error'] == 'model_loading':
+        return jsonify({
+            "error": "model_loading",
+            "message": "Model is loading, please try again in a few seconds",
+            "retry_after": result.get('estimated_time', 20)
+        }), 503
+    if result['error'] == 'deadline_exceeded':
+        return jsonify(result), 504
+    return jsonify(result), 500
+
+def flux_stats(sync_source, async_source):
+    """Stats of the sync Flux path, with the ASGI path's under "async" when it is serving"""
+    stats = sync_source.stats()
+    if async_source is not None:
+        stats["async"] = async_source.stats()
+    return stats
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -154,7 +667,18 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "service": "Hugging Face Flux API",
-        "timestamp": time.time()
+        "timestamp": time.time(),
+        "image_cache": image_cache.stats() if image_cache else {"enabled": False},
+        "singleflight": flux_stats(flux_flight, async_flux_flight),
+        "upstream": flux_stats(hf_client, async_hf_client),
+        "flux": flux_monitor.stats(),
+        "extraction_cache": extraction_cache.stats() if extraction_cache else {"enabled": False},
+        "upload_io": upload_io_stats.stats(),
+        "llm": llm.stats(),
+        "admission": admission.stats(),
+        "image_store": image_store.stats() if image_store else {"enabled": False},
+        "image_ingest": image_ingest.stats(),
+        "providers": providers.stats()
     })
 
 @app.route('/generate-image', methods=['POST'])
@@ -162,78 +686,26 @@ def generate_image():
     """Enhanced image generation with quality controls"""
     try:
         data = request.get_json()
+        settings, error = parse_generation_request(data)
+        if error:
+            return jsonify(error), 400
         
-        if not data or 'prompt' not in data:
-            return jsonify({
-                "error": "missing_prompt",
-                "message": "Prompt is required"
-            }), 400
-        
-        prompt = data['prompt']
-        width = data.get('width', 800)
-        height = data.get('height', 450)
-        quality_mode = data.get('quality_mode', 'high')  # standard, high, ultra
-        
-        # Validate dimensions
-        if width > 1024 or height > 1024 or width < 256 or height < 256:
-            return jsonify({
-                "error": "invalid_dimensions",
-                "message": "Width and height must be between 256 and 1024 pixels"
-            }), 400
-        
-        # Validate quality mode
-        if quality_mode not in ['standard', 'high', 'ultra']:
-            quality_mode = 'high'
-        
-        print(f"Generating {quality_mode} quality image for prompt: {prompt}")
+        result = render_image(**settings)
+        if isinstance(result, dict):
+            return image_error_response(result)
         
-        # Query Hugging Face with quality settings
-        result = query_huggingface_flux(prompt, width, height, quality_mode)
+        png_bytes, cached = result
+        binary_format = negotiate_image_format(data)
+        if binary_format:
+            return binary_image_response(
+                png_bytes, binary_format, settings['prompt'], settings['width'],
+                settings['height'], settings['quality_mode'], cached=cached
+            )
+        return jsonify(build_image_response(
+            png_bytes, settings['prompt'], settings['width'], settings['height'],
+            settings['quality_mode'], cached=cached
+        ))
         
-        if isinstance(result, dict) and 'error' in result:
-            # Handle different error types
-            if result['error'] == 'model_loading':
-                return jsonify({
-                    "error": "model_loading",
-                    "message": "Model is loading, please try again in a few seconds",
-                    "retry_after": result.get('estimated_time', 20)
-                }), 503
-            else:
-                return jsonify(result), 500
-        
-        # Enhanced image processing
-        try:
-            # Verify it's a valid image
-            image = Image.open(io.BytesIO(result))
-            
-            # Quality enhancement post-processing
-            if quality_mode in ['high', 'ultra']:
-                # Enhance image quality
-                image = enhance_image_quality(image)
-            
-            # Convert to base64
-            buffered = io.BytesIO()
-            image.save(buffered, format="PNG", quality=95, optimize=True)
-            img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            
-            return jsonify({
-                "success": True,
-                "image": f"data:image/png;base64,{img_base64}",
-                "metadata": {
-                    "model": "FLUX.1-schnell",
-                    "prompt": prompt,
-                    "dimensions": f"{width}x{height}",
-                    "quality_mode": quality_mode,
-                    "timestamp": time.time()
-                }
-            })
-            
-        except Exception as e:
-            return jsonify({
-                "error": "image_processing_failed",
-                "message": f"Failed to process generated image: {str(e)}"
-            }), 500
-            
     except Exception as e:
         print(f"Error in generate_image: {str(e)}")
         return jsonify({
@@ -241,61 +713,371 @@ def generate_image():
             "message": str(e)
         }), 500
 
-def enhance_image_quality(image):
+def encode_image(image, fmt="png"):
+    """Encode a PIL image as PNG or WebP using the configured encoder effort"""
+    settings = ENCODER_SETTINGS.get(IMAGE_ENCODER_EFFORT, ENCODER_SETTINGS["balanced"])
+    buffered = io.BytesIO()
+    with stage(f'encode_{fmt}'):
+        if fmt == "webp":
+            image.save(buffered, format="WEBP", quality=WEBP_QUALITY, **settings["webp"])
+        else:
+            image.save(buffered, format="PNG", **settings["png"])
+    return buffered.getvalue()
+
+def negotiate_image_format(data):
+    """Pick 'png' or 'webp' for a raw binary response, or None to keep the JSON body"""
+    explicit = (data.get('response_format') or request.args.get('format') or '').lower()
+    if explicit in BINARY_IMAGE_FORMATS:
+        return explicit
+    if explicit == 'json':
+        return None
+    
+    # Only switch to binary when the client names an image type explicitly;
+    # a bare */* (what fetch() sends by default) keeps the JSON response
+    accept = request.accept_mimetypes
+    listed = {value for value, _ in accept}
+    best = accept.best_match(['application/json', 'image/png', 'image/webp'], default='application/json')
+    if best in listed and best != 'application/json':
+        return best.split('/')[1]
+    return None
+
+def binary_image_response(png_bytes, fmt, prompt, width, height, quality_mode, cached=False):
+    """Stream raw image bytes with generation metadata in headers"""
+    body = png_bytes if fmt == "png" else encode_image(Image.open(io.BytesIO(png_bytes)), fmt)
+    image_id = store_image(png_bytes)
+    view = memoryview(body)
+    
+    def chunks():
+        for offset in range(0, len(view), IMAGE_STREAM_CHUNK_BYTES):
+            yield view[offset:offset + IMAGE_STREAM_CHUNK_BYTES].tobytes()
+    
+    return Response(
+        chunks(),
+        mimetype=BINARY_IMAGE_FORMATS[fmt],
+        direct_passthrough=True,
+        headers={
+            "Content-Length": str(len(body)),
+            "X-Image-Model": "FLUX.1-schnell",
+            "X-Image-Prompt": quote(prompt),
+            "X-Image-Dimensions": f"{width}x{height}",
+            "X-Image-Quality-Mode": quality_mode,
+            "X-Image-Cached": "true" if cached else "false",
+            "X-Image-Timestamp": str(time.time()),
+            "X-Image-Id": image_id or "",
+            "Vary": "Accept"
+        }
+    )
+
+@app.route('/images/<image_id>/<variant>', methods=['GET'])
+def get_image_variant(image_id, variant):
+    """Serve a stored image or a derivative: thumbnail, medium or full, as ?format=png|webp|jpeg|auto&quality=1-100"""
+    if not image_store:
+        return jsonify({"error": "image_store_disabled", "message": "IMAGE_STORE_ENABLED is false"}), 404
+    
+    fmt = request.args.get('format')
+    vary = None
+    if fmt == 'auto':
+        # Responsive default: WebP where the browser accepts it, JPEG otherwise
+        fmt = 'webp' if 'image/webp' in request.accept_mimetypes else 'jpeg'
+        vary = 'Accept'
+    try:
+        variant, fmt, quality = parse_variant(variant, fmt, request.args.get('quality'))
+    except VariantError as e:
+        return jsonify({"error": "invalid_variant", "message": str(e)}), 400
+    
+    etag = variant_etag(image_id, variant, fmt, quality)
+    headers = {"Cache-Control": f"public, max-age={IMAGE_STORE_MAX_AGE_SECONDS}, immutable"}
+    if vary:
+        headers["Vary"] = vary
+    # Stored bytes never change, so a matching ETag is answered without touching the disk
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+    
+    with stage('derive'):
+        data = image_store.get_variant(image_id, variant, fmt, quality)
+    if data is None:
+        return jsonify({"error": "image_not_found", "message": "Unknown or evicted image id"}), 404
+    
+    response = Response(data, mimetype=VARIANT_FORMATS[fmt], headers=headers)
+    response.set_etag(etag)
+    return response
+
+@app.route('/images/<image_id>', methods=['GET'])
+def get_image(image_id):
+    """Serve a stored image at full size (same options as the variants)"""
+    return get_image_variant(image_id, 'full')
+
+def store_image(png_bytes):
+    """Persist a generated PNG in the image store; return its content id (None if the store is off)"""
+    if not image_store:
+        return None
+    with stage('store'):
+        return image_store.put_original(png_bytes)
+
+def build_image_response(png_bytes, prompt, width, height, quality_mode, cached=False):
+    """JSON body for a generated image as a base64 data URL"""
+    image_id = store_image(png_bytes)
+    with stage('base64'):
+        img_base64 = base64.b64encode(png_bytes).decode('utf-8')
+    body = {
+        "success": True,
+        "image": f"data:image/png;base64,{img_base64}",
+        "metadata": {
+            "model": "FLUX.1-schnell",
+            "prompt": prompt,
+            "dimensions": f"{width}x{height}",
+            "quality_mode": quality_mode,
+            "cached": cached,
+            "timestamp": time.time()
+        }
+    }
+    if image_id:
+        body["metadata"]["image_id"] = image_id
+        body["variants"] = {variant: f"/images/{image_id}/{variant}" for variant in VARIANT_SIZES}
+    return body
+
+def enhance_image_quality(image, quality_mode="high"):
     """Post-process image for enhanced quality"""
     try:
-        from PIL import ImageEnhance, ImageFilter
-        
-        # Enhance sharpness
-        enhancer = ImageEnhance.Sharpness(image)
-        image = enhancer.enhance(1.2)
-        
-        # Enhance contrast slightly
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.1)
-        
-        # Enhance color saturation for educational content
-        enhancer = ImageEnhance.Color(image)
-        image = enhancer.enhance(1.1)
-        
-        return image
+        # Sharpness, contrast and colour applied as one fused pass
+        return post_processor.process(image, quality_mode)
     except Exception as e:
         print(f"Image enhancement failed: {e}")
         return image  # Return original if enhancement fails
 
+def measure_quality_mode(prompt, quality, deadline=NO_DEADLINE):
+    """Generate one quality mode and report wall time, payload size and decode time"""
+    print(f"Testing {quality} quality mode...")
+    started = time.perf_counter()
+    # The mode's timeout starts now, when it runs, not when the request queued it
+    result = query_huggingface_flux(prompt, 800, 450, quality,
+                                    deadline=deadline.within(QUALITY_TEST_TIMEOUT_SECONDS))
+    wall_ms = round((time.perf_counter() - started) * 1000, 1)
+    
+    if isinstance(result, dict) and 'error' in result:
+        error = result['error']
+        if error == 'deadline_exceeded' and not deadline.expired():
+            error = 'timeout'  # its own QUALITY_TEST_TIMEOUT_SECONDS, not the request's deadline
+        return {"error": error, "quality_mode": quality, "wall_time_ms": wall_ms}
+    
+    decode_started = time.perf_counter()
+    image = Image.open(io.BytesIO(result))
+    image.load()
+    decode_ms = round((time.perf_counter() - decode_started) * 1000, 1)
+    
+    return {
+        "success": True,
+        "size_kb": len(result) // 1024 if result else 0,
+        "size_bytes": len(result),
+        "dimensions": f"{image.width}x{image.height}",
+        "quality_mode": quality,
+        "wall_time_ms": wall_ms,
+        "decode_time_ms": decode_ms
+    }
+
 @app.route('/test-quality', methods=['POST'])
 def test_quality_modes():
     """Test endpoint to compare different quality modes"""
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         prompt = data.get('prompt', 'educational diagram of photosynthesis')
         
-        results = {}
+        # Dispatch all modes at once; a slow or failing mode only affects its own entry
+        started = time.perf_counter()
+        deadline = current_deadline()
+        futures = {
+            quality: quality_test_executor.submit(measure_quality_mode, prompt, quality, deadline)
+            for quality in ['standard', 'high', 'ultra']
+        }
+        # Each mode times itself out once running, so only the request deadline bounds this
+        # wait; modes still queued behind other requests' modes are not cut short early
+        wait(futures.values(), timeout=deadline.remaining())
         
-        for quality in ['standard', 'high', 'ultra']:
-            print(f"Testing {quality} quality mode...")
-            
-            result = query_huggingface_flux(prompt, 800, 450, quality)
-            
-            if isinstance(result, dict) and 'error' in result:
-                results[quality] = {"error": result['error']}
+        results = {}
+        for quality, future in futures.items():
+            if not future.done():
+                future.cancel()
+                results[quality] = {"error": "timeout", "quality_mode": quality}
+            elif future.exception() is not None:
+                results[quality] = {"error": str(future.exception()), "quality_mode": quality}
             else:
-                # Just return metadata for comparison
-                results[quality] = {
-                    "success": True,
-                    "size_kb": len(result) // 1024 if result else 0,
-                    "quality_mode": quality
-                }
+                results[quality] = future.result()
         
         return jsonify({
             "prompt": prompt,
             "quality_comparison": results,
+            "total_time_ms": round((time.perf_counter() - started) * 1000, 1),
             "recommendation": "Use 'high' for best balance of quality and speed"
         })
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def parse_batch_request(data):
+    """Validate a batch body; return (unique prompts with their input indexes, shared settings, error_body)"""
+    prompts = (data or {}).get('prompts')
+    if not isinstance(prompts, list) or not prompts:
+        return None, None, {"error": "missing_prompts", "message": "prompts must be a non-empty list"}
+    if len(prompts) > BATCH_MAX_PROMPTS:
+        return None, None, {
+            "error": "too_many_prompts",
+            "message": f"At most {BATCH_MAX_PROMPTS} prompts per batch"
+        }
+    
+    settings, error = parse_generation_request({**data, 'prompt': None})
+    if error:
+        return None, None, error
+    del settings['prompt']
+    
+    # Identical prompts (ignoring surrounding/repeated whitespace) are generated once
+    unique = {}
+    for index, prompt in enumerate(prompts):
+        if not isinstance(prompt, str) or not prompt.strip():
+            return None, None, {"error": "invalid_prompt", "message": f"Prompt {index} must be a non-empty string"}
+        key = ' '.join(prompt.split())
+        unique.setdefault(key, []).append(index)
+    return list(unique.items()), settings, None
+
+def batch_deadline(header_value, unique_prompts):
+    """Deadline for a batch: REQUEST_TIMEOUT_SECONDS per wave of BATCH_CONCURRENCY renders, capped at the max"""
+    waves = math.ceil(unique_prompts / max(1, BATCH_CONCURRENCY))
+    return deadline_from_header(header_value, REQUEST_TIMEOUT_SECONDS * waves, REQUEST_TIMEOUT_MAX_SECONDS)
+
+def render_batch_item(prompt, settings, deadline=NO_DEADLINE):
+    """Render one batch prompt; return the per-item result body (never raises)"""
+    started = time.perf_counter()
+    try:
+        result = render_image(prompt, deadline=deadline, **settings)
+        if isinstance(result, dict):
+            item = {"success": False, **result}
+        else:
+            png_bytes, cached = result
+            item = build_image_response(
+                png_bytes, prompt, settings['width'], settings['height'], settings['quality_mode'], cached=cached
+            )
+    except Exception as e:
+        item = {"success": False, "error": "internal_server_error", "message": str(e)}
+    item['ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return item
+
+def stream_batch_images(unique, settings, total, deadline=NO_DEADLINE):
+    """Yield NDJSON lines: meta, one image line per unique prompt as it completes, then a summary.
+
+    Only BATCH_CONCURRENCY renders are submitted at a time, so a client that disconnects
+    stops the rest of the batch; renders already running still finish into the cache.
+    Prompts not yet started when the deadline passes are reported as deadline_exceeded.
+    """
+    started = time.perf_counter()
+    yield json.dumps({'type': 'meta', 'prompts': total, 'unique': len(unique)}) + "\n"
+    
+    pending = iter(unique)
+    running = {}
+    succeeded = failed = 0
+    
+    def submit_next():
+        for prompt, indexes in pending:
+            running[batch_executor.submit(render_batch_item, prompt, settings, deadline)] = (prompt, indexes)
+            return
+    
+    for _ in range(max(1, BATCH_CONCURRENCY)):
+        submit_next()
+    while running:
+        if deadline.expired():
+            break
+        done, _ = wait(running, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+        for future in done:
+            prompt, indexes = running.pop(future)
+            item = future.result()
+            if item['success']:
+                succeeded += len(indexes)
+            else:
+                failed += len(indexes)
+            yield json.dumps({'type': 'image', 'indexes': indexes, 'prompt': prompt, **item}) + "\n"
+            submit_next()
+    
+    # Deadline passed: in-flight renders give up on their own; the rest are never started
+    for prompt, indexes in [*running.values(), *pending]:
+        failed += len(indexes)
+        yield json.dumps({'type': 'image', 'indexes': indexes, 'prompt': prompt, 'success': False,
+                          **deadline_error('batch')}) + "\n"
+    
+    yield json.dumps({
+        'type': 'summary',
+        'prompts': total,
+        'unique': len(unique),
+        'succeeded': succeeded,
+        'failed': failed,
+        'totalMs': round((time.perf_counter() - started) * 1000, 1)
+    }) + "\n"
+
+@app.route('/generate-images/batch', methods=['POST'])
+def generate_images_batch():
+    """Generate one image per prompt with shared settings, streamed back as NDJSON"""
+    try:
+        data = request.get_json(silent=True)
+        unique, settings, error = parse_batch_request(data)
+        if error:
+            return jsonify(error), 400
+        
+        # Refuse the whole batch with a real 429 while the Flux lane is visibly full
+        admission.check('flux')
+        deadline = batch_deadline(request.headers.get('X-Request-Timeout'), len(unique))
+        return ndjson_response(stream_batch_images(unique, settings, len(data['prompts']), deadline))
+    
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+    except Exception as e:
+        print(f"Error in generate_images_batch: {str(e)}")
+        return jsonify({"error": "internal_server_error", "message": str(e)}), 500
+
+def admission_points(field):
+    return [({"lane": lane}, stats[field]) for lane, stats in admission.stats().items() if isinstance(stats, dict)]
+
+def cache_points():
+    points = []
+    if image_cache:
+        stats = image_cache.stats()
+        points += [({"cache": "image", "result": "hit"}, stats["memory_hits"] + stats["disk_hits"]),
+                   ({"cache": "image", "result": "miss"}, stats["misses"])]
+    if extraction_cache:
+        stats = extraction_cache.stats()
+        points += [({"cache": "extraction", "result": "hit"}, stats["hits"]),
+                   ({"cache": "extraction", "result": "miss"}, stats["misses"])]
+    if llm.cache:
+        stats = llm.cache.stats()
+        points += [({"cache": "llm", "result": "hit"}, stats["hits"] + stats["persistent_hits"]),
+                   ({"cache": "llm", "result": "miss"}, stats["misses"])]
+    return points
+
+metrics.gauge('admission_in_flight', 'Calls holding an admission slot', ('lane',),
+              lambda: admission_points('in_flight'))
+metrics.gauge('admission_queued', 'Callers waiting for an admission slot', ('lane',),
+              lambda: admission_points('queued'))
+metrics.gauge('admission_wait_p95_seconds', 'p95 wait for an admission slot over recent calls', ('lane',),
+              lambda: [(labels, wait['p95'] / 1000) for labels, wait in admission_points('wait_ms')])
+metrics.callback_counter('admission_rejected_total', 'Calls turned away by admission control', ('lane', 'reason'),
+                         lambda: [({"lane": lane, "reason": reason}, stats[f"rejected_{reason}"])
+                                  for lane, stats in admission.stats().items() if isinstance(stats, dict)
+                                  for reason in ("queue_full", "timeout")])
+metrics.callback_counter('cache_lookups_total', 'Cache lookups by cache and result', ('cache', 'result'), cache_points)
+metrics.callback_counter('singleflight_coalesced_total', 'Flux requests that joined an identical in-flight call', (),
+                         lambda: [({}, flux_flight.stats()["coalesced"] +
+                                    (async_flux_flight.stats()["coalesced"] if async_flux_flight else 0))])
+metrics.gauge('flux_upstream_state', 'Current Flux upstream state (1 for the active state)', ('state',),
+              lambda: [({"state": state}, int(flux_monitor.state == state))
+                       for state in ("unknown", "ready", "loading", "down")])
+metrics.gauge('jobs_pending', 'Queued or running async jobs', (),
+              lambda: [({}, job_runner.store.count_pending())])
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text-format metrics"""
+    if not METRICS_ENABLED:
+        return jsonify({"error": "metrics_disabled"}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/models', methods=['GET'])
 def list_models():
     """List available models with enhanced capabilities"""
@@ -308,6 +1090,7 @@ def list_models():
                 "max_resolution": "1024x1024",
                 "supported_formats": ["PNG", "JPEG"],
                 "quality_modes": ["standard", "high", "ultra"],
+                "status": flux_monitor.summary(),
                 "features": [
                     "Educational prompt enhancement",
                     "Negative prompt filtering",
@@ -319,7 +1102,7 @@ def list_models():
         ],
         "enhancements": {
             "prompt_engineering": "Advanced educational keywords and quality enhancers",
-            "post_processing": "Sharpness, contrast, and color enhancement",
+            "post_processing": "Fused sharpness, contrast, and color enhancement",
             "quality_modes": {
                 "standard": "20 steps, 3.5 guidance, 800x450",
                 "high": "25 steps, 5.0 guidance, 1000x562", 
@@ -329,28 +1112,109 @@ def list_models():
     })
 
 # ============================================
-# IMAGE ANALYSIS ENDPOINTS
+# ASYNC JOB ENDPOINTS
 # ============================================
 
-def extract_text_from_image(image_path):
-    """Extract text from image or describe image content using AI."""
+def run_generation_job(settings, progress):
+    """Job handler: render an image and return the same body as /generate-image"""
+    result = render_image(progress=progress, **settings)
+    if isinstance(result, dict):
+        return result
+    png_bytes, cached = result
+    return build_image_response(
+        png_bytes, settings['prompt'], settings['width'], settings['height'],
+        settings['quality_mode'], cached=cached
+    )
+
+@app.route('/jobs/generate-image', methods=['POST'])
+def create_generation_job():
+    """Queue an image generation and return its job id immediately"""
     try:
-        # Try Tesseract first if available
-        if TESSERACT_AVAILABLE:
-            try:
-                img = Image.open(image_path)
-                text = pytesseract.image_to_string(img)
-                if text.strip():
-                    return text.strip()
-            except Exception:
-                pass
+        settings, error = parse_generation_request(request.get_json())
+        if error:
+            return jsonify(error), 400
+        
+        job = job_runner.submit('generate-image', settings, run_generation_job)
+        return jsonify({
+            "job_id": job["id"],
+            "status": job["status"],
+            "status_url": f"/jobs/{job['id']}",
+            "events_url": f"/jobs/{job['id']}/events"
+        }), 202
+        
+    except JobQueueFull as e:
+        response = jsonify({"error": "queue_full", "message": str(e), "retry_after": e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    except Exception as e:
+        print(f"Error in create_generation_job: {str(e)}")
+        return jsonify({"error": "internal_server_error", "message": str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Poll a job for its status, progress and result"""
+    job = job_runner.store.get(job_id)
+    if job is None:
+        return jsonify({"error": "job_not_found", "message": "Unknown or expired job id"}), 404
+    return jsonify(public_job(job))
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """Server-sent events stream of job progress, ending with the result or error"""
+    if job_runner.store.get(job_id) is None:
+        return jsonify({"error": "job_not_found", "message": "Unknown or expired job id"}), 404
+    
+    poll_interval = float(os.getenv('JOB_EVENTS_POLL_SECONDS', '0.5'))
+    
+    def events():
+        last_seen = None
+        while True:
+            job = job_runner.store.get(job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'job_not_found'})}\n\n"
+                return
+            if job["status"] == "completed":
+                yield f"event: result\ndata: {json.dumps(public_job(job))}\n\n"
+                return
+            if job["status"] == "failed":
+                yield f"event: error\ndata: {json.dumps(public_job(job))}\n\n"
+                return
+            snapshot = (job["status"], job["stage"], job["progress"])
+            if snapshot != last_seen:
+                last_seen = snapshot
+                progress = {"id": job_id, "status": job["status"], "stage": job["stage"], "progress": job["progress"]}
+                yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+            else:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+            time.sleep(poll_interval)
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
-        # Use Gemini Vision for image analysis
-        if GEMINI_API_KEY and GEMINI_API_KEY != 'your_gemini_api_key_here':
-            model = genai.GenerativeModel('gemini-2.0-flash-exp')
-            img = Image.open(image_path)
+# ============================================
+# IMAGE ANALYSIS ENDPOINTS
+# ============================================
+
+IMAGE_EXTRACTION_ERROR_PREFIXES = ("Error analyzing image", "Could not analyze image")
+
+
+def image_extractor_version():
+    """Cache version for image results; depends on which backends produced the text"""
+    ocr = "tesseract" if TESSERACT_AVAILABLE else "no-ocr"
+    ai = f"{llm.backend.name}:{GEMINI_MODEL}" if llm.available else "no-ai"
+    return f"{IMAGE_EXTRACTOR_VERSION}:{ocr}:{ai}:long={image_ingest.max_long_side}"
 
-            prompt = """Analyze this image carefully.
+
+def is_extraction_error(text):
+    """True for the fallback messages extract_text_from_image returns on failure"""
+    return text.startswith(IMAGE_EXTRACTION_ERROR_PREFIXES)
+
+
+IMAGE_ANALYSIS_PROMPT = """Analyze this image carefully.
 
 If there is TEXT in the image:
 - Extract all text exactly as shown
@@ -366,25 +1230,64 @@ If there is NO TEXT or very little text:
 
 Be thorough and descriptive."""
 
-            response = model.generate_content([prompt, img])
-            return response.text.strip()
-
-        return "Could not analyze image - No AI service available"
-    except Exception as e:
-        return f"Error analyzing image: {str(e)}"
 
+def extract_text_from_image(image, deadline=NO_DEADLINE):
+    """Extract text from a decoded image or describe its content using AI.
 
-def analyze_with_ai(content, prompt=None):
-    """Analyze content using Gemini AI."""
+    Returns (text, degraded). degraded is True when the answer is low-confidence OCR
+    that the AI fallback should have replaced; such results must not be cached.
+    """
+    ocr_text = ""
     try:
-        if not GEMINI_API_KEY or GEMINI_API_KEY == 'your_gemini_api_key_here':
-            return "Error: GEMINI_API_KEY not configured. Please add your Gemini API key to backend/.env file. Get key from: https://makersuite.google.com/app/apikey"
+        ai_available = llm.available
 
-        model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        # Try Tesseract first if available
+        if TESSERACT_AVAILABLE:
+            try:
+                with admission.slot('tesseract', timeout=deadline.remaining()), stage('ocr'):
+                    result = ocr_engine.recognize(image, timeout=deadline.timeout(stage='ocr'))
+                ocr_text = result['text'].strip()
+                print(f"🔎 OCR: {result['words']} words, confidence {result['confidence']}, "
+                      f"{result['tiles']} tile(s), {result['elapsed_ms']} ms")
+                # Confident OCR makes the (slow) AI fallback unnecessary
+                if ocr_text and (result['confidence'] >= OCR_MIN_CONFIDENCE or not ai_available):
+                    return ocr_text, False
+                # ...and so does a deadline that leaves no room for it
+                if ocr_text and deadline.shorter_than(OCR_FALLBACK_MIN_SECONDS):
+                    print("⏱️  Skipping AI vision fallback: request deadline is close")
+                    return ocr_text, True
+            except AdmissionRejected:
+                if deadline.expired():
+                    raise DeadlineExceeded('ocr queue')
+                raise
+            except Exception:
+                pass
+
+        # Use Gemini Vision for image analysis
+        if ai_available:
+            with stage('ai_vision'):
+                text = llm.generate([IMAGE_ANALYSIS_PROMPT, fit(image, VISION_MAX_LONG_SIDE)], deadline=deadline)
+            return text, False
+
+        return "Could not analyze image - No AI service available", False
+    except AdmissionRejected:
+        raise
+    except DeadlineExceeded:
+        if ocr_text:
+            return ocr_text, True
+        raise
+    except Exception as e:
+        if ocr_text:
+            # Low-confidence OCR still beats an error message, but only for this request
+            return ocr_text, True
+        return f"Error analyzing image: {str(e)}", False
 
-        if prompt:
-            # User provided custom prompt
-            full_prompt = f"""{prompt}
+
+def build_analysis_prompt(content, prompt=None):
+    """Assemble the full analysis prompt for content and an optional user prompt."""
+    if prompt:
+        # User provided custom prompt
+        return f"""{prompt}
 
 Content:
 {content}
@@ -399,9 +1302,9 @@ IMPORTANT: Write in natural, conversational language.
 - Give complete, accurate answers
 
 Make it easy to read and understand."""
-        else:
-            # Auto-generate intelligent analysis
-            full_prompt = f"""Analyze this content and provide a helpful response.
+
+    # Auto-generate intelligent analysis
+    return f"""Analyze this content and provide a helpful response.
 
 Content:
 {content}
@@ -435,13 +1338,130 @@ Suggest helpful next steps or insights.
 
 Write everything in clear, natural language that's easy to understand."""
 
-        response = model.generate_content(full_prompt)
-        return response.text.strip()
 
+def analyze_with_ai(content, prompt=None, deadline=None):
+    """Analyze content using Gemini AI."""
+    try:
+        if not llm.available:
+            return "Error: GEMINI_API_KEY not configured. Please add your Gemini API key to backend/.env file. Get key from: https://makersuite.google.com/app/apikey"
+
+        return llm.generate(build_analysis_prompt(content, prompt), deadline=deadline)
+
+    except (AdmissionRejected, DeadlineExceeded):
+        raise
     except Exception as e:
         return f"Error analyzing content: {str(e)}"
 
 
+def use_chunked_analysis(content, mode):
+    """Map-reduce for mode='chunked', or automatically for content above the token threshold"""
+    if mode in ('chunked', 'single'):
+        return mode == 'chunked'
+    return bool(ANALYSIS_AUTO_CHUNK_TOKENS) and estimate_tokens(content) > ANALYSIS_AUTO_CHUNK_TOKENS
+
+
+def analyze_chunked(content, prompt=None, deadline=None):
+    """Map-reduce analysis of long content; returns (result text, chunk statistics or None)"""
+    try:
+        if not llm.available:
+            return "Error: GEMINI_API_KEY not configured. Please add your Gemini API key to backend/.env file. Get key from: https://makersuite.google.com/app/apikey", None
+
+        outcome = chunked_analyzer.analyze(content, prompt, deadline)
+        return outcome['result'], {
+            'chunks': outcome['chunks'],
+            'mapMs': outcome['map_ms'],
+            'reduceMs': outcome['reduce_ms'],
+        }
+
+    except (AdmissionRejected, DeadlineExceeded):
+        raise
+    except Exception as e:
+        return f"Error analyzing content: {str(e)}", None
+
+
+def stream_analysis_events(content, prompt, fmt, chunked=False, deadline=None):
+    """Forward analysis chunks as they arrive (SSE or NDJSON), ending with timing metrics.
+
+    When the client disconnects the WSGI server closes this generator, which closes
+    the LLM stream and cancels the upstream generation; the same happens when the
+    request deadline passes mid-stream.
+    """
+    def encode(kind, payload):
+        if fmt == 'sse':
+            return f"event: {kind}\ndata: {json.dumps(payload)}\n\n"
+        return json.dumps({'type': kind, **payload}) + "\n"
+
+    if not llm.available:
+        yield encode('error', {'error': "GEMINI_API_KEY not configured. Please add your Gemini API key to backend/.env file. Get key from: https://makersuite.google.com/app/apikey"})
+        return
+
+    timings = {}
+    chars = 0
+    full_prompt = build_analysis_prompt(content, prompt)
+    if chunked:
+        # Map step: report each section as it is summarised, then stream the reduce step
+        try:
+            sections = chunked_analyzer.split(content)
+            summaries = [None] * len(sections)
+            done = 0
+            for index, summary, ms in chunked_analyzer.map_chunks(sections, deadline):
+                summaries[index] = summary
+                done += 1
+                yield encode('progress', {'chunk': index + 1, 'done': done, 'chunks': len(sections), 'ms': ms})
+            full_prompt = chunked_analyzer.reduce_prompt(summaries, prompt, deadline)
+        except AdmissionRejected as e:
+            yield encode('error', {'error': 'overloaded', 'message': str(e), 'retryAfter': e.retry_after})
+            return
+        except DeadlineExceeded as e:
+            yield encode('error', {'error': 'deadline_exceeded', 'message': str(e)})
+            return
+        except Exception as e:
+            yield encode('error', {'error': f"Error analyzing content: {str(e)}"})
+            return
+
+    chunks = llm.stream(full_prompt, timings=timings, deadline=deadline)
+    try:
+        for chunk in chunks:
+            chars += len(chunk)
+            yield encode('chunk', {'text': chunk})
+    except AdmissionRejected as e:
+        yield encode('error', {'error': 'overloaded', 'message': str(e), 'retryAfter': e.retry_after})
+        return
+    except DeadlineExceeded as e:
+        yield encode('error', {'error': 'deadline_exceeded', 'message': str(e)})
+        return
+    except Exception as e:
+        yield encode('error', {'error': f"Error analyzing content: {str(e)}"})
+        return
+    finally:
+        chunks.close()
+
+    if not timings.get('cached'):
+        observe_stage('ttft', timings['ttft_ms'] / 1000 if 'ttft_ms' in timings else None)
+        observe_stage('stream_total', timings['total_ms'] / 1000)
+    yield encode('done', {
+        'ttftMs': timings.get('ttft_ms'),
+        'totalMs': timings.get('total_ms'),
+        'chars': chars,
+        'cached': timings.get('cached', False),
+    })
+
+
+def analysis_stream_format(data):
+    """'sse' or 'ndjson' when the client asked for a streamed analysis, else None"""
+    best = request.accept_mimetypes.best
+    if best == 'text/event-stream':
+        return 'sse'
+    if best == 'application/x-ndjson':
+        return 'ndjson'
+    flag = str(data.get('stream') or request.args.get('stream') or '').lower()
+    if flag == 'sse':
+        return 'sse'
+    if flag in ('1', 'true', 'yes', 'ndjson'):
+        return 'ndjson'
+    return None
+
+
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     """Handle file upload and text extraction."""
@@ -453,32 +1473,66 @@ def upload_file():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
 
-        # Save file
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-
-        # Detect file type and extract text
         ext = filename.lower().split('.')[-1]
-        extracted_text = ""
-
-        if ext in ['jpg', 'jpeg', 'png', 'bmp', 'gif', 'webp']:
-            extracted_text = extract_text_from_image(filepath)
-        else:
-            os.remove(filepath)
+        if ext not in ['jpg', 'jpeg', 'png', 'bmp', 'gif', 'webp']:
             return jsonify({'error': 'Unsupported file type. Please upload an image.'}), 400
 
-        # Clean up file
-        os.remove(filepath)
+        upload_io_stats.record('upload_file', [file.stream])
+
+        # Re-uploaded images are answered from the cache without saving or OCR
+        with stage('hash'):
+            file_hash = hash_stream(file.stream) if extraction_cache else None
+        version = image_extractor_version()
+        with stage('cache_lookup'):
+            cached = extraction_cache.get(file_hash, version) if file_hash else None
+
+        image_info = None  # decode report; None for cached results
+        degraded = False
+        if cached is not None:
+            extracted_text = cached['text']
+        else:
+            # Read from the upload buffer (memory-mapped if it spilled to disk)
+            source = upload_source(file.stream)
+            try:
+                # Decoded once within the pixel budget; OCR and vision share the result
+                with stage('decode'):
+                    image, image_info = image_ingest.load(source)
+                if METRICS_ENABLED:
+                    decode_memory.observe(image_info['decodeMb'], endpoint='upload_file')
+                with stage('extract'):
+                    extracted_text, degraded = extract_text_from_image(image, current_deadline())
+            finally:
+                release_source(source)
+
+            # Degraded answers (OCR kept because the AI fallback was skipped or failed)
+            # would otherwise be served for every later upload of the same file
+            if file_hash and not degraded and not is_extraction_error(extracted_text):
+                extraction_cache.put(file_hash, version, {
+                    'text': extracted_text,
+                    'pages': 1,
+                    'wordCount': len(extracted_text.split())
+                })
 
         return jsonify({
             'success': True,
             'filename': filename,
             'fileType': ext,
             'extractedText': extracted_text[:500],  # Preview
-            'fullText': extracted_text
+            'fullText': extracted_text,
+            'cached': cached is not None,
+            'degraded': degraded,
+            'image': image_info
         })
 
+    except ImageTooLarge as e:
+        return jsonify({'error': 'image_too_large', 'message': str(e)}), 413
+    except UnidentifiedImageError:
+        return jsonify({'error': 'Could not read image. The file may be corrupt.'}), 400
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+    except DeadlineExceeded as e:
+        return deadline_exceeded_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -494,20 +1548,170 @@ def analyze_content():
         if not content:
             return jsonify({'error': 'No content provided'}), 400
 
-        result = analyze_with_ai(content, prompt)
+        chunked = use_chunked_analysis(content, data.get('mode'))
+        fmt = analysis_stream_format(data)
+        deadline = current_deadline()
+        if fmt:
+            # Turn streams away with a real 429 while the lane is visibly full
+            admission.check('gemini_text')
+        if fmt == 'sse':
+            return Response(stream_with_context(stream_analysis_events(content, prompt, fmt, chunked, deadline)),
+                            mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        if fmt == 'ndjson':
+            return ndjson_response(stream_analysis_events(content, prompt, fmt, chunked, deadline))
+
+        if chunked:
+            result, chunk_stats = analyze_chunked(content, prompt, deadline)
+            if chunk_stats:
+                observe_stage('map', chunk_stats['mapMs'] / 1000)
+                observe_stage('reduce', chunk_stats['reduceMs'] / 1000)
+            return jsonify({
+                'success': True,
+                'result': result,
+                'chunked': chunk_stats
+            })
+
+        with stage('llm'):
+            result = analyze_with_ai(content, prompt, deadline)
 
         return jsonify({
             'success': True,
             'result': result
         })
 
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+    except DeadlineExceeded as e:
+        return deadline_exceeded_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def wants_ndjson():
+    """True when the client asked for a streamed NDJSON response"""
+    flag = (request.args.get('stream') or request.form.get('stream') or '').lower()
+    if flag in ('1', 'true', 'yes'):
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def pdf_extractor_version():
+    """Cache version for PDF results; budget settings change what gets extracted"""
+    return f"{PDF_EXTRACTOR_VERSION}:pages={pdf_extractor.max_pages}:bytes={pdf_extractor.max_text_bytes}"
+
+
+def new_pdf_record(num_pages):
+    """Cacheable PDF extraction result: non-empty page texts plus statistics"""
+    return {'pages': num_pages, 'pagesProcessed': 0, 'truncated': None,
+            'pageTexts': [], 'wordCount': 0, 'charCount': 0}
+
+
+def add_pdf_page(record, item):
+    """Fold one extracted page into a record; return False if it carried an error"""
+    record['pagesProcessed'] += 1
+    observe_stage('page', item['ms'] / 1000)
+    if item['error']:
+        print(f"⚠️  Error extracting page {item['page']}: {item['error']}")
+        return False
+    text = item['text']
+    if text.strip():
+        record['pageTexts'].append([item['page'], text])
+        record['wordCount'] += len(text.split())
+        record['charCount'] += len(text) + 2  # pages are joined with a blank line
+    return True
+
+
+def cache_pdf_record(file_hash, record):
+    # An extraction cut short by the request deadline is not the document's full text
+    if extraction_cache and file_hash and record['wordCount'] and record['truncated'] != 'deadline':
+        extraction_cache.put(file_hash, pdf_extractor_version(), record)
+
+
+def pdf_json_response(filename, record, cached=False, timing=None):
+    """JSON body for /api/extract-pdf built from an extraction record"""
+    extracted_text = "".join(f"{text}\n\n" for _, text in record['pageTexts'])
+    if not extracted_text.strip():
+        return jsonify({'error': PDF_NO_TEXT_ERROR}), 400
+    
+    print(f"✅ Extracted {record['wordCount']} words from {record['pages']} pages")
+    
+    body = {
+        'success': True,
+        'text': extracted_text.strip(),
+        'pages': record['pages'],
+        'pagesProcessed': record['pagesProcessed'],
+        'truncated': record['truncated'],
+        'filename': filename,
+        'wordCount': record['wordCount'],
+        'charCount': record['charCount'],
+        'preview': extracted_text[:1000] + '...' if len(extracted_text) > 1000 else extracted_text,
+        'cached': cached
+    }
+    if timing:
+        body['timing'] = timing
+    return jsonify(body)
+
+
+def pdf_summary_line(record, started, cached=False):
+    summary = {
+        'type': 'summary',
+        'success': record['wordCount'] > 0,
+        'pages': record['pages'],
+        'pagesProcessed': record['pagesProcessed'],
+        'truncated': record['truncated'],
+        'wordCount': record['wordCount'],
+        'charCount': record['charCount'],
+        'cached': cached,
+        'totalMs': round((time.perf_counter() - started) * 1000, 1)
+    }
+    if not record['wordCount']:
+        summary['error'] = PDF_NO_TEXT_ERROR
+    return json.dumps(summary) + "\n"
+
+
+def stream_pdf_pages(source, filename, num_pages, file_hash=None, upload=None, deadline=None):
+    """Yield NDJSON lines: meta, one line per page as it is parsed, then a summary"""
+    started = time.perf_counter()
+    record = new_pdf_record(num_pages)
+    try:
+        yield json.dumps({'type': 'meta', 'filename': filename, 'pages': num_pages}) + "\n"
+        for item in pdf_extractor.iter_pages(source, num_pages, deadline):
+            if 'budget_exceeded' in item:
+                record['truncated'] = item['budget_exceeded']
+                break
+            if not add_pdf_page(record, item):
+                yield json.dumps({'type': 'page_error', 'page': item['page'], 'error': item['error'], 'ms': item['ms']}) + "\n"
+                continue
+            yield json.dumps({'type': 'page', 'page': item['page'], 'text': item['text'], 'ms': item['ms']}) + "\n"
+
+        cache_pdf_record(file_hash, record)
+        yield pdf_summary_line(record, started)
+    except Exception as e:
+        print(f"❌ PDF extraction error: {str(e)}")
+        yield json.dumps({'type': 'error', 'error': f'PDF extraction failed: {str(e)}'}) + "\n"
+    finally:
+        if upload is not None:
+            upload.close()
+
+
+def stream_cached_pdf(filename, record):
+    """Replay a cached extraction in the same NDJSON format"""
+    started = time.perf_counter()
+    yield json.dumps({'type': 'meta', 'filename': filename, 'pages': record['pages'], 'cached': True}) + "\n"
+    for page, text in record['pageTexts']:
+        yield json.dumps({'type': 'page', 'page': page, 'text': text, 'ms': 0}) + "\n"
+    yield pdf_summary_line(record, started, cached=True)
+
+
+def ndjson_response(stream):
+    return Response(stream_with_context(stream), mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no'})
+
+
 @app.route('/api/extract-pdf', methods=['POST'])
 def extract_pdf_text():
-    """Extract text from PDF file - handles large PDFs up to 500 pages."""
+    """Extract text from PDF file - handles large PDFs up to 500 pages (PDF_MAX_PAGES)."""
     try:
         if not PDF_AVAILABLE:
             return jsonify({'error': 'PyPDF2 not installed. Install with: pip install PyPDF2'}), 500
@@ -522,59 +1726,75 @@ def extract_pdf_text():
         if not file.filename.lower().endswith('.pdf'):
             return jsonify({'error': 'File must be a PDF'}), 400
 
-        # Save file temporarily
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-
-        # Extract text from PDF
-        extracted_text = ""
-        page_texts = []
-        
-        with open(filepath, 'rb') as pdf_file:
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            num_pages = len(pdf_reader.pages)
-            
+        stream_response = wants_ndjson()
+        upload_io_stats.record('extract_pdf_text', [file.stream])
+
+        # Re-uploaded handouts are answered from the cache without touching disk
+        with stage('hash'):
+            file_hash = hash_stream(file.stream) if extraction_cache else None
+        if file_hash:
+            with stage('cache_lookup'):
+                record = extraction_cache.get(file_hash, pdf_extractor_version())
+            if record is not None:
+                print(f"📄 Cache hit for PDF: {filename} ({record['pages']} pages)")
+                if stream_response:
+                    return ndjson_response(stream_cached_pdf(filename, record))
+                return pdf_json_response(filename, record, cached=True)
+
+        # Parse straight from the upload buffer; spilled files are shared with the
+        # process pool by their temp path
+        source = getattr(file.stream, 'path', None) or file.stream
+
+        # PDF parsing slot; a streamed response keeps it until the response is closed.
+        # Pages not parsed by the deadline are left out and reported as truncated='deadline'
+        deadline = current_deadline()
+        try:
+            token = admission.acquire('pdf', timeout=deadline.remaining())
+        except AdmissionRejected:
+            if deadline.expired():
+                raise DeadlineExceeded('pdf queue')  # our time ran out, not the lane's capacity
+            raise
+        release_with_response = False
+        try:
+            with stage('count_pages'):
+                num_pages = count_pages(source)
             print(f"📄 Processing PDF: {filename} ({num_pages} pages)")
-            
-            # Process all pages (no limit)
-            for page_num in range(num_pages):
-                try:
-                    page = pdf_reader.pages[page_num]
-                    page_text = page.extract_text()
-                    if page_text.strip():
-                        page_texts.append(f"--- Page {page_num + 1} ---\n{page_text}")
-                        extracted_text += page_text + "\n\n"
-                except Exception as page_error:
-                    print(f"⚠️  Error extracting page {page_num + 1}: {str(page_error)}")
-                    continue
-
-        # Clean up file
-        os.remove(filepath)
-
-        if not extracted_text.strip():
-            return jsonify({'error': 'Could not extract text from PDF. It might be scanned or image-based.'}), 400
-
-        # Calculate text statistics
-        word_count = len(extracted_text.split())
-        char_count = len(extracted_text)
-        
-        print(f"✅ Extracted {word_count} words from {num_pages} pages")
 
-        return jsonify({
-            'success': True,
-            'text': extracted_text.strip(),
-            'pages': num_pages,
-            'filename': filename,
-            'wordCount': word_count,
-            'charCount': char_count,
-            'preview': extracted_text[:1000] + '...' if len(extracted_text) > 1000 else extracted_text
+            if stream_response:
+                # The generator outlives this request context, so it owns and closes the buffer
+                upload = detach_upload(file)
+                response = ndjson_response(stream_pdf_pages(source, filename, num_pages, file_hash, upload, deadline))
+                response.call_on_close(lambda: admission.release('pdf', token))
+                release_with_response = True
+                return response
+
+            # Extract text from PDF
+            started = time.perf_counter()
+            record = new_pdf_record(num_pages)
+            page_timings = []
+            with stage('extract'):
+                for item in pdf_extractor.iter_pages(source, num_pages, deadline):
+                    if 'budget_exceeded' in item:
+                        record['truncated'] = item['budget_exceeded']
+                        break
+                    page_timings.append(item['ms'])
+                    add_pdf_page(record, item)
+        finally:
+            if not release_with_response:
+                admission.release('pdf', token)
+
+        cache_pdf_record(file_hash, record)
+        return pdf_json_response(filename, record, timing={
+            'totalMs': round((time.perf_counter() - started) * 1000, 1),
+            'pageMs': page_timings
         })
 
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+    except DeadlineExceeded as e:
+        return deadline_exceeded_response(e)
     except Exception as e:
-        # Clean up file on error
-        if 'filepath' in locals() and os.path.exists(filepath):
-            os.remove(filepath)
         print(f"❌ PDF extraction error: {str(e)}")
         return jsonify({'error': f'PDF extraction failed: {str(e)}'}), 500
 
@@ -597,8 +1817,12 @@ if __name__ == '__main__':
         print("⚠️  PyPDF2 not available - PDF text extraction disabled")
         print("   Install with: pip install PyPDF2")
     
+    # Development server; the reloader/debugger is opt-in (FLASK_DEBUG=true).
+    # Production: uvicorn asgi:application (see README "Production Serving")
+    port = int(os.getenv('PORT', '5000'))
+    debug = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
     print("🚀 Starting Hugging Face Flux API Service...")
-    print("📡 Service will be available at: http://localhost:5000")
+    print(f"📡 Service will be available at: http://localhost:{port}")
     print("🎨 Ready to generate educational images!")
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=debug, host='0.0.0.0', port=port, threaded=True)
\ No newline at end of file
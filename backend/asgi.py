@@ -0,0 +1,355 @@
+# ASGI entry point
+# Production serving mode. /generate-image and /api/analyze run as native coroutines:
+# Flux and Gemini calls use non-blocking clients, admission waits do not hold threads,
+# and PIL work (decode, post-processing, PNG/base64 encoding) runs on a CPU executor,
+# so one process can keep hundreds of generations in flight. Every other route (and
+# the streamed/binary variants of those two) goes through the WSGI adapter unchanged.
+#
+#   uvicorn asgi:application --host 0.0.0.0 --port $PORT
+#   python asgi.py
+
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import asgiref
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+import app as backend
+from admission import AdmissionRejected
+from deadlines import NO_DEADLINE, DeadlineExceeded
+from hf_client import AsyncHuggingFaceClient
+from singleflight import AsyncSingleFlight, SingleFlightTimeout
+
+
+# asgiref wraps WsgiToAsgiInstance.run_wsgi_app in a thread-sensitive sync_to_async; the
+# plain function is re-wrapped below. requirements.txt pins asgiref<4 for this, and a
+# different layout fails here at start-up rather than on the first request.
+_run_wsgi_app = getattr(WsgiToAsgiInstance.__dict__.get('run_wsgi_app'), 'func', None)
+if not callable(_run_wsgi_app):
+    raise RuntimeError(
+        f"asgiref {getattr(asgiref, '__version__', '?')} is not supported by asgi.py: "
+        "WsgiToAsgiInstance.run_wsgi_app is no longer a sync_to_async wrapper. Install asgiref>=3.8,<4."
+    )
+
+
+class PooledWsgiInstance(WsgiToAsgiInstance):
+    """One WSGI request run on the loop's default executor.
+
+    asgiref runs WSGI apps thread-sensitively, i.e. all on one shared thread, so a
+    single long stream (job events, PDF or analysis NDJSON) would block every other
+    WSGI route. Here each request gets its own thread from the ASGI_WSGI_THREADS pool.
+    """
+    run_wsgi_app = sync_to_async(_run_wsgi_app, thread_sensitive=False)
+
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await PooledWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+wsgi_application = PooledWsgiToAsgi(backend.app)
+
+# PIL releases the GIL for most of decode/filter/encode, so threads scale across cores
+cpu_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('ASGI_CPU_WORKERS', str(os.cpu_count() or 1))),
+    thread_name_prefix='asgi-cpu'
+)
+# Threads for routes served through the WSGI adapter
+WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', '32'))
+
+async_hf_client = AsyncHuggingFaceClient(
+    backend.HF_API_URL, backend.headers,
+    pool_size=int(os.getenv('ASGI_HF_POOL_SIZE', '200')),
+    max_retries=backend.hf_client.max_retries,
+    backoff_base=backend.hf_client.backoff_base,
+    backoff_max=backend.hf_client.backoff_max,
+    connect_timeout=backend.hf_client.connect_timeout,
+    read_timeout=backend.hf_client.read_timeout,
+    latency_budget=backend.hf_client.latency_budget,
+    on_status=backend.hf_client.on_status,
+)
+async_flux_flight = AsyncSingleFlight()
+backend.register_async_flux(async_hf_client, async_flux_flight)
+
+
+def observe(endpoint, stage, seconds):
+    if backend.METRICS_ENABLED:
+        backend.stage_latency.observe(seconds, endpoint=endpoint, stage=stage)
+
+
+async def run_cpu(fn, *args):
+    # Carry the request's context (its stage_endpoint label) into the executor thread
+    call = functools.partial(contextvars.copy_context().run, fn, *args)
+    return await asyncio.get_running_loop().run_in_executor(cpu_executor, call)
+
+
+# ---- image generation ----
+
+async def query_flux_async(payload, deadline=NO_DEADLINE):
+    """query_huggingface_flux() on the non-blocking client"""
+    error, wait = backend.flux_preflight(deadline)
+    if error:
+        return error
+    if wait:
+        await asyncio.sleep(wait)
+    try:
+        async with backend.admission.slot_async('flux', timeout=deadline.remaining()):
+            started = time.perf_counter()
+            result = await async_hf_client.generate(payload, budget=deadline.remaining())
+    except AdmissionRejected as e:
+        return backend.flux_admission_error(e, deadline)
+    return backend.flux_outcome(result, time.perf_counter() - started, deadline)
+
+
+async def render_fresh_async(payload, quality_mode, cache_key, deadline):
+    """render_fresh() on the non-blocking client and the CPU executor"""
+    started = time.perf_counter()
+    result = await query_flux_async(payload, deadline)
+    observe('generate_image', 'upstream', time.perf_counter() - started)
+    if isinstance(result, dict) and 'error' in result:
+        return result
+    if deadline.expired():
+        return backend.deadline_error('post-processing')
+    return await run_cpu(backend.finish_render, result, quality_mode, cache_key)
+
+
+async def render_image_async(prompt, width=800, height=450, quality_mode="high", bypass_cache=False,
+                             deadline=NO_DEADLINE):
+    """render_image() without blocking the event loop; return (png_bytes, cached) or an error dict"""
+    payload = backend.build_flux_payload(prompt, width, height, quality_mode)
+    flight_key = backend.flux_cache_key(payload, quality_mode)
+    cache_key = flight_key if backend.image_cache else None
+
+    cached_png = await run_cpu(backend.lookup_rendered_image, cache_key, prompt, quality_mode, bypass_cache)
+    if cached_png is not None:
+        return cached_png, True
+
+    print(f"Generating {quality_mode} quality image for prompt: {prompt}")
+    # Identical concurrent requests share one Flux call and one post-process/encode/store pass
+    query = lambda: render_fresh_async(payload, quality_mode, cache_key, deadline)
+    try:
+        result = await async_flux_flight.do(
+            flight_key, query, timeout=deadline.timeout(backend.SINGLEFLIGHT_TIMEOUT_SECONDS, stage='flux')
+        )
+        if backend.flux_leader_ran_out(result, deadline):
+            result = await query()  # the shared render ran out of the leader's time, not ours
+    except (DeadlineExceeded, SingleFlightTimeout) as e:
+        result = backend.flux_flight_error(e, deadline)
+    return result
+
+
+def image_error(result):
+    """(status, body, extra headers) for a render error dict, matching image_error_response()"""
+    if result['error'] == 'overloaded':
+        return 429, result, [(b'retry-after', str(result['retry_after']).encode())]
+    if result['error'] == 'upstream_unavailable':
+        return 503, result, [(b'retry-after', str(result['retry_after']).encode())]
+    if result['error'] == 'model_loading':
+        return 503, {
+            "error": "model_loading",
+            "message": "Model is loading, please try again in a few seconds",
+            "retry_after": result.get('estimated_time', 20)
+        }, []
+    if result['error'] == 'deadline_exceeded':
+        return 504, result, []
+    return 500, result, []
+
+
+def wants_binary_image(scope, data):
+    """Binary image responses stay on the Flask path (same negotiation rules)"""
+    explicit = str(data.get('response_format') or '').lower()
+    query = scope.get('query_string', b'').decode('latin-1')
+    if explicit in backend.BINARY_IMAGE_FORMATS or 'format=' in query:
+        return True
+    accept = dict(scope['headers']).get(b'accept', b'').decode('latin-1')
+    return 'image/png' in accept or 'image/webp' in accept
+
+
+def request_deadline(scope):
+    """Deadline from the X-Request-Timeout header, as for Flask requests"""
+    value = dict(scope['headers']).get(b'x-request-timeout')
+    return backend.request_deadline(value.decode('latin-1') if value else None)
+
+
+async def generate_image(scope, data):
+    settings, error = backend.parse_generation_request(data)
+    if error:
+        return 400, error, []
+
+    result = await render_image_async(deadline=request_deadline(scope), **settings)
+    if isinstance(result, dict):
+        return image_error(result)
+
+    png_bytes, cached = result
+    body = await run_cpu(
+        backend.build_image_response, png_bytes, settings['prompt'], settings['width'],
+        settings['height'], settings['quality_mode'], cached
+    )
+    return 200, body, []
+
+
+# ---- analysis ----
+
+async def analyze_content(scope, data):
+    content = data.get('content', '')
+    prompt = data.get('prompt', None)
+    if not content:
+        return 400, {'error': 'No content provided'}, []
+
+    if not backend.llm.available:
+        result = "Error: GEMINI_API_KEY not configured. Please add your Gemini API key to backend/.env file. Get key from: https://makersuite.google.com/app/apikey"
+    else:
+        started = time.perf_counter()
+        try:
+            result = await backend.llm.agenerate(backend.build_analysis_prompt(content, prompt),
+                                                 deadline=request_deadline(scope))
+        except AdmissionRejected as e:
+            return 429, {"error": "overloaded", "message": str(e), "lane": e.lane,
+                         "retry_after": e.retry_after}, [(b'retry-after', str(e.retry_after).encode())]
+        except DeadlineExceeded as e:
+            return 504, {"error": "deadline_exceeded", "message": str(e)}, []
+        except Exception as e:
+            result = f"Error analyzing content: {str(e)}"
+        observe('analyze_content', 'llm', time.perf_counter() - started)
+
+    return 200, {'success': True, 'result': result}, []
+
+
+def analyze_needs_wsgi(scope, data):
+    """Streamed and chunked analysis stay on the Flask path"""
+    accept = dict(scope['headers']).get(b'accept', b'').decode('latin-1')
+    query = scope.get('query_string', b'').decode('latin-1')
+    if 'text/event-stream' in accept or 'application/x-ndjson' in accept or data.get('stream') or 'stream=' in query:
+        return True
+    return backend.use_chunked_analysis(data.get('content', '') or '', data.get('mode'))
+
+
+NATIVE_ROUTES = {
+    '/generate-image': ('generate_image', generate_image, wants_binary_image),
+    '/api/analyze': ('analyze_content', analyze_content, analyze_needs_wsgi),
+}
+
+
+# ---- ASGI plumbing ----
+
+def cors_headers(scope):
+    origin = dict(scope['headers']).get(b'origin')
+    if origin is None:
+        return []
+    if '*' in backend.CORS_ORIGINS:
+        return [(b'access-control-allow-origin', b'*')]
+    if origin.decode('latin-1') in backend.CORS_ORIGINS:
+        return [(b'access-control-allow-origin', origin), (b'vary', b'Origin')]
+    return []
+
+
+async def read_body(receive, limit):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        size += len(chunks[-1])
+        if limit and size > limit:
+            raise ValueError("request body too large")
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def replay_receive(body, receive):
+    """receive() that hands an already-read body to the WSGI adapter"""
+    sent = False
+
+    async def replay():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        return await receive()
+
+    return replay
+
+
+async def send_json(send, scope, status, body, extra_headers):
+    payload = await run_cpu(lambda: json.dumps(body).encode('utf-8'))
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': headers + extra_headers + cors_headers(scope)})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='asgi-wsgi')
+            )
+            await send({'type': 'lifespan.startup.complete'})
+            backend.start_warmup()
+        elif message['type'] == 'lifespan.shutdown':
+            await async_hf_client.aclose()
+            cpu_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    route = NATIVE_ROUTES.get(scope.get('path')) if scope['type'] == 'http' else None
+    if route is None or scope['method'] != 'POST':
+        return await wsgi_application(scope, receive, send)
+
+    endpoint, handler, needs_wsgi = route
+    backend.stage_endpoint.set(endpoint)  # this request's task has its own context
+    started = time.perf_counter()
+    try:
+        body = await read_body(receive, backend.app.config.get('MAX_CONTENT_LENGTH'))
+    except ValueError:
+        return await send_json(send, scope, 413, {"error": "request body too large"}, [])
+    if body is None:
+        return
+
+    try:
+        data = json.loads(body or b'null')
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        # Let Flask produce its usual response for malformed bodies
+        return await wsgi_application(scope, replay_receive(body, receive), send)
+    if needs_wsgi(scope, data):
+        return await wsgi_application(scope, replay_receive(body, receive), send)
+
+    try:
+        status, payload, extra_headers = await handler(scope, data)
+    except Exception as e:
+        print(f"Error in {endpoint} (async): {str(e)}")
+        status, payload, extra_headers = 500, {"error": "internal_server_error", "message": str(e)}, []
+    await send_json(send, scope, status, payload, extra_headers)
+    if backend.METRICS_ENABLED:
+        backend.request_latency.observe(
+            time.perf_counter() - started, endpoint=endpoint, method='POST', status=str(status)
+        )
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    # No reloader or debugger; scale with WEB_CONCURRENCY worker processes if needed
+    uvicorn.run(
+        'asgi:application',
+        host=os.getenv('HOST', '0.0.0.0'),
+        port=int(os.getenv('PORT', '5000')),
+        workers=int(os.getenv('WEB_CONCURRENCY', '1')),
+        log_level=os.getenv('LOG_LEVEL', 'info'),
+    )
@@ -0,0 +1,129 @@
+# Image ingest benchmark
+# Decodes synthetic phone-photo JPEGs and a large PNG the old way (Image.open + full
+# decode) and through the ingest guard (header check, draft decode, downscale), each in a
+# fresh process, and reports decode time, the size handed to OCR and peak RSS growth.
+#
+# Usage (from backend/):  python benchmarks/bench_ingest.py [--repeat 3]
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from image_ingest import ImageIngest, ImageTooLarge  # noqa: E402
+
+# 12 MP and 48 MP phone photos, a 100 MP panorama and a 30 MP screenshot-style PNG
+SAMPLES = [("JPEG", 4000, 3000), ("JPEG", 8000, 6000), ("JPEG", 12000, 8400), ("PNG", 6400, 4800)]
+
+
+def sample_bytes(fmt, width, height):
+    """Encoded noise-over-gradient image (noise keeps the encoder from collapsing it)"""
+    tile = Image.merge('RGB', (
+        Image.linear_gradient('L').resize((512, 512)),
+        Image.effect_noise((512, 512), 40),
+        Image.radial_gradient('L').resize((512, 512)),
+    ))
+    image = Image.new('RGB', (width, height))
+    for x in range(0, width, 512):
+        for y in range(0, height, 512):
+            image.paste(tile, (x, y))
+    buffered = io.BytesIO()
+    if fmt == 'JPEG':
+        image.save(buffered, format=fmt, quality=85)
+    else:
+        image.save(buffered, format=fmt, compress_level=1)
+    return buffered.getvalue()
+
+
+def _peak_rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return 0
+
+
+def _reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def decode_full(data, ingest):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+def decode_guarded(data, ingest):
+    return ingest.load(io.BytesIO(data))[0]
+
+
+VARIANTS = {"full": decode_full, "guarded": decode_guarded}
+
+
+def _measure(variant, data, repeat, max_pixels, queue):
+    """Run one variant in a fresh process so the RSS peak reflects only its allocations"""
+    ingest = ImageIngest(max_pixels=max_pixels)
+    func = VARIANTS[variant]
+    Image.MAX_IMAGE_PIXELS = None  # the unguarded path is what we are measuring
+    _reset_peak_rss()
+    baseline_kb = _peak_rss_kb()
+    timings = []
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            image = func(data, ingest)
+            timings.append((time.perf_counter() - started) * 1000)
+            size = image.size
+            del image
+    except ImageTooLarge as e:
+        queue.put({"rejected": str(e)})
+        return
+    timings.sort()
+    queue.put({
+        "median_ms": round(timings[len(timings) // 2], 1),
+        "output": f"{size[0]}x{size[1]}",
+        "peak_rss_growth_mb": round((_peak_rss_kb() - baseline_kb) / 1024, 1),
+    })
+
+
+def measure(variant, data, repeat, max_pixels):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(variant, data, repeat, max_pixels, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-megapixels', type=float, default=40)
+    args = parser.parse_args()
+
+    max_pixels = int(args.max_megapixels * 1_000_000)
+    report = {"max_megapixels": args.max_megapixels, "results": []}
+    for fmt, width, height in SAMPLES:
+        data = sample_bytes(fmt, width, height)
+        entry = {"image": f"{fmt} {width}x{height}", "encoded_mb": round(len(data) / (1024 * 1024), 1)}
+        for variant in VARIANTS:
+            entry[variant] = measure(variant, data, args.repeat, max_pixels)
+        report["results"].append(entry)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
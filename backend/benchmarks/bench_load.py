@@ -0,0 +1,491 @@
+# Load benchmark
+# Starts a local stand-in for the Flux endpoint (canned PNGs, configurable latency and
+# 503 rate), runs the backend against it with the fake LLM backend, drives the main
+# endpoints at a fixed concurrency and reports latency percentiles, throughput and the
+# backend's peak RSS as JSON. No API keys or network access needed.
+#
+# Usage (from backend/):
+#   python benchmarks/bench_load.py
+#   python benchmarks/bench_load.py --concurrency 16 --requests 200 --flux-latency 0.5 --flux-503-rate 0.1
+#   python benchmarks/bench_load.py --endpoints generate-image,analyze --with-caches
+#   python benchmarks/bench_load.py --server asgi --concurrency 200   # uvicorn + asgi.py
+#   python benchmarks/bench_load.py --endpoints "" --isolation-streams 0   # behaviour checks only
+#
+# Behaviour checks (see CHECKS) run against a second backend with deadlines scaled to a
+# fixed-latency mock; the script exits non-zero if one of them, or the stream isolation
+# check, fails.
+
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from PIL import Image, ImageDraw
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Fake Gemini delay per streamed word: a streamed analysis lasts about a second, which
+# the stream isolation check needs (non-streamed /api/analyze is unaffected)
+STREAM_CHUNK_LATENCY = 0.04
+
+# Behaviour checks use their own mock with this fixed Flux latency and deadlines scaled
+# to it: one render fits in REQUEST_TIMEOUT_SECONDS, five waves of renders do not, and
+# one quality mode fits in QUALITY_TEST_TIMEOUT_SECONDS, two back to back do not
+CHECK_FLUX_LATENCY = 1.0
+CHECK_ENV = {
+    "REQUEST_TIMEOUT_SECONDS": "3",
+    "QUALITY_TEST_TIMEOUT_SECONDS": "1.5",
+}
+
+TOPICS = [
+    "photosynthesis", "the water cycle", "plate tectonics", "the human heart",
+    "the solar system", "cell division", "the nitrogen cycle", "volcano cross-section",
+]
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # accept bursts of concurrent connections without resets
+
+
+# Prompts containing this get a 400 from the mock, as Flux answers a rejected prompt
+MOCK_REJECTED_PROMPT = "mock-rejected-prompt"
+
+
+class MockFlux:
+    """Flux stand-in: PNGs sized from the payload, with latency, injected 503s and 400s for MOCK_REJECTED_PROMPT"""
+
+    def __init__(self, latency, jitter, error_rate, estimated_time):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.estimated_time = estimated_time
+        self.stats = {"requests": 0, "served_503": 0, "served_400": 0}
+        self._lock = threading.Lock()
+        self._pngs = {}
+        self._random = random.Random(42)
+        self.server = MockServer(('127.0.0.1', 0), self._handler())
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/models/black-forest-labs/FLUX.1-schnell"
+
+    def png(self, width, height):
+        key = (width, height)
+        with self._lock:
+            data = self._pngs.get(key)
+        if data is None:
+            image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+            buffered = io.BytesIO()
+            image.save(buffered, format='PNG')
+            data = buffered.getvalue()
+            with self._lock:
+                self._pngs[key] = data
+        return data
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                with mock._lock:
+                    mock.stats["requests"] += 1
+                    fail = mock._random.random() < mock.error_rate
+                    delay = mock.latency + mock._random.uniform(0, mock.jitter)
+                time.sleep(delay)
+                if MOCK_REJECTED_PROMPT in str(payload.get('inputs', '')):
+                    with mock._lock:
+                        mock.stats["served_400"] += 1
+                    self._reply(400, 'application/json', json.dumps({"error": "Input validation error"}).encode())
+                    return
+                if fail:
+                    with mock._lock:
+                        mock.stats["served_503"] += 1
+                    body = json.dumps({"error": "Model is loading", "estimated_time": mock.estimated_time}).encode()
+                    self._reply(503, 'application/json', body)
+                    return
+                parameters = payload.get('parameters', {})
+                self._reply(200, 'image/png', mock.png(parameters.get('width', 800), parameters.get('height', 450)))
+
+            def _reply(self, status, content_type, body):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+# ---- request fixtures ----
+
+def make_pdf(pages, words_per_page):
+    """Minimal multi-page PDF with one line of Helvetica text per page"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        text = " ".join(f"{TOPICS[(page + i) % len(TOPICS)].split()[-1]}{i}" for i in range(words_per_page))
+        stream = f"BT /F1 10 Tf 20 700 Td ({text}) Tj ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 3 0 R >> >> >>" % len(objects))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % k for k in kids) + b"] /Count %d >>" % pages
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return out
+
+
+def make_worksheet_png(index):
+    image = Image.new('RGB', (1200, 900), 'white')
+    draw = ImageDraw.Draw(image)
+    for line in range(12):
+        draw.text((40, 40 + line * 60), f"{index}.{line} Explain {TOPICS[(index + line) % len(TOPICS)]}.", fill='black')
+    buffered = io.BytesIO()
+    image.save(buffered, format='PNG')
+    return buffered.getvalue()
+
+
+def make_scenarios(args):
+    """Endpoint name -> function(session, base_url, i) returning the HTTP response"""
+    pdf = make_pdf(args.pdf_pages, 120)
+    worksheets = [make_worksheet_png(i) for i in range(args.distinct)]
+    content = "\n\n".join(
+        f"{TOPICS[i % len(TOPICS)].capitalize()} is an important topic. " * 12 for i in range(20)
+    )
+
+    def prompt(i):
+        return f"{TOPICS[i % len(TOPICS)]} diagram {i % args.distinct}"
+
+    return {
+        "generate-image": lambda s, url, i: s.post(f"{url}/generate-image", json={
+            "prompt": prompt(i), "quality_mode": ("standard", "high", "ultra")[i % 3]}),
+        "test-quality": lambda s, url, i: s.post(f"{url}/test-quality", json={"prompt": prompt(i)}),
+        "upload": lambda s, url, i: s.post(f"{url}/api/upload", files={
+            "file": (f"sheet{i}.png", worksheets[i % args.distinct], "image/png")}),
+        "extract-pdf": lambda s, url, i: s.post(f"{url}/api/extract-pdf", files={
+            "file": (f"book{i}.pdf", pdf, "application/pdf")}),
+        "analyze": lambda s, url, i: s.post(f"{url}/api/analyze", json={
+            "content": f"Lesson {i % args.distinct}.\n\n{content}"}),
+    }
+
+
+# ---- backend process ----
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_backend(port, env, server='wsgi'):
+    if server == 'asgi':
+        bootstrap = (
+            "import uvicorn; "
+            f"uvicorn.run('asgi:application', host='127.0.0.1', port={port}, log_level='warning')"
+        )
+    else:
+        bootstrap = (
+            "from werkzeug.serving import run_simple; import app; "
+            f"run_simple('127.0.0.1', {port}, app.app, threaded=True)"
+        )
+    process = subprocess.Popen([sys.executable, '-c', bootstrap], cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("backend exited during startup")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health", timeout=1).ok:
+                return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("backend did not become healthy within 60s")
+
+
+def rss_mb(pid, field):
+    """VmRSS / VmHWM of a process in MB (Linux)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+# ---- load generation ----
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(len(values) * fraction))], 1)
+
+
+def run_endpoint(name, scenario, base_url, total, concurrency):
+    local = threading.local()
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def one(i):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            status = str(scenario(session, base_url, i).status_code)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "endpoint": name,
+        "requests": total,
+        "concurrency": concurrency,
+        "status_codes": statuses,
+        "errors": sum(count for status, count in statuses.items() if status != "200"),
+        "rps": round(total / wall, 2),
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": round(latencies[-1], 1) if latencies else None,
+        },
+    }
+
+
+def check_stream_isolation(base_url, streams):
+    """Time /health while `streams` streamed analyses are open.
+
+    Each WSGI request must get its own thread (in ASGI mode too); if they share one,
+    the streams run one after another and /health waits for all of them.
+    """
+    def stream(i):
+        started = time.perf_counter()
+        with requests.post(f"{base_url}/api/analyze?stream=1", json={"content": f"Isolation check {i}."},
+                           stream=True, timeout=120) as response:
+            for _ in response.iter_lines():
+                pass
+        return (time.perf_counter() - started) * 1000
+
+    with ThreadPoolExecutor(max_workers=streams) as pool:
+        futures = [pool.submit(stream, i) for i in range(streams)]
+        time.sleep(0.2)  # let the streams open
+        started = time.perf_counter()
+        requests.get(f"{base_url}/health", timeout=120)
+        health_ms = (time.perf_counter() - started) * 1000
+        stream_ms = sorted(future.result() for future in futures)
+    return {
+        "open_streams": streams,
+        "stream_ms_min": round(stream_ms[0], 1),
+        "stream_ms_max": round(stream_ms[-1], 1),
+        "health_ms": round(health_ms, 1),
+        # Concurrent streams finish together, and /health does not wait for them
+        "isolated": stream_ms[-1] < 1.5 * stream_ms[0] and health_ms < stream_ms[0] / 2,
+    }
+
+
+def check_batch_deadline(base_url):
+    """A full-size batch sent without X-Request-Timeout must finish every prompt"""
+    prompts = [f"{TOPICS[i % len(TOPICS)]} batch check {i}" for i in range(20)]
+    started = time.perf_counter()
+    response = requests.post(f"{base_url}/generate-images/batch", timeout=600, json={
+        "prompts": prompts, "quality_mode": "standard", "width": 256, "height": 256})
+    lines = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+    summary = lines[-1] if lines and lines[-1].get('type') == 'summary' else {}
+    errors = sorted({line.get('error') for line in lines if line.get('type') == 'image' and not line.get('success')})
+    return {
+        "prompts": len(prompts),
+        "succeeded": summary.get('succeeded'),
+        "errors": errors,
+        "ms": round((time.perf_counter() - started) * 1000, 1),
+        "passed": summary.get('succeeded') == len(prompts),
+    }
+
+
+def check_quality_overlap(base_url):
+    """Two overlapping /test-quality calls: the second one's modes queue, but must not time out"""
+    def call(i):
+        response = requests.post(f"{base_url}/test-quality", json={"prompt": f"overlap check {i}"}, timeout=120)
+        return {quality: result.get('error', 'ok') for quality, result in response.json()["quality_comparison"].items()}
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        calls = list(pool.map(call, range(2)))
+    return {
+        "calls": calls,
+        "passed": all(outcome == 'ok' for modes in calls for outcome in modes.values()),
+    }
+
+
+def check_client_errors(base_url, attempts=5):
+    """Prompts Flux rejects with 400 (more than FLUX_FAILURE_THRESHOLD) must not open the circuit"""
+    statuses = [requests.post(f"{base_url}/generate-image", timeout=120, json={
+        "prompt": f"{MOCK_REJECTED_PROMPT} {i}", "quality_mode": "standard"}).status_code for i in range(attempts)]
+    state = requests.get(f"{base_url}/health", timeout=30).json()["flux"]["state"]
+    follow_up = requests.post(f"{base_url}/generate-image", timeout=120, json={
+        "prompt": "client error check follow-up", "quality_mode": "standard"}).status_code
+    return {
+        "rejected_statuses": statuses,
+        "state": state,
+        "follow_up_status": follow_up,
+        "passed": state == "ready" and follow_up == 200,
+    }
+
+
+# name -> function(base_url) returning a dict with "passed"
+CHECKS = {
+    "batch_default_deadline": check_batch_deadline,
+    "quality_overlap": check_quality_overlap,
+    "client_errors_keep_ready": check_client_errors,
+}
+
+
+def run_checks(env, server):
+    """Run CHECKS against a fresh backend and fixed-latency mock; return {name: result}"""
+    mock = MockFlux(CHECK_FLUX_LATENCY, 0.0, 0.0, estimated_time=0.2)
+    mock.start()
+    port = free_port()
+    backend = start_backend(port, dict(env, HF_API_URL=mock.url, **CHECK_ENV), server)
+    try:
+        return {name: check(f"http://127.0.0.1:{port}") for name, check in CHECKS.items()}
+    finally:
+        backend.terminate()
+        backend.wait(timeout=10)
+        mock.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--endpoints', default='generate-image,test-quality,upload,extract-pdf,analyze')
+    parser.add_argument('--requests', type=int, default=50, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--distinct', type=int, default=10, help='distinct prompts/files per endpoint')
+    parser.add_argument('--pdf-pages', type=int, default=30)
+    parser.add_argument('--flux-latency', type=float, default=0.2, help='mock Flux latency in seconds')
+    parser.add_argument('--flux-jitter', type=float, default=0.1)
+    parser.add_argument('--flux-503-rate', type=float, default=0.0)
+    parser.add_argument('--llm-latency', type=float, default=0.1, help='fake Gemini latency in seconds')
+    parser.add_argument('--with-caches', action='store_true', help='keep image/extraction/LLM caches on')
+    parser.add_argument('--server', default='wsgi', choices=['wsgi', 'asgi'],
+                        help='threaded Werkzeug server or uvicorn + asgi.py')
+    parser.add_argument('--isolation-streams', type=int, default=4,
+                        help='streamed analyses held open while /health is timed (0 = skip the check)')
+    parser.add_argument('--skip-checks', action='store_true', help='skip the behaviour checks')
+    args = parser.parse_args()
+
+    scenarios = make_scenarios(args)
+    selected = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = [name for name in selected if name not in scenarios]
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(unknown)} (choose from {', '.join(scenarios)})")
+
+    mock = MockFlux(args.flux_latency, args.flux_jitter, args.flux_503_rate, estimated_time=0.2)
+    mock.start()
+    workdir = tempfile.mkdtemp(prefix='visora-bench-')
+    caches = 'true' if args.with_caches else 'false'
+    env = dict(
+        os.environ,
+        HF_API_URL=mock.url,
+        HUGGINGFACE_API_TOKEN='bench',
+        HF_BACKOFF_BASE_SECONDS='0.05',
+        LLM_BACKEND='fake',
+        LLM_FAKE_LATENCY_SECONDS=str(args.llm_latency),
+        LLM_FAKE_CHUNK_LATENCY_SECONDS=str(STREAM_CHUNK_LATENCY),
+        IMAGE_CACHE_ENABLED=caches,
+        EXTRACTION_CACHE_ENABLED=caches,
+        LLM_CACHE_ENABLED=caches,
+        IMAGE_STORE_ENABLED=caches,
+        IMAGE_CACHE_DIR=os.path.join(workdir, 'images'),
+        IMAGE_STORE_DIR=os.path.join(workdir, 'store'),
+        JOB_SQLITE_PATH=os.path.join(workdir, 'jobs.db'),
+        EXTRACTION_CACHE_PATH=os.path.join(workdir, 'extractions.db'),
+        UPLOAD_TMP_DIR=workdir,
+    )
+
+    port = free_port()
+    backend = start_backend(port, env, args.server)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        rss_idle = rss_mb(backend.pid, 'VmRSS')
+        isolation = check_stream_isolation(base_url, args.isolation_streams) if args.isolation_streams else None
+        results = [run_endpoint(name, scenarios[name], base_url, args.requests, args.concurrency)
+                   for name in selected]
+        checks = None if args.skip_checks else run_checks(env, args.server)
+        report = {
+            "config": {
+                "server": args.server,
+                "concurrency": args.concurrency,
+                "requests_per_endpoint": args.requests,
+                "flux_latency_s": args.flux_latency,
+                "flux_503_rate": args.flux_503_rate,
+                "llm_latency_s": args.llm_latency,
+                "caches": args.with_caches,
+            },
+            "stream_isolation": isolation,
+            "checks": checks,
+            "results": results,
+            "backend": {
+                "rss_idle_mb": rss_idle,
+                "rss_end_mb": rss_mb(backend.pid, 'VmRSS'),
+                "peak_rss_mb": rss_mb(backend.pid, 'VmHWM'),
+            },
+            "mock_flux": dict(mock.stats),
+        }
+    finally:
+        backend.terminate()
+        backend.wait(timeout=10)
+        mock.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+    if isolation and not isolation["isolated"]:
+        sys.exit("stream isolation check failed: concurrent WSGI requests were serialized")
+    failed = [name for name, result in (checks or {}).items() if not result["passed"]]
+    if failed:
+        sys.exit(f"behaviour checks failed: {', '.join(failed)}")
+
+
+if __name__ == '__main__':
+    main()
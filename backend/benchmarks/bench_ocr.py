@@ -0,0 +1,133 @@
+# OCR benchmark
+# Compares raw pytesseract.image_to_string against the OCREngine pipeline (preprocess +
+# strip tiling + parallel Tesseract) on a fixture set: latency, character accuracy and
+# the confidence the engine would use to decide on the Gemini fallback.
+#
+# Usage (from backend/):
+#   python benchmarks/bench_ocr.py                      # synthetic worksheet fixtures
+#   python benchmarks/bench_ocr.py --fixtures DIR       # DIR/name.png + DIR/name.txt pairs
+#
+# Requires the tesseract binary on PATH.
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont  # noqa: E402
+
+from ocr import OCREngine, TESSERACT_AVAILABLE  # noqa: E402
+
+WORKSHEET_TEXT = [
+    "Photosynthesis Worksheet",
+    "1. What gas do plants absorb from the air?",
+    "2. Name the green pigment found in chloroplasts.",
+    "3. Where in the plant cell does photosynthesis happen?",
+    "4. Write the word equation for photosynthesis.",
+    "5. Why do leaves change colour in autumn?",
+    "Carbon dioxide + water -> glucose + oxygen",
+    "Bonus: explain the role of sunlight in two sentences.",
+]
+
+
+def render_worksheet(lines, repeat, long_side, noise):
+    """Render worksheet text, then scale it up like a phone photo of a printed page"""
+    font = ImageFont.load_default(size=28)
+    line_height = 44
+    body = [line for _ in range(repeat) for line in lines]
+    page = Image.new('L', (1240, 80 + line_height * len(body)), 245)
+    draw = ImageDraw.Draw(page)
+    for i, line in enumerate(body):
+        draw.text((60, 40 + i * line_height), line, fill=20, font=font)
+
+    scale = long_side / max(page.size)
+    photo = page.resize((int(page.width * scale), int(page.height * scale)), Image.BICUBIC)
+    if noise:
+        grain = Image.effect_noise(photo.size, noise)
+        photo = Image.blend(photo, grain, 0.15).filter(ImageFilter.GaussianBlur(1))
+    return photo.convert('RGB'), "\n".join(body)
+
+
+def synthetic_fixtures():
+    return [
+        ("small-clean", *render_worksheet(WORKSHEET_TEXT, 1, 1200, 0)),
+        ("phone-photo", *render_worksheet(WORKSHEET_TEXT, 1, 4032, 40)),
+        ("long-handout", *render_worksheet(WORKSHEET_TEXT, 6, 6000, 30)),
+    ]
+
+
+def directory_fixtures(path):
+    fixtures = []
+    for image_path in sorted(glob.glob(os.path.join(path, '*'))):
+        base, ext = os.path.splitext(image_path)
+        if ext.lower() not in ('.png', '.jpg', '.jpeg', '.webp', '.bmp') or not os.path.exists(base + '.txt'):
+            continue
+        with open(base + '.txt', encoding='utf-8') as f:
+            fixtures.append((os.path.basename(base), Image.open(image_path), f.read()))
+    return fixtures
+
+
+def levenshtein(a, b):
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def char_accuracy(expected, actual):
+    """1 - normalised edit distance over whitespace-collapsed text"""
+    expected = " ".join(expected.split())
+    actual = " ".join(actual.split())
+    if not expected:
+        return 1.0 if not actual else 0.0
+    return round(max(0.0, 1 - levenshtein(expected, actual) / len(expected)), 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--fixtures', help='directory of image + .txt ground-truth pairs')
+    args = parser.parse_args()
+
+    if not TESSERACT_AVAILABLE:
+        print(json.dumps({"error": "pytesseract is not installed"}))
+        sys.exit(1)
+    import pytesseract
+    try:
+        pytesseract.get_tesseract_version()
+    except Exception as e:
+        print(json.dumps({"error": f"tesseract binary not available: {e}"}))
+        sys.exit(1)
+
+    fixtures = directory_fixtures(args.fixtures) if args.fixtures else synthetic_fixtures()
+    engine = OCREngine()
+    results = []
+    for name, image, expected in fixtures:
+        started = time.perf_counter()
+        raw_text = pytesseract.image_to_string(image)
+        raw_ms = (time.perf_counter() - started) * 1000
+
+        result = engine.recognize(image)
+        results.append({
+            "fixture": name,
+            "size": f"{image.width}x{image.height}",
+            "raw": {"latency_ms": round(raw_ms, 1), "char_accuracy": char_accuracy(expected, raw_text)},
+            "engine": {
+                "latency_ms": result["elapsed_ms"],
+                "char_accuracy": char_accuracy(expected, result["text"]),
+                "confidence": result["confidence"],
+                "tiles": result["tiles"],
+            },
+        })
+
+    print(json.dumps({"fixtures": results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
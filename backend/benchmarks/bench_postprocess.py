@@ -0,0 +1,121 @@
+# Post-processing benchmark
+# Compares the fused enhancement pass against the original chained ImageEnhance calls:
+# pixel parity, time per image and peak memory growth, at the sizes each quality mode produces.
+#
+# Usage (from backend/):  python benchmarks/bench_postprocess.py [--repeat 20]
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageChops, ImageStat  # noqa: E402
+
+from image_processing import DEFAULT_PROFILES, enhance_chained, enhance_fused  # noqa: E402
+
+# Output sizes of standard/high/ultra for the default 800x450 request, plus a large upload
+SIZES = [(800, 450), (1000, 562), (1024, 675), (2048, 2048)]
+VARIANTS = {"chained": enhance_chained, "fused": enhance_fused}
+
+
+def sample_image(width, height):
+    """Deterministic test image with smooth gradients, colour and high-frequency noise"""
+    red = Image.radial_gradient('L').resize((width, height))
+    green = Image.effect_noise((width, height), 60)
+    blue = Image.linear_gradient('L').resize((width, height))
+    return Image.merge('RGB', (red, green, blue))
+
+
+def parity(width, height, factors):
+    """Per-channel difference between the fused and chained outputs"""
+    image = sample_image(width, height)
+    diff = ImageChops.difference(enhance_chained(image, *factors), enhance_fused(image, *factors))
+    histogram = diff.convert('L').histogram()
+    total = width * height
+    return {
+        "max_abs_diff": max(high for _, high in diff.getextrema()),
+        "mean_abs_diff": round(sum(ImageStat.Stat(diff).mean) / 3, 4),
+        "pixels_over_2_levels_pct": round(100.0 * sum(histogram[3:]) / total, 4),
+    }
+
+
+def _peak_rss_kb():
+    """Peak resident set size (VmHWM) of this process in kB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _reset_peak_rss():
+    """Reset VmHWM to the current RSS (Linux >= 4.0); otherwise the peak only grows"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _measure(variant, width, height, factors, repeat, queue):
+    """Run one variant in a fresh process so the RSS peak reflects only its allocations"""
+    image = sample_image(width, height)
+    image.load()
+    func = VARIANTS[variant]
+    func(image, *factors)  # warm-up
+
+    _reset_peak_rss()
+    baseline_kb = _peak_rss_kb()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(image, *factors)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    peak_kb = _peak_rss_kb()
+    timings.sort()
+    queue.put({
+        "median_ms": round(timings[len(timings) // 2], 2),
+        "min_ms": round(timings[0], 2),
+        "peak_rss_growth_mb": round((peak_kb - baseline_kb) / 1024, 2),
+    })
+
+
+def measure(variant, width, height, factors, repeat):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(variant, width, height, factors, repeat, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--mode', default='high', choices=[m for m, f in DEFAULT_PROFILES.items() if f])
+    args = parser.parse_args()
+
+    factors = DEFAULT_PROFILES[args.mode]
+    report = {"quality_mode": args.mode, "factors": factors, "results": []}
+    for width, height in SIZES:
+        entry = {"size": f"{width}x{height}", "parity": parity(width, height, factors)}
+        for variant in VARIANTS:
+            entry[variant] = measure(variant, width, height, factors, args.repeat)
+        entry["speedup"] = round(entry["chained"]["median_ms"] / max(entry["fused"]["median_ms"], 1e-6), 2)
+        report["results"].append(entry)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
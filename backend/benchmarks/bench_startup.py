@@ -0,0 +1,118 @@
+# Startup benchmark
+# Times `import app` in fresh interpreters (what an autoscaled instance pays on a cold
+# start), the first request after it, and which heavy SDKs were imported by then.
+# --eager imports every provider up front to reproduce the old import-everything
+# startup for comparison; --importtime adds the slowest modules from `python -X importtime`.
+#
+# Usage (from backend/):
+#   python benchmarks/bench_startup.py
+#   python benchmarks/bench_startup.py --runs 10 --eager --importtime
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, sys, time
+started = time.perf_counter()
+if EAGER:
+    from providers import registry
+    for name in ('genai', 'pytesseract', 'PyPDF2', 'requests'):
+        if registry.available(name):
+            registry.load(name)
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+client.get('/health')
+first_request = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (first_request - imported) * 1000,
+    "loaded": [m for m in ('google.generativeai', 'pytesseract', 'PyPDF2', 'requests') if m in sys.modules],
+}))
+"""
+
+
+def probe_env(args):
+    env = dict(os.environ)
+    env.update(
+        GEMINI_API_KEY=args.gemini_key,
+        WARMUP_ENABLED='false',
+        IMAGE_CACHE_ENABLED='false',
+        EXTRACTION_CACHE_ENABLED='false',
+        LLM_CACHE_ENABLED='false',
+    )
+    return env
+
+
+def run_probe(args, eager):
+    code = PROBE.replace('EAGER', str(eager))
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=BACKEND_DIR, env=probe_env(args),
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    imports = [s["import_ms"] for s in samples]
+    firsts = [s["first_request_ms"] for s in samples]
+    return {
+        "runs": len(samples),
+        "import_ms": {"p50": round(statistics.median(imports), 1), "min": round(min(imports), 1),
+                      "max": round(max(imports), 1)},
+        "first_request_ms_p50": round(statistics.median(firsts), 1),
+        "loaded_at_first_request": samples[-1]["loaded"],
+    }
+
+
+def slowest_imports(args, limit):
+    """Modules imported directly by app, slowest first (from `python -X importtime`)"""
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=BACKEND_DIR,
+        env=probe_env(args), capture_output=True, text=True, check=True
+    ).stderr
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        # Entries are printed after their own imports, so app's children precede it
+        if depth == 0:
+            if name.strip() == 'app':
+                break
+            children = []
+        elif depth == 1:
+            children.append((int(cumulative), name.strip()))
+    children.sort(reverse=True)
+    return [{"module": name, "cumulative_ms": round(us / 1000, 1)} for us, name in children[:limit]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--gemini-key', default='dummy', help='GEMINI_API_KEY for the probe ("" = unconfigured)')
+    parser.add_argument('--eager', action='store_true', help='also measure importing every provider up front')
+    parser.add_argument('--importtime', action='store_true', help="list app's slowest direct imports")
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    report = {"lazy": summarize([run_probe(args, eager=False) for _ in range(args.runs)])}
+    if args.eager:
+        report["eager"] = summarize([run_probe(args, eager=True) for _ in range(args.runs)])
+        report["import_speedup"] = round(
+            report["eager"]["import_ms"]["p50"] / report["lazy"]["import_ms"]["p50"], 2
+        )
+    if args.importtime:
+        report["slowest_imports"] = slowest_imports(args, args.top)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
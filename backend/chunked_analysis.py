@@ -0,0 +1,161 @@
+# Chunked (map-reduce) analysis
+# Splits long documents into token-bounded, overlapping chunks, summarises them in
+# parallel through the shared LLM service and merges the summaries in a reduce step.
+# Chunk prompts go through the LLM response cache, so re-analysing an edited document
+# only sends the chunks whose text changed.
+
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+CHARS_PER_TOKEN = 4
+
+# Chunk prompts carry no position so an unchanged chunk keeps its cache entry
+# when an edit elsewhere adds or removes chunks.
+CHUNK_SUMMARY_PROMPT = """You are summarizing one section of a long educational document.
+Write a concise summary of this section, then list its key facts, definitions and examples as bullet points.
+Do not add an introduction or refer to other sections.
+
+SECTION:
+{text}"""
+
+MERGE_SUMMARIES_PROMPT = """Merge these summaries of consecutive sections of a long document into one concise summary.
+Keep every key fact, definition and example; drop repetition.
+
+SUMMARIES:
+{text}"""
+
+REDUCE_PREFACE = "The following are summaries of consecutive sections of a long document, in order.\n\n"
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English text)"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _pieces(text, max_chars):
+    """Paragraphs, with oversized paragraphs split on sentence ends and then hard-wrapped"""
+    for paragraph in text.split('\n\n'):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind('. ', 0, max_chars)
+            cut = cut + 1 if cut > max_chars // 2 else max_chars
+            yield paragraph[:cut].strip()
+            paragraph = paragraph[cut:].strip()
+        if paragraph:
+            yield paragraph
+
+
+def _is_anchor(piece):
+    """Content-defined boundary: about one paragraph in four ends a chunk once it is half full"""
+    return hashlib.sha1(piece.encode('utf-8')).digest()[0] % 4 == 0
+
+
+def split_into_chunks(text, max_tokens=3000, overlap_tokens=200):
+    """Split text into chunks of at most max_tokens (plus overlap).
+
+    Boundaries fall on paragraph ends chosen by content, not by running length, so an
+    edit only changes the chunks around it. Each chunk after the first starts with
+    the last overlap_tokens of the previous chunk as context.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    overlap_chars = overlap_tokens * CHARS_PER_TOKEN
+    bodies = []
+    current = []
+    size = 0
+    for piece in _pieces(text, max_chars):
+        if current and size + len(piece) + 2 > max_chars:
+            bodies.append('\n\n'.join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece) + 2
+        if size >= max_chars // 2 and _is_anchor(piece):
+            bodies.append('\n\n'.join(current))
+            current, size = [], 0
+    if current:
+        bodies.append('\n\n'.join(current))
+
+    chunks = []
+    for i, body in enumerate(bodies):
+        if i and overlap_chars:
+            tail = bodies[i - 1][-overlap_chars:]
+            space = tail.find(' ')
+            tail = tail[space + 1:] if 0 <= space < len(tail) // 2 else tail
+            body = f"...{tail}\n\n{body}"
+        chunks.append(body)
+    return chunks
+
+
+class ChunkedAnalyzer:
+    """Map-reduce analysis of long content over a bounded worker pool"""
+
+    def __init__(self, llm, build_final_prompt, max_chunk_tokens=3000, overlap_tokens=200, workers=4):
+        self.llm = llm
+        self.build_final_prompt = build_final_prompt
+        self.max_chunk_tokens = max_chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analyze-chunk')
+
+    def split(self, text):
+        return split_into_chunks(text, self.max_chunk_tokens, self.overlap_tokens)
+
+    def _summarize(self, prompt, deadline=None):
+        started = time.perf_counter()
+        summary = self.llm.generate(prompt, deadline=deadline)
+        return summary, round((time.perf_counter() - started) * 1000, 1)
+
+    def map_chunks(self, chunks, deadline=None):
+        """Summarise chunks in parallel; yield (index, summary, ms) as each one finishes"""
+        futures = {}
+        for i, chunk in enumerate(chunks):
+            prompt = CHUNK_SUMMARY_PROMPT.format(text=chunk)
+            futures[self._executor.submit(self._summarize, prompt, deadline)] = i
+        try:
+            for future in as_completed(futures):
+                summary, ms = future.result()
+                yield futures[future], summary, ms
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def collapse(self, summaries, deadline=None):
+        """Merge summaries in groups until they fit in one chunk"""
+        max_chars = self.max_chunk_tokens * CHARS_PER_TOKEN
+        while len(summaries) > 1 and sum(len(s) + 2 for s in summaries) > max_chars:
+            groups = [[]]
+            size = 0
+            for summary in summaries:
+                if groups[-1] and size + len(summary) > max_chars:
+                    groups.append([])
+                    size = 0
+                groups[-1].append(summary)
+                size += len(summary) + 2
+            if len(groups) == len(summaries):
+                break  # every summary already fills a chunk on its own
+            prompts = [MERGE_SUMMARIES_PROMPT.format(text='\n\n'.join(group)) for group in groups]
+            summaries = list(self._executor.map(lambda p: self.llm.generate(p, deadline=deadline), prompts))
+        return summaries
+
+    def reduce_prompt(self, summaries, prompt=None, deadline=None):
+        """Final analysis prompt over the merged chunk summaries"""
+        return self.build_final_prompt(REDUCE_PREFACE + '\n\n'.join(self.collapse(summaries, deadline)), prompt)
+
+    def analyze(self, text, prompt=None, deadline=None):
+        """Split, map and reduce; return {'result', 'chunks', 'map_ms', 'reduce_ms'}"""
+        chunks = self.split(text)
+        started = time.perf_counter()
+        summaries = [None] * len(chunks)
+        for index, summary, _ in self.map_chunks(chunks, deadline):
+            summaries[index] = summary
+        map_ms = round((time.perf_counter() - started) * 1000, 1)
+
+        started = time.perf_counter()
+        result = self.llm.generate(self.reduce_prompt(summaries, prompt, deadline), deadline=deadline)
+        return {
+            "result": result,
+            "chunks": len(chunks),
+            "map_ms": map_ms,
+            "reduce_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
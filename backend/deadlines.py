@@ -0,0 +1,80 @@
+# Request deadlines
+# Each request gets one absolute deadline (from the X-Request-Timeout header or a
+# default). Upstream calls size their timeouts, admission waits and retry budgets from
+# what is left, optional fallbacks are skipped when little is left, and work stops
+# early once it has passed.
+
+import math
+import time
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes before or during a piece of work"""
+
+    def __init__(self, stage=None):
+        super().__init__(f"Request deadline exceeded{f' during {stage}' if stage else ''}")
+        self.stage = stage
+
+
+class Deadline:
+    """Monotonic point in time by which a request must be answered (None = no limit)"""
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds if seconds else None
+
+    def remaining(self):
+        """Seconds left (never negative), or None without a deadline"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, stage=None):
+        if self.expired():
+            raise DeadlineExceeded(stage)
+
+    def timeout(self, cap=None, stage=None):
+        """Timeout for a sub-call: the remaining budget, capped at `cap`; raise if nothing is left"""
+        remaining = self.remaining()
+        if remaining is None:
+            return cap
+        if remaining <= 0:
+            raise DeadlineExceeded(stage)
+        return remaining if cap is None else min(cap, remaining)
+
+    def within(self, seconds):
+        """Deadline `seconds` from now, or this one if it ends sooner"""
+        child = Deadline(seconds)
+        if self.expires_at is not None and (child.expires_at is None or self.expires_at < child.expires_at):
+            child.seconds, child.expires_at = self.seconds, self.expires_at
+        return child
+
+    def shorter_than(self, seconds):
+        """True when a deadline is set and less than `seconds` of it is left"""
+        remaining = self.remaining()
+        return remaining is not None and remaining < seconds
+
+
+NO_DEADLINE = Deadline()
+
+
+def deadline_from_header(value, default=None, maximum=None):
+    """Deadline for an X-Request-Timeout value in seconds, capped at `maximum`.
+
+    Missing, malformed, zero or negative values get `default`, so a client cannot
+    opt out of the server's deadline.
+    """
+    try:
+        seconds = float(value) if value not in (None, '', b'') else None
+    except (TypeError, ValueError):
+        seconds = None
+    if seconds is None or not math.isfinite(seconds) or seconds <= 0:
+        seconds = default
+    if not seconds or seconds <= 0:
+        return NO_DEADLINE
+    if maximum:
+        seconds = min(seconds, maximum)
+    return Deadline(seconds)
@@ -0,0 +1,120 @@
+# Extraction result cache
+# SQLite store of OCR / PDF extraction results keyed by upload SHA-256 and extractor version,
+# so re-uploaded handouts skip the save-to-disk and extraction steps.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def hash_stream(stream, chunk_size=HASH_CHUNK_BYTES):
+    """SHA-256 of a seekable stream; the stream is rewound afterwards.
+
+    Upload buffers that hash themselves while being written (`sha256`) are not re-read.
+    """
+    precomputed = getattr(stream, 'sha256', None)
+    if isinstance(precomputed, str):
+        stream.seek(0)
+        return precomputed
+    digest = hashlib.sha256()
+    stream.seek(0)
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """Extraction results by (file hash, extractor version) with size and age eviction"""
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, max_age_seconds=30 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS extractions ("
+                "file_hash TEXT NOT NULL, version TEXT NOT NULL, result TEXT NOT NULL, "
+                "size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL, "
+                "PRIMARY KEY (file_hash, version))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS extractions_accessed ON extractions (accessed_at)"
+            )
+
+    def get(self, file_hash, version):
+        """Cached result dict, or None"""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT result, created_at FROM extractions WHERE file_hash = ? AND version = ?",
+                (file_hash, version)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age_seconds:
+                self._stats["misses"] += 1
+                return None
+            self._conn.execute(
+                "UPDATE extractions SET accessed_at = ? WHERE file_hash = ? AND version = ?",
+                (now, file_hash, version)
+            )
+            self._stats["hits"] += 1
+        return json.loads(row[0])
+
+    def put(self, file_hash, version, result):
+        """Store a result dict and evict old or excess entries"""
+        data = json.dumps(result)
+        if len(data) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions (file_hash, version, result, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (file_hash, version, data, len(data), now, now)
+            )
+            self._stats["stores"] += 1
+            self._evict(now)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            row = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions").fetchone()
+        stats["entries"], stats["bytes"] = row
+        return stats
+
+    def _evict(self, now):
+        """Drop expired rows, then least recently used rows until under max_bytes (lock held)"""
+        expired = self._conn.execute(
+            "DELETE FROM extractions WHERE created_at < ?", (now - self.max_age_seconds,)
+        ).rowcount
+        self._stats["evictions"] += expired
+
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT file_hash, version, size FROM extractions ORDER BY accessed_at"
+        ).fetchall()
+        for file_hash, version, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute(
+                "DELETE FROM extractions WHERE file_hash = ? AND version = ?", (file_hash, version)
+            )
+            total -= size
+            self._stats["evictions"] += 1
@@ -0,0 +1,228 @@
+# Flux upstream monitor
+# Tracks the inference endpoint's readiness from every real call (and optional
+# probes): ready, loading (503 model_loading with an estimated time), or down after
+# repeated failures. Callers ask admit() before going upstream, so requests wait out
+# a short model load or fail fast instead of each paying for it. An optional keeper
+# thread sends cheap, rate-limited warm requests during active hours so the model is
+# not unloaded between lessons.
+
+import math
+import threading
+import time
+from collections import deque
+
+
+def parse_active_hours(spec):
+    """'7-22' or '7-12,13-22' (local hours, end exclusive, may wrap midnight) -> list of (start, end)"""
+    ranges = []
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        start = int(start) % 24
+        end = int(end) if end else start + 1
+        ranges.append((start, end % 24 or 24))
+    return ranges
+
+
+def in_active_hours(ranges, hour):
+    if not ranges:
+        return True
+    for start, end in ranges:
+        if start < end and start <= hour < end:
+            return True
+        if start >= end and (hour >= start or hour < end):
+            return True
+    return False
+
+
+def is_upstream_failure(result):
+    """True for errors that say the upstream is unhealthy: 5xx, timeouts and connection errors.
+
+    4xx answers (bad prompt, bad token, rate limit) mean the upstream is up and replying.
+    """
+    status = result.get('status')
+    if status is not None:
+        return status >= 500
+    return result.get('error') in ('timeout', 'request_failed')
+
+
+class FluxMonitor:
+    """Upstream readiness state machine with an optional keep-warm prober"""
+
+    def __init__(self, probe_fn=None, active_hours=None, probe_interval=60.0, idle_seconds=240.0,
+                 warm_min_interval=300.0, warm_max_per_hour=12, loading_max_wait=30.0,
+                 failure_threshold=3, open_seconds=30.0):
+        self.probe_fn = probe_fn  # () -> image bytes or error dict; one attempt, no retries
+        self.active_hours = parse_active_hours(active_hours)
+        self.probe_interval = probe_interval
+        self.idle_seconds = idle_seconds
+        self.warm_min_interval = warm_min_interval
+        self.warm_max_per_hour = warm_max_per_hour
+        self.loading_max_wait = loading_max_wait
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+
+        self._lock = threading.Lock()
+        self._state = "unknown"
+        self._changed_at = time.time()
+        self._ready_at = None  # expected end of a model load
+        self._open_until = None  # fail-fast window after repeated failures
+        self._failures = 0
+        self._last_success = None
+        self._latencies = deque(maxlen=200)
+        self._warm_times = deque()
+        self._last_probe = None
+        self._stats = {"probes": 0, "warm_requests": 0, "waited": 0, "rejected_loading": 0,
+                       "rejected_down": 0, "transitions": 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def state(self):
+        return self._state
+
+    # ---- observations ----
+
+    def record(self, result, elapsed, probe=False):
+        """Update the state from one upstream outcome (image bytes or an error dict)"""
+        now = time.time()
+        with self._lock:
+            if not isinstance(result, dict):
+                self._failures = 0
+                self._last_success = now
+                self._ready_at = self._open_until = None
+                if not probe:
+                    self._latencies.append(elapsed)
+                self._set_state("ready", now)
+            elif result.get('error') == 'model_loading':
+                self._failures = 0
+                self._ready_at = now + float(result.get('estimated_time') or 20)
+                self._set_state("loading", now)
+            elif is_upstream_failure(result):
+                self._failures += 1
+                if self._failures >= self.failure_threshold:
+                    self._open_until = now + self.open_seconds
+                    self._set_state("down", now)
+
+    def _set_state(self, state, now):
+        if state != self._state:
+            print(f"🌡️  Flux upstream {self._state} -> {state}")
+            self._state = state
+            self._changed_at = now
+            self._stats["transitions"] += 1
+
+    # ---- routing ----
+
+    def admit(self):
+        """('go', 0), ('wait', seconds) to ride out a short model load, or ('reject', error dict)"""
+        now = time.time()
+        with self._lock:
+            if self._state == "loading" and self._ready_at:
+                remaining = self._ready_at - now
+                if remaining > self.loading_max_wait:
+                    self._stats["rejected_loading"] += 1
+                    return "reject", {"error": "model_loading", "estimated_time": math.ceil(remaining)}
+                if remaining > 0:
+                    self._stats["waited"] += 1
+                    return "wait", remaining
+            if self._state == "down" and self._open_until and now < self._open_until:
+                self._stats["rejected_down"] += 1
+                retry_after = math.ceil(self._open_until - now)
+                return "reject", {
+                    "error": "upstream_unavailable",
+                    "message": f"Flux upstream is failing, retry in {retry_after}s",
+                    "retry_after": retry_after
+                }
+        # After the fail-fast window calls go through again; the next failure reopens it
+        return "go", 0
+
+    # ---- keep-warm prober ----
+
+    def start(self):
+        """Run the prober on a daemon thread (once); needs probe_fn"""
+        if self.probe_fn is None or self._thread is not None:
+            return False
+        self._thread = threading.Thread(target=self._run, name='flux-keeper', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.probe_interval):
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"⚠️  Flux keeper tick failed: {e}")
+
+    def tick(self, now=None):
+        """Send one warm request if it is due; return what was decided"""
+        now = now or time.time()
+        if not in_active_hours(self.active_hours, time.localtime(now).tm_hour):
+            return "inactive"
+        with self._lock:
+            if self._state == "ready" and self._last_success and now - self._last_success < self.idle_seconds:
+                return "warm"  # real traffic is keeping the model loaded
+            if self._state == "down" and self._open_until and now < self._open_until:
+                return "down"
+            while self._warm_times and now - self._warm_times[0] > 3600:
+                self._warm_times.popleft()
+            if len(self._warm_times) >= self.warm_max_per_hour:
+                return "rate_limited"
+            # Keep-warm pings are spaced out; a loading or unknown model is re-probed each interval
+            if self._state == "ready" and self._warm_times and now - self._warm_times[-1] < self.warm_min_interval:
+                return "rate_limited"
+            self._warm_times.append(now)
+            self._stats["warm_requests"] += 1
+        self.probe()
+        return "probed"
+
+    def probe(self):
+        """One probe request; updates the state and returns the outcome"""
+        started = time.perf_counter()
+        result = self.probe_fn()
+        elapsed = time.perf_counter() - started
+        self.record(result, elapsed, probe=True)
+        outcome = "ok" if not isinstance(result, dict) else result.get('error', 'error')
+        with self._lock:
+            self._stats["probes"] += 1
+            self._last_probe = {"at": time.time(), "outcome": outcome, "latency_ms": round(elapsed * 1000, 1)}
+        return outcome
+
+    # ---- reporting ----
+
+    def summary(self):
+        """Short state for /models"""
+        now = time.time()
+        with self._lock:
+            latencies = sorted(self._latencies)
+            summary = {
+                "state": self._state,
+                "ready": self._state == "ready",
+                "latency_ms_p50": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+                "estimated_ready_in_seconds": (
+                    max(0, math.ceil(self._ready_at - now)) if self._state == "loading" and self._ready_at else None
+                ),
+            }
+        summary["keeper_active"] = self._thread is not None and in_active_hours(
+            self.active_hours, time.localtime(now).tm_hour
+        )
+        return summary
+
+    def stats(self):
+        """Full state for /health"""
+        summary = self.summary()
+        with self._lock:
+            summary.update(self._stats)
+            summary.update(
+                since=self._changed_at,
+                consecutive_failures=self._failures,
+                last_success=self._last_success,
+                last_probe=self._last_probe,
+                warm_requests_last_hour=len(self._warm_times),
+            )
+        summary["keeper_enabled"] = self._thread is not None
+        return summary
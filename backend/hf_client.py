@@ -0,0 +1,253 @@
+# Hugging Face inference client
+# Keep-alive connection pool with retry/backoff and upstream latency tracking; a
+# requests-based client for WSGI and an httpx-based one for the ASGI entry point.
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+from providers import registry
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class HuggingFaceClient:
+    """Shared requests.Session for the Flux endpoint with bounded, budget-aware retries"""
+
+    def __init__(self, api_url, headers, pool_size=10, max_retries=3,
+                 backoff_base=1.0, backoff_max=20.0, connect_timeout=5.0,
+                 read_timeout=60.0, latency_budget=90.0, on_status=None):
+        self.api_url = api_url
+        self.on_status = on_status  # called with each attempt's status code or error kind
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.latency_budget = latency_budget
+
+        self.headers = headers
+        self.pool_size = pool_size
+        self._session = None
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=500)
+        self._stats = {"requests": 0, "attempts": 0, "retries": 0, "successes": 0, "failures": 0}
+
+    @property
+    def session(self):
+        """requests.Session, created (and requests imported) on first use"""
+        if self._session is None:
+            requests = registry.load('requests')
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    session.headers.update(self.headers)
+                    adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=self.pool_size, pool_maxsize=self.pool_size
+                    )
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def generate(self, payload, budget=None):
+        """POST a generation payload; return image bytes or an error dict.
+
+        `budget` (seconds) shortens the latency budget, e.g. to a request's remaining deadline.
+        """
+        requests = registry.load('requests')
+        started = time.monotonic()
+        deadline = started + (self.latency_budget if budget is None else min(self.latency_budget, budget))
+        attempt = 0
+        with self._lock:
+            self._stats["requests"] += 1
+
+        while True:
+            attempt += 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return self._finish(started, {"error": "timeout", "message": "Upstream latency budget exhausted"})
+
+            with self._lock:
+                self._stats["attempts"] += 1
+            try:
+                response = self.session.post(
+                    self.api_url, json=payload,
+                    timeout=(self.connect_timeout, min(self.read_timeout, remaining))
+                )
+            except requests.exceptions.Timeout:
+                self._record_status("timeout")
+                error = {"error": "timeout", "message": "Request timed out"}
+                wait = self._backoff(attempt)
+            except requests.exceptions.ConnectionError as e:
+                self._record_status("connection_error")
+                error = {"error": "request_failed", "message": str(e)}
+                wait = self._backoff(attempt)
+            except Exception as e:
+                self._record_status("error")
+                return self._finish(started, {"error": "request_failed", "message": str(e)})
+            else:
+                final, error, wait = self._handle_response(response, attempt)
+                if final is not None:
+                    return self._finish(started, final)
+
+            if not self._should_retry(error, wait, attempt, deadline):
+                return self._finish(started, error)
+            time.sleep(wait)
+
+    def probe(self, payload, timeout=None):
+        """A single attempt with no retries (health probes, keep-warm); image bytes or an error dict"""
+        requests = registry.load('requests')
+        try:
+            response = self.session.post(
+                self.api_url, json=payload,
+                timeout=(self.connect_timeout, timeout or self.read_timeout)
+            )
+        except requests.exceptions.Timeout:
+            self._record_status("timeout")
+            return {"error": "timeout", "message": "Request timed out"}
+        except Exception as e:
+            self._record_status("connection_error")
+            return {"error": "request_failed", "message": str(e)}
+        final, error, _ = self._handle_response(response, 1)
+        return final if final is not None else error
+
+    def _handle_response(self, response, attempt):
+        """Classify an HTTP response as (final result, None, None) or (None, error, wait)"""
+        self._record_status(str(response.status_code))
+        if response.status_code == 200:
+            return response.content, None, None
+        if response.status_code == 503:
+            estimated_time = self._estimated_time(response)
+            error = {"error": "model_loading", "estimated_time": estimated_time}
+            return None, error, max(self._backoff(attempt), estimated_time)
+        error = {"error": f"API error: {response.status_code}", "status": response.status_code, "details": response.text}
+        if response.status_code not in RETRYABLE_STATUS_CODES:
+            return error, None, None
+        return None, error, self._retry_after(response) or self._backoff(attempt)
+
+    def _should_retry(self, error, wait, attempt, deadline):
+        """Only wait if another attempt still fits inside the latency budget"""
+        if attempt > self.max_retries or time.monotonic() + wait >= deadline:
+            return False
+        with self._lock:
+            self._stats["retries"] += 1
+        print(f"⏳ Flux upstream {error['error']}, retrying in {wait:.1f}s (attempt {attempt}/{self.max_retries})")
+        return True
+
+    def stats(self):
+        """Request counters and upstream latency percentiles in milliseconds"""
+        with self._lock:
+            stats = dict(self._stats)
+            latencies = sorted(self._latencies)
+        if latencies:
+            stats["latency_ms"] = {
+                "p50": round(latencies[len(latencies) // 2] * 1000, 1),
+                "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+                "max": round(latencies[-1] * 1000, 1),
+                "samples": len(latencies),
+            }
+        return stats
+
+    def _finish(self, started, result):
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._latencies.append(elapsed)
+            if isinstance(result, dict):
+                self._stats["failures"] += 1
+            else:
+                self._stats["successes"] += 1
+        return result
+
+    def _record_status(self, status):
+        if self.on_status:
+            self.on_status(status)
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    @staticmethod
+    def _estimated_time(response):
+        try:
+            return float(response.json().get('estimated_time', 20))
+        except Exception:
+            return 20.0
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+
+
+class AsyncHuggingFaceClient(HuggingFaceClient):
+    """httpx.AsyncClient variant for the ASGI entry point; same retry policy and stats.
+
+    The async client is created on first use so it binds to the serving event loop.
+    """
+
+    def __init__(self, api_url, headers, pool_size=100, **kwargs):
+        super().__init__(api_url, dict(headers), pool_size=pool_size, **kwargs)
+        self.client = None
+
+    def _client(self):
+        if self.client is None:
+            import httpx
+            self.client = httpx.AsyncClient(
+                headers=self.headers,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+        return self.client
+
+    async def generate(self, payload, budget=None):
+        """POST a generation payload without blocking the loop; return image bytes or an error dict"""
+        import httpx
+
+        started = time.monotonic()
+        deadline = started + (self.latency_budget if budget is None else min(self.latency_budget, budget))
+        attempt = 0
+        with self._lock:
+            self._stats["requests"] += 1
+
+        while True:
+            attempt += 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return self._finish(started, {"error": "timeout", "message": "Upstream latency budget exhausted"})
+
+            with self._lock:
+                self._stats["attempts"] += 1
+            try:
+                response = await self._client().post(
+                    self.api_url, json=payload,
+                    timeout=httpx.Timeout(min(self.read_timeout, remaining), connect=self.connect_timeout)
+                )
+            except httpx.TimeoutException:
+                self._record_status("timeout")
+                error = {"error": "timeout", "message": "Request timed out"}
+                wait = self._backoff(attempt)
+            except httpx.TransportError as e:
+                self._record_status("connection_error")
+                error = {"error": "request_failed", "message": str(e)}
+                wait = self._backoff(attempt)
+            except Exception as e:
+                self._record_status("error")
+                return self._finish(started, {"error": "request_failed", "message": str(e)})
+            else:
+                final, error, wait = self._handle_response(response, attempt)
+                if final is not None:
+                    return self._finish(started, final)
+
+            if not self._should_retry(error, wait, attempt, deadline):
+                return self._finish(started, error)
+            await asyncio.sleep(wait)
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
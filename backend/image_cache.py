@@ -0,0 +1,229 @@
+# Generated image cache
+# Two-tier (memory LRU + disk) store for post-processed PNG bytes, keyed on the
+# effective Flux request so repeated lesson topics skip the upstream round trip.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_cache_key(enhanced_prompt, width, height, steps, guidance, quality_mode):
+    """Content-address a generation request by its effective parameters"""
+    material = json.dumps({
+        "prompt": enhanced_prompt,
+        "width": int(width),
+        "height": int(height),
+        "steps": steps,
+        "guidance": guidance,
+        "quality_mode": quality_mode,
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class ImageCache:
+    """In-memory LRU tier backed by an optional on-disk tier, both with TTL eviction"""
+
+    def __init__(self, memory_items=128, memory_bytes=64 * 1024 * 1024,
+                 disk_dir=None, disk_bytes=512 * 1024 * 1024, ttl_seconds=7 * 24 * 3600):
+        self.memory_items = memory_items
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (data, stored_at)
+        self._memory_size = 0
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "bypasses": 0,
+        }
+
+        # Disk tier index, least recently read first: key -> (size, stored_at). Built by one
+        # scan at startup and kept up to date on every read, write and removal
+        self._disk_lock = threading.Lock()
+        self._disk_index = OrderedDict()
+        self._disk_size = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    # ---- public API ----
+
+    def get(self, key):
+        """Return cached PNG bytes for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                data, stored_at = entry
+                if now - stored_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return data
+                self._drop_memory(key)
+
+        data, stored_at = self._disk_get(key, now)
+        with self._lock:
+            if data is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._memory_put(key, data, stored_at)
+        return data
+
+    def put(self, key, data):
+        """Store PNG bytes in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._memory_put(key, data, now)
+            self._stats["stores"] += 1
+        self._disk_put(key, data)
+
+    def record_bypass(self):
+        """Count a request that explicitly skipped the cache lookup"""
+        with self._lock:
+            self._stats["bypasses"] += 1
+
+    def stats(self):
+        """Snapshot of hit/miss counters and tier sizes"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_size
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        stats["disk_enabled"] = bool(self.disk_dir)
+        with self._disk_lock:
+            stats["disk_entries"] = len(self._disk_index)
+            stats["disk_bytes"] = self._disk_size
+        return stats
+
+    # ---- memory tier (caller holds the lock) ----
+
+    def _memory_put(self, key, data, stored_at):
+        if len(data) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._drop_memory(key)
+        self._memory[key] = (data, stored_at)
+        self._memory_size += len(data)
+        while self._memory and (len(self._memory) > self.memory_items or self._memory_size > self.memory_bytes):
+            oldest = next(iter(self._memory))
+            self._drop_memory(oldest)
+            self._stats["evictions"] += 1
+
+    def _drop_memory(self, key):
+        data, _ = self._memory.pop(key)
+        self._memory_size -= len(data)
+
+    # ---- disk tier ----
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.png")
+
+    def _scan_disk(self):
+        """Index the files already on disk (startup only); expired ones are removed"""
+        now = time.time()
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith('.tmp'):
+                    self._remove_file(path, count=False)  # left behind by an interrupted write
+                    continue
+                if not name.endswith('.png'):
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if now - st.st_mtime > self.ttl_seconds:
+                    self._remove_file(path)
+                    continue
+                files.append((st.st_atime, name[:-4], st.st_size, st.st_mtime))
+        with self._disk_lock:
+            for _, key, size, stored_at in sorted(files):
+                self._disk_index[key] = (size, stored_at)
+                self._disk_size += size
+            self._evict_disk()
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None, None
+        path = self._disk_path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if now - stored_at > self.ttl_seconds:
+                self._remove_file(path, count=False)
+                self._forget(key)
+                return None, None
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Touch atime so size eviction prefers least recently read files (also across restarts)
+            os.utime(path, (now, stored_at))
+        except OSError:
+            self._forget(key)
+            return None, None
+        with self._disk_lock:
+            if key in self._disk_index:
+                self._disk_index.move_to_end(key)
+            else:  # written by another worker process sharing the directory
+                self._disk_index[key] = (len(data), stored_at)
+                self._disk_size += len(data)
+        return data, stored_at
+
+    def _disk_put(self, key, data):
+        if not self.disk_dir or len(data) > self.disk_bytes:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️  Image cache write failed: {e}")
+            return
+        with self._disk_lock:
+            previous = self._disk_index.pop(key, None)
+            if previous is not None:
+                self._disk_size -= previous[0]
+            self._disk_index[key] = (len(data), time.time())
+            self._disk_size += len(data)
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """Drop expired entries at the cold end, then least recently read ones until under the limit (disk lock held)"""
+        now = time.time()
+        while self._disk_index:
+            key, (size, stored_at) = next(iter(self._disk_index.items()))
+            if self._disk_size <= self.disk_bytes and now - stored_at <= self.ttl_seconds:
+                break
+            del self._disk_index[key]
+            self._disk_size -= size
+            self._remove_file(self._disk_path(key))
+
+    def _forget(self, key):
+        with self._disk_lock:
+            entry = self._disk_index.pop(key, None)
+            if entry is not None:
+                self._disk_size -= entry[0]
+
+    def _remove_file(self, path, count=True):
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        if count:
+            with self._lock:
+                self._stats["evictions"] += 1
+        return True
@@ -0,0 +1,167 @@
+# Image ingest guard
+# Uploads are sized from their header before any pixels are decoded. Images within
+# the pixel budget decode normally. Larger JPEGs are decoded in draft mode (the
+# decoder's own 1/2, 1/4 or 1/8 scaling), and other large formats are rejected
+# instead of being expanded into hundreds of MB. Anything still at least twice
+# max_long_side is box-reduced, so OCR and vision get a right-sized image.
+
+import threading
+
+from PIL import Image
+
+# Formats whose decoder can scale down while decoding (Image.draft)
+DRAFT_FORMATS = ('JPEG',)
+
+
+class ImageTooLarge(ValueError):
+    """Raised for an upload that cannot be decoded within the pixel budget"""
+
+
+def decoded_bytes(mode, size):
+    """Bytes Pillow allocates for an image of this mode and size"""
+    if mode in ('1', 'L', 'P'):
+        pixel_size = 1
+    elif mode.startswith('I;16'):
+        pixel_size = 2
+    else:
+        pixel_size = 4  # multi-band and 32-bit modes are stored 4 bytes per pixel
+    return size[0] * size[1] * pixel_size
+
+
+def _megabytes(n):
+    return round(n / (1024 * 1024), 1)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (VmHWM), in MB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource  # not on Windows
+    except ImportError:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _scale_dpi(image, scale):
+    """Keep the DPI consistent with the new size so OCR still finds the page size"""
+    dpi = image.info.get('dpi')
+    if dpi and dpi[0]:
+        image.info['dpi'] = (dpi[0] * scale, dpi[1] * scale)
+
+
+class ImageIngest:
+    """Header check, draft decode and downscale for uploaded images"""
+
+    def __init__(self, max_pixels=40_000_000, max_long_side=4096):
+        self.max_pixels = max_pixels
+        self.max_long_side = max_long_side
+        self._lock = threading.Lock()
+        self._stats = {"images": 0, "full": 0, "draft": 0, "reduced": 0, "rejected": 0,
+                       "decoded_bytes_max": 0, "decoded_bytes_saved": 0}
+
+    def open(self, source):
+        """Open an image from a path or a (rewound) file-like object, reading only its header"""
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        try:
+            return Image.open(source)
+        except Image.DecompressionBombError:
+            # Beyond Pillow's own limit (about 179 MP) nothing is decoded, not even in draft mode
+            self._reject()
+            raise ImageTooLarge(f"Image is larger than {Image.MAX_IMAGE_PIXELS * 2 / 1e6:.0f} MP")
+
+    def _reject(self):
+        with self._lock:
+            self._stats["rejected"] += 1
+
+    def _draft_scale(self, width, height):
+        """JPEG scale denominator: fit the pixel budget, then shrink while still >= max_long_side"""
+        scale = 1
+        while scale < 8 and width * height / (scale * scale) > self.max_pixels:
+            scale *= 2
+        while scale < 8 and self.max_long_side and max(width, height) // (scale * 2) >= self.max_long_side:
+            scale *= 2
+        return scale
+
+    def load(self, source):
+        """Decode an upload within the budget; return (image, report) or raise ImageTooLarge"""
+        image = self.open(source)
+        width, height = image.size
+        fmt = image.format
+        full_bytes = decoded_bytes(image.mode, image.size)
+        method = "full"
+
+        if width * height > self.max_pixels or (
+            self.max_long_side and max(width, height) > self.max_long_side and image.format in DRAFT_FORMATS
+        ):
+            if image.format not in DRAFT_FORMATS:
+                self._reject()
+                raise ImageTooLarge(
+                    f"Image is {width}x{height} ({width * height / 1e6:.0f} MP); "
+                    f"the limit is {self.max_pixels / 1e6:.0f} MP"
+                )
+            # Decoder-side scaling: only the reduced image is ever allocated. draft() picks
+            # the largest scale whose result is still at least the requested size
+            scale = self._draft_scale(width, height)
+            image.draft(image.mode, (max(1, width // scale), max(1, height // scale)))
+            if image.size[0] * image.size[1] > self.max_pixels:
+                self._reject()
+                raise ImageTooLarge(
+                    f"Image is {width}x{height}; even a 1/{scale} scale decode exceeds "
+                    f"{self.max_pixels / 1e6:.0f} MP"
+                )
+            if image.size != (width, height):
+                method = "draft"
+                _scale_dpi(image, image.size[0] / width)
+        image.load()
+        peak_bytes = decoded_bytes(image.mode, image.size)
+
+        # Box-reduce by a whole factor: cheap, and the result stays at least max_long_side.
+        # OCR and vision rescale to their own targets, so up to 2x larger is fine here
+        factor = max(image.size) // self.max_long_side if self.max_long_side else 1
+        if factor > 1:
+            reduced = image.reduce(factor)
+            reduced.info = dict(image.info)
+            _scale_dpi(reduced, 1 / factor)
+            peak_bytes += decoded_bytes(reduced.mode, reduced.size)  # both are alive while reducing
+            image = reduced
+            method = "reduce" if method == "full" else method
+
+        with self._lock:
+            self._stats["images"] += 1
+            self._stats["reduced" if method == "reduce" else method] += 1
+            self._stats["decoded_bytes_max"] = max(self._stats["decoded_bytes_max"], peak_bytes)
+            self._stats["decoded_bytes_saved"] += max(0, full_bytes - peak_bytes)
+        return image, {
+            "format": fmt,
+            "width": width,
+            "height": height,
+            "decodedWidth": image.size[0],
+            "decodedHeight": image.size[1],
+            "method": method,
+            "decodeMb": _megabytes(peak_bytes),
+            "fullDecodeMb": _megabytes(full_bytes),
+        }
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["decoded_mb_max"] = _megabytes(stats.pop("decoded_bytes_max"))
+        stats["decoded_mb_saved"] = _megabytes(stats.pop("decoded_bytes_saved"))
+        stats.update(max_pixels=self.max_pixels, max_long_side=self.max_long_side, process_peak_rss_mb=peak_rss_mb())
+        return stats
+
+
+def fit(image, long_side):
+    """Copy of image scaled down so its longest side is at most long_side (or the image itself)"""
+    if not long_side or max(image.size) <= long_side:
+        return image
+    scale = long_side / max(image.size)
+    size = (max(1, round(image.size[0] * scale)), max(1, round(image.size[1] * scale)))
+    return image.resize(size, Image.LANCZOS, reducing_gap=2.0)
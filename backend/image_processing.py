@@ -0,0 +1,129 @@
+# Image post-processing
+# Fused sharpen/contrast/saturation stage for generated images.
+#
+# The original pipeline ran ImageEnhance.Sharpness, Contrast and Color back to back,
+# each allocating a full intermediate image. All three are linear blends, so they
+# collapse into one 3x3 convolution (sharpness) followed by one affine colour matrix
+# (contrast + saturation), which Pillow applies in a single pass each.
+
+import os
+
+from PIL import Image, ImageEnhance, ImageFilter, ImageStat
+
+from process_pools import SpawnedProcessPool
+
+# ITU-R 601-2 luma weights, as used by Image.convert("L")
+LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
+# ImageEnhance blends truncate to uint8 at every stage while filter()/convert() round,
+# so the fused passes are biased down to land on the chained output (calibrated with
+# benchmarks/bench_postprocess.py)
+SHARPEN_ROUNDING_BIAS = -0.25
+MATRIX_ROUNDING_BIAS = -0.75
+
+# (sharpness, contrast, saturation) factors per quality mode; 1.0 leaves the image unchanged
+DEFAULT_PROFILES = {
+    "standard": None,
+    "high": (1.2, 1.1, 1.1),
+    "ultra": (1.2, 1.1, 1.1),
+}
+
+
+def load_profiles():
+    """Quality profiles, overridable with POSTPROCESS_<MODE>="sharpness,contrast,saturation" """
+    profiles = dict(DEFAULT_PROFILES)
+    for mode in profiles:
+        override = os.getenv(f'POSTPROCESS_{mode.upper()}')
+        if not override:
+            continue
+        if override.lower() == 'off':
+            profiles[mode] = None
+            continue
+        try:
+            sharpness, contrast, saturation = (float(v) for v in override.split(','))
+            profiles[mode] = (sharpness, contrast, saturation)
+        except ValueError:
+            print(f"⚠️  Ignoring invalid POSTPROCESS_{mode.upper()}={override!r}")
+    return profiles
+
+
+def enhance_chained(image, sharpness, contrast, saturation):
+    """Reference implementation: three separate ImageEnhance passes"""
+    image = ImageEnhance.Sharpness(image).enhance(sharpness)
+    image = ImageEnhance.Contrast(image).enhance(contrast)
+    image = ImageEnhance.Color(image).enhance(saturation)
+    return image
+
+
+def sharpen_kernel(sharpness):
+    """3x3 kernel equal to blending the image with ImageFilter.SMOOTH by `sharpness`"""
+    # SMOOTH is (1 1 1 / 1 5 1 / 1 1 1) / 13; Sharpness blends it with the original
+    outer = (1.0 - sharpness) / 13.0
+    center = sharpness + (1.0 - sharpness) * 5.0 / 13.0
+    return ImageFilter.Kernel((3, 3), [outer] * 4 + [center] + [outer] * 4,
+                              scale=1, offset=SHARPEN_ROUNDING_BIAS)
+
+
+def color_matrix(contrast, saturation, mean):
+    """Affine RGB matrix applying Contrast around `mean` followed by Color"""
+    matrix = []
+    for channel in range(3):
+        for k, weight in enumerate(LUMA_WEIGHTS):
+            coefficient = (1.0 - saturation) * contrast * weight
+            if k == channel:
+                coefficient += saturation * contrast
+            matrix.append(coefficient)
+        matrix.append((1.0 - contrast) * mean + MATRIX_ROUNDING_BIAS)
+    return tuple(matrix)
+
+
+def enhance_fused(image, sharpness, contrast, saturation):
+    """Sharpen, contrast and saturate with one convolution and one colour-matrix pass"""
+    if image.mode != "RGB":
+        # Alpha and palette images keep the reference behaviour
+        return enhance_chained(image, sharpness, contrast, saturation)
+
+    sharpened = image.filter(sharpen_kernel(sharpness)) if sharpness != 1.0 else image
+
+    # Contrast pivots on the rounded grey mean; luma is linear so it follows from channel means
+    channel_means = ImageStat.Stat(sharpened).mean
+    mean = int(sum(w * m for w, m in zip(LUMA_WEIGHTS, channel_means)) + 0.5)
+
+    return sharpened.convert("RGB", color_matrix(contrast, saturation, mean))
+
+
+# ---- optional process pool for large images ----
+
+def _enhance_raw(mode, size, raw, factors):
+    """Process-pool entry point: rebuild the image from raw pixels and enhance it"""
+    result = enhance_fused(Image.frombytes(mode, size, raw), *factors)
+    return result.mode, result.size, result.tobytes()
+
+
+class PostProcessor:
+    """Applies the per-quality-mode profile, offloading very large images to a process pool"""
+
+    def __init__(self, profiles=None, pool_min_pixels=0, pool_workers=2, pool_timeout=30.0):
+        self.profiles = profiles if profiles is not None else load_profiles()
+        self.pool_min_pixels = pool_min_pixels
+        self.pool_workers = pool_workers
+        self.pool_timeout = pool_timeout
+        self._pool = SpawnedProcessPool(pool_workers)
+
+    def process(self, image, quality_mode):
+        factors = self.profiles.get(quality_mode)
+        if not factors:
+            return image
+
+        if self.pool_min_pixels and image.width * image.height >= self.pool_min_pixels:
+            image = image.convert("RGB") if image.mode not in ("RGB", "RGBA") else image
+            future = self._pool.get().submit(
+                _enhance_raw, image.mode, image.size, image.tobytes(), factors
+            )
+            mode, size, raw = future.result(timeout=self.pool_timeout)
+            return Image.frombytes(mode, size, raw)
+
+        return enhance_fused(image, *factors)
+
+    def shutdown(self):
+        self._pool.shutdown()
@@ -0,0 +1,237 @@
+# Image store
+# Content-addressed originals (sha256 of the PNG bytes) plus lazily rendered
+# derivatives: resized presets re-encoded as PNG, WebP or JPEG. Both live on disk
+# with size-based eviction of the least recently read files. Originals and
+# derivatives never change once written, so their URLs can be cached forever.
+
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+
+from PIL import Image
+
+from singleflight import SingleFlight
+
+# Longest side in pixels per preset; None keeps the original size
+VARIANT_SIZES = {"thumbnail": 256, "medium": 640, "full": None}
+VARIANT_FORMATS = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+DEFAULT_QUALITY = {"webp": 80, "jpeg": 85}
+
+IMAGE_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class VariantError(ValueError):
+    """Raised for an unknown preset, format or quality"""
+
+
+def parse_variant(variant, fmt=None, quality=None):
+    """Normalise a variant request to (preset, format, quality or None)"""
+    if variant not in VARIANT_SIZES:
+        raise VariantError(f"Unknown variant '{variant}' (use {', '.join(VARIANT_SIZES)})")
+    fmt = (fmt or 'png').lower()
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if fmt not in VARIANT_FORMATS:
+        raise VariantError(f"Unknown format '{fmt}' (use {', '.join(VARIANT_FORMATS)})")
+    if fmt == 'png':
+        return variant, fmt, None
+    if quality in (None, ''):
+        return variant, fmt, DEFAULT_QUALITY[fmt]
+    try:
+        quality = int(quality)
+    except (TypeError, ValueError):
+        raise VariantError("quality must be an integer between 1 and 100")
+    if not 1 <= quality <= 100:
+        raise VariantError("quality must be an integer between 1 and 100")
+    return variant, fmt, quality
+
+
+def variant_name(variant, fmt, quality):
+    return f"{variant}-q{quality}.{fmt}" if quality else f"{variant}.{fmt}"
+
+
+def variant_etag(image_id, variant, fmt, quality):
+    """Strong ETag: the bytes are fully determined by the original and the variant"""
+    return f"{image_id[:32]}-{variant_name(variant, fmt, quality)}"
+
+
+def render_variant(png_bytes, variant, fmt, quality):
+    """Resize and re-encode an original; return the encoded bytes"""
+    image = Image.open(io.BytesIO(png_bytes))
+    longest = VARIANT_SIZES[variant]
+    if longest and max(image.size) > longest:
+        image.thumbnail((longest, longest), Image.LANCZOS)
+
+    buffered = io.BytesIO()
+    if fmt == 'jpeg':
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(buffered, format='JPEG', quality=quality, optimize=True, progressive=True)
+    elif fmt == 'webp':
+        image.save(buffered, format='WEBP', quality=quality, method=4)
+    else:
+        image.save(buffered, format='PNG', compress_level=6)
+    return buffered.getvalue()
+
+
+class _DiskArea:
+    """Directory of immutable files with a size limit enforced by least-recent-read eviction"""
+
+    def __init__(self, root, max_bytes, on_evict):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._size = None  # computed on the first write
+        os.makedirs(root, exist_ok=True)
+
+    def read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Touch atime so eviction prefers least recently read files
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+            return data
+        except OSError:
+            return None
+
+    def write(self, path, data):
+        if len(data) > self.max_bytes:
+            return False
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️  Image store write failed: {e}")
+            return False
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+        return True
+
+    def _files(self):
+        for root, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield st.st_atime, st.st_size, path
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._files())
+
+    def _evict(self):
+        """Remove least recently read files until under the limit (lock held)"""
+        files = sorted(self._files())
+        self._size = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+            self.on_evict()
+            try:
+                os.rmdir(os.path.dirname(path))  # only succeeds once the directory is empty
+            except OSError:
+                pass
+
+    def size(self):
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            return self._size
+
+
+class ImageStore:
+    """Content-addressed originals with on-demand, disk-cached derivatives"""
+
+    def __init__(self, root, originals_bytes=1024 * 1024 * 1024, derivatives_bytes=256 * 1024 * 1024):
+        self._lock = threading.Lock()
+        self._stats = {
+            "originals_stored": 0,
+            "derivative_hits": 0,
+            "derivative_renders": 0,
+            "evictions": 0,
+        }
+        self.originals = _DiskArea(os.path.join(root, 'originals'), originals_bytes, self._count_eviction)
+        self.derivatives = _DiskArea(os.path.join(root, 'derivatives'), derivatives_bytes, self._count_eviction)
+        self._flight = SingleFlight()
+
+    # ---- originals ----
+
+    def _original_path(self, image_id):
+        return os.path.join(self.originals.root, image_id[:2], f"{image_id}.png")
+
+    def put_original(self, png_bytes):
+        """Persist PNG bytes once and return their content id"""
+        image_id = hashlib.sha256(png_bytes).hexdigest()
+        path = self._original_path(image_id)
+        if not os.path.exists(path) and self.originals.write(path, png_bytes):
+            with self._lock:
+                self._stats["originals_stored"] += 1
+        return image_id
+
+    def get_original(self, image_id):
+        if not IMAGE_ID_PATTERN.match(image_id):
+            return None
+        return self.originals.read(self._original_path(image_id))
+
+    # ---- derivatives ----
+
+    def _derivative_path(self, image_id, name):
+        return os.path.join(self.derivatives.root, image_id[:2], image_id, name)
+
+    def get_variant(self, image_id, variant, fmt, quality):
+        """Encoded bytes for a parsed variant, rendering and caching it on first use; None if the original is gone"""
+        if not IMAGE_ID_PATTERN.match(image_id):
+            return None
+        name = variant_name(variant, fmt, quality)
+        path = self._derivative_path(image_id, name)
+        data = self.derivatives.read(path)
+        if data is not None:
+            with self._lock:
+                self._stats["derivative_hits"] += 1
+            return data
+
+        def render():
+            original = self.get_original(image_id)
+            if original is None:
+                return None
+            if variant == 'full' and fmt == 'png':
+                return original
+            rendered = render_variant(original, variant, fmt, quality)
+            self.derivatives.write(path, rendered)
+            with self._lock:
+                self._stats["derivative_renders"] += 1
+            return rendered
+
+        # Concurrent requests for the same new variant render it once
+        return self._flight.do(f"{image_id}/{name}", render)
+
+    def _count_eviction(self):
+        with self._lock:
+            self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["originals_bytes"] = self.originals.size()
+        stats["derivatives_bytes"] = self.derivatives.size()
+        return stats
@@ -0,0 +1,284 @@
+# Background job queue
+# Pluggable job stores (memory or SQLite) and a bounded worker pool for long-running generations.
+# Runners heartbeat the jobs they own; unfinished jobs whose lease lapses (their process died)
+# are marked failed, so they stop counting as pending and their event streams end.
+
+import json
+import math
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+FINISHED_STATUSES = ('completed', 'failed')
+LOST_JOB_ERROR = {"error": "job_lost", "message": "The worker running this job stopped before it finished"}
+
+
+class JobQueueFull(Exception):
+    """Raised when the pending job limit has been reached"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def new_job(kind, params):
+    """Fresh job record in the queued state"""
+    now = time.time()
+    return {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "status": "queued",
+        "stage": "queued",
+        "progress": 0,
+        "params": params,
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+class MemoryJobStore:
+    """Process-local job store; finished jobs expire after ttl_seconds"""
+
+    def __init__(self, ttl_seconds=3600, lease_seconds=60):
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def create(self, job):
+        with self._lock:
+            self._purge_expired()
+            self._jobs[job["id"]] = dict(job)
+        return job
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(fields)
+            job["updated_at"] = time.time()
+            return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def count_pending(self):
+        cutoff = time.time() - self.lease_seconds
+        with self._lock:
+            return sum(1 for job in self._jobs.values()
+                       if job["status"] not in FINISHED_STATUSES and job["updated_at"] >= cutoff)
+
+    def touch(self, job_ids):
+        """Renew the lease on jobs this process is still working on"""
+        now = time.time()
+        with self._lock:
+            for job_id in job_ids:
+                if job_id in self._jobs:
+                    self._jobs[job_id]["updated_at"] = now
+
+    def fail_stale(self):
+        """Mark unfinished jobs whose lease has lapsed as failed; return how many"""
+        with self._lock:
+            return self._fail_stale()
+
+    def _fail_stale(self):
+        now = time.time()
+        stale = [job for job in self._jobs.values()
+                 if job["status"] not in FINISHED_STATUSES and job["updated_at"] < now - self.lease_seconds]
+        for job in stale:
+            job.update(status="failed", stage="failed", error=dict(LOST_JOB_ERROR), updated_at=now)
+        return len(stale)
+
+    def _purge_expired(self):
+        self._fail_stale()
+        cutoff = time.time() - self.ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["status"] in FINISHED_STATUSES and job["updated_at"] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """SQLite-backed job store so job state survives restarts and is visible across workers"""
+
+    def __init__(self, path, ttl_seconds=3600, lease_seconds=60):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, updated_at REAL NOT NULL, data TEXT NOT NULL)"
+            )
+
+    def create(self, job):
+        with self._lock, self._conn:
+            self._fail_stale()
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (*FINISHED_STATUSES, time.time() - self.ttl_seconds)
+            )
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, updated_at, data) VALUES (?, ?, ?, ?)",
+                (job["id"], job["status"], job["updated_at"], json.dumps(job))
+            )
+        return job
+
+    def update(self, job_id, **fields):
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = json.loads(row[0])
+            job.update(fields)
+            job["updated_at"] = time.time()
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ?, data = ? WHERE id = ?",
+                (job["status"], job["updated_at"], json.dumps(job), job_id)
+            )
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def count_pending(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status NOT IN (?, ?) AND updated_at >= ?",
+                (*FINISHED_STATUSES, time.time() - self.lease_seconds)
+            ).fetchone()
+        return row[0]
+
+    def touch(self, job_ids):
+        """Renew the lease on jobs this process is still working on"""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE jobs SET updated_at = ? WHERE id IN ({', '.join('?' * len(job_ids))})",
+                (time.time(), *job_ids)
+            )
+
+    def fail_stale(self):
+        """Mark unfinished jobs whose lease has lapsed as failed; return how many"""
+        with self._lock, self._conn:
+            return self._fail_stale()
+
+    def _fail_stale(self):
+        now = time.time()
+        rows = self._conn.execute(
+            "SELECT id, data FROM jobs WHERE status NOT IN (?, ?) AND updated_at < ?",
+            (*FINISHED_STATUSES, now - self.lease_seconds)
+        ).fetchall()
+        for job_id, data in rows:
+            job = json.loads(data)
+            job.update(status="failed", stage="failed", error=dict(LOST_JOB_ERROR), updated_at=now)
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ?, data = ? WHERE id = ?",
+                (job["status"], now, json.dumps(job), job_id)
+            )
+        return len(rows)
+
+
+class JobRunner:
+    """Runs job handlers on a bounded thread pool and records progress in a job store"""
+
+    def __init__(self, store, max_workers=4, max_pending=100):
+        self.store = store
+        self.max_pending = max_pending
+        self.max_workers = max_workers
+        self._avg_seconds = None  # moving average of job run time, for Retry-After
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._submit_lock = threading.Lock()
+        self._active = set()
+        self._active_lock = threading.Lock()
+        # Jobs a previous process left queued or running are failed once their lease lapses
+        lost = self.store.fail_stale()
+        if lost:
+            print(f"⚠️ Marked {lost} interrupted job(s) as failed")
+        threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True).start()
+
+    def _heartbeat(self):
+        """Renew leases on this process's jobs and fail jobs whose owner has gone"""
+        interval = max(1, self.store.lease_seconds / 3)
+        while True:
+            time.sleep(interval)
+            try:
+                with self._active_lock:
+                    active = list(self._active)
+                self.store.touch(active)
+                self.store.fail_stale()
+            except Exception as e:
+                print(f"⚠️ Job heartbeat failed: {e}")
+
+    def submit(self, kind, params, handler):
+        """Queue handler(params, progress) and return the new job record"""
+        with self._submit_lock:
+            if self.store.count_pending() >= self.max_pending:
+                raise JobQueueFull(f"Too many pending jobs (limit {self.max_pending})", self.retry_after())
+            job = self.store.create(new_job(kind, params))
+            with self._active_lock:
+                self._active.add(job["id"])
+        self._executor.submit(self._run, job["id"], params, handler)
+        return job
+
+    def retry_after(self):
+        """Seconds until a pending slot likely frees: one job's run time spread over the workers"""
+        if self._avg_seconds is None:
+            return self.store.lease_seconds
+        return max(1, math.ceil(self._avg_seconds / self.max_workers))
+
+    def _run(self, job_id, params, handler):
+        started = time.time()
+        try:
+            self._run_handler(job_id, params, handler)
+        finally:
+            elapsed = time.time() - started
+            avg = self._avg_seconds
+            self._avg_seconds = elapsed if avg is None else avg * 0.8 + elapsed * 0.2
+            with self._active_lock:
+                self._active.discard(job_id)
+
+    def _run_handler(self, job_id, params, handler):
+        self.store.update(job_id, status="running", stage="running", progress=1)
+
+        def progress(stage, percent):
+            self.store.update(job_id, stage=stage, progress=percent)
+
+        try:
+            result = handler(params, progress)
+        except Exception as e:
+            print(f"❌ Job {job_id} failed: {e}")
+            self.store.update(job_id, status="failed", stage="failed",
+                              error={"error": "internal_server_error", "message": str(e)})
+            return
+
+        if isinstance(result, dict) and 'error' in result:
+            self.store.update(job_id, status="failed", stage="failed", error=result)
+        else:
+            self.store.update(job_id, status="completed", stage="completed", progress=100, result=result)
+
+
+def create_job_store(backend, sqlite_path, ttl_seconds, lease_seconds=60):
+    """Build the configured job store ('memory' or 'sqlite')"""
+    if backend == 'sqlite':
+        return SQLiteJobStore(sqlite_path, ttl_seconds=ttl_seconds, lease_seconds=lease_seconds)
+    return MemoryJobStore(ttl_seconds=ttl_seconds, lease_seconds=lease_seconds)
+
+
+def public_job(job):
+    """Job fields safe to return to clients"""
+    return {key: job[key] for key in
+            ("id", "kind", "status", "stage", "progress", "result", "error", "created_at", "updated_at")}
@@ -0,0 +1,445 @@
+# LLM layer
+# Backend interface (Gemini or a local fake), a registry of model handles created once,
+# and a response cache keyed on (model, assembled prompt, content).
+
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+from deadlines import DeadlineExceeded
+from providers import registry
+
+DEFAULT_MODEL = 'gemini-2.0-flash-exp'
+
+
+class LLMBackend:
+    """Interface for text/vision generation backends"""
+
+    name = "base"
+    available = False
+
+    def generate(self, model, parts, timeout=None):
+        """Return the response text for a prompt (a string or a list of strings/PIL images)"""
+        raise NotImplementedError
+
+    def stream(self, model, parts, timeout=None):
+        """Yield response text chunks as they arrive; closing the generator cancels the call"""
+        yield self.generate(model, parts, timeout)
+
+    async def agenerate(self, model, parts, timeout=None):
+        """generate() for the event loop; backends without native async use a worker thread"""
+        return await asyncio.to_thread(self.generate, model, parts, timeout)
+
+    def warm_up(self, model):
+        """Load SDKs and create handles ahead of the first request"""
+
+
+class GeminiBackend(LLMBackend):
+    """google-generativeai backend; model handles are created once and reused"""
+
+    name = "gemini"
+
+    def __init__(self, api_key):
+        self.available = bool(api_key) and registry.available('genai')
+        self._api_key = api_key
+        self._genai = None
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _client(self):
+        """google.generativeai, imported and configured on first use (lock held)"""
+        if self._genai is None:
+            genai = registry.load('genai')
+            genai.configure(api_key=self._api_key)
+            self._genai = genai
+        return self._genai
+
+    def model(self, model_name):
+        """Shared GenerativeModel handle for model_name"""
+        with self._lock:
+            handle = self._models.get(model_name)
+            if handle is None:
+                handle = self._client().GenerativeModel(model_name)
+                self._models[model_name] = handle
+            return handle
+
+    def warm_up(self, model):
+        if self.available:
+            self.model(model)
+
+    @staticmethod
+    def _request_options(timeout):
+        return {"timeout": timeout} if timeout else None
+
+    def generate(self, model, parts, timeout=None):
+        response = self.model(model).generate_content(parts, request_options=self._request_options(timeout))
+        return response.text
+
+    async def agenerate(self, model, parts, timeout=None):
+        response = await self.model(model).generate_content_async(
+            parts, request_options=self._request_options(timeout)
+        )
+        return response.text
+
+    def stream(self, model, parts, timeout=None):
+        response = self.model(model).generate_content(
+            parts, stream=True, request_options=self._request_options(timeout)
+        )
+        try:
+            for chunk in response:
+                text = chunk.text
+                if text:
+                    yield text
+        finally:
+            # The SDK has no public cancel; close the underlying gRPC/HTTP stream if we stop early
+            iterator = getattr(response, '_iterator', None)
+            cancel = getattr(iterator, 'cancel', None)
+            if cancel:
+                cancel()
+
+
+class FakeBackend(LLMBackend):
+    """Deterministic offline backend for tests and benchmarks"""
+
+    name = "fake"
+    available = True
+
+    def __init__(self, latency=0.0, chunk_latency=0.0):
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.calls = 0
+        self.cancelled = 0
+        self._lock = threading.Lock()
+
+    def generate(self, model, parts, timeout=None):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(min(self.latency, timeout or self.latency))
+            if timeout and self.latency > timeout:
+                raise TimeoutError(f"fake backend timed out after {timeout:.2f}s")
+        return self._respond(parts)
+
+    async def agenerate(self, model, parts, timeout=None):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            await asyncio.sleep(min(self.latency, timeout or self.latency))
+            if timeout and self.latency > timeout:
+                raise TimeoutError(f"fake backend timed out after {timeout:.2f}s")
+        return self._respond(parts)
+
+    @staticmethod
+    def _respond(parts):
+        text = " ".join(part for part in _as_list(parts) if isinstance(part, str))
+        words = text.split()
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+        return (f"SUMMARY:\nFake analysis {digest} of {len(words)} words.\n\n"
+                f"KEY POINTS:\nFirst, the content starts with: {' '.join(words[:12])}")
+
+    def stream(self, model, parts, timeout=None):
+        text = self.generate(model, parts, timeout)
+        finished = False
+        try:
+            words = text.split(' ')
+            for i, word in enumerate(words):
+                if self.chunk_latency:
+                    time.sleep(self.chunk_latency)
+                yield word if i == len(words) - 1 else word + ' '
+            finished = True
+        finally:
+            if not finished:
+                with self._lock:
+                    self.cancelled += 1
+
+
+def create_backend(kind, api_key=None, fake_latency=0.0, fake_chunk_latency=0.0):
+    """Build the configured backend ('gemini' or 'fake')"""
+    if kind == 'fake':
+        return FakeBackend(latency=fake_latency, chunk_latency=fake_chunk_latency)
+    return GeminiBackend(api_key)
+
+
+def _as_list(parts):
+    return parts if isinstance(parts, (list, tuple)) else [parts]
+
+
+def prompt_key(model, parts):
+    """Stable hash of a model name and prompt parts; images are hashed by their pixels"""
+    digest = hashlib.sha256(model.encode('utf-8'))
+    for part in _as_list(parts):
+        if isinstance(part, str):
+            digest.update(b'\x00text\x00')
+            digest.update(part.encode('utf-8'))
+        elif hasattr(part, 'tobytes'):
+            digest.update(f"\x00image\x00{part.mode}:{part.size}".encode('utf-8'))
+            digest.update(part.tobytes())
+        else:
+            digest.update(b'\x00repr\x00')
+            digest.update(repr(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL response cache with an optional SQLite persistence tier"""
+
+    def __init__(self, max_items=512, ttl_seconds=24 * 3600, sqlite_path=None):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (text, stored_at)
+        self._stats = {"hits": 0, "persistent_hits": 0, "misses": 0, "stores": 0}
+        self._conn = None
+        if sqlite_path:
+            self._conn = sqlite3.connect(sqlite_path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_responses "
+                    "(key TEXT PRIMARY KEY, text TEXT NOT NULL, stored_at REAL NOT NULL)"
+                )
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[1] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[0]
+            if entry:
+                del self._entries[key]
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT text, stored_at FROM llm_responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row and now - row[1] <= self.ttl_seconds:
+                    self._remember(key, row[0], row[1])
+                    self._stats["persistent_hits"] += 1
+                    return row[0]
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key, text):
+        now = time.time()
+        with self._lock:
+            self._remember(key, text, now)
+            self._stats["stores"] += 1
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO llm_responses (key, text, stored_at) VALUES (?, ?, ?)",
+                        (key, text, now)
+                    )
+                    self._conn.execute(
+                        "DELETE FROM llm_responses WHERE stored_at < ?", (now - self.ttl_seconds,)
+                    )
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        stats["persistent"] = self._conn is not None
+        return stats
+
+    def _remember(self, key, text, stored_at):
+        self._entries[key] = (text, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_items:
+            self._entries.popitem(last=False)
+
+
+def lane_for(parts):
+    """Admission lane for a prompt: 'gemini_vision' if it carries an image"""
+    return "gemini_text" if all(isinstance(part, str) for part in _as_list(parts)) else "gemini_vision"
+
+
+def _remaining(deadline):
+    return deadline.remaining() if deadline is not None else None
+
+
+def _timeout(deadline):
+    return deadline.timeout(stage='llm') if deadline is not None else None
+
+
+def _raise_if_expired(deadline, error):
+    """Report an error caused by running out of time as DeadlineExceeded"""
+    if deadline is not None and deadline.expired() and not isinstance(error, DeadlineExceeded):
+        raise DeadlineExceeded('llm') from error
+
+
+class LLMService:
+    """Single entry point for LLM calls: backend + response cache + optional admission control"""
+
+    def __init__(self, backend, cache=None, default_model=DEFAULT_MODEL, admission=None, on_outcome=None):
+        self.backend = backend
+        self.cache = cache
+        self.default_model = default_model
+        self.admission = admission
+        self.on_outcome = on_outcome  # called with (lane, 'ok' | 'error' | 'cancelled') per backend call
+        self._lock = threading.Lock()
+        self._streams = {"started": 0, "completed": 0, "cancelled": 0, "failed": 0}
+        self._ttft = deque(maxlen=200)
+        self._total = deque(maxlen=200)
+
+    @property
+    def available(self):
+        return self.backend.available
+
+    def warm_up(self):
+        self.backend.warm_up(self.default_model)
+
+    def generate(self, parts, model=None, use_cache=True, deadline=None):
+        """Response text for parts; identical (model, prompt, content) calls are served from cache.
+
+        With a `deadline`, the admission wait and the upstream timeout come from its
+        remaining time, and running out of it raises DeadlineExceeded.
+        """
+        model = model or self.default_model
+        key = prompt_key(model, parts) if self.cache and use_cache else None
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        try:
+            if self.admission:
+                with self.admission.slot(lane_for(parts), timeout=_remaining(deadline)):
+                    text = self._call(model, parts, _timeout(deadline))
+            else:
+                text = self._call(model, parts, _timeout(deadline))
+        except Exception as e:
+            _raise_if_expired(deadline, e)
+            raise
+        if key and text:
+            self.cache.put(key, text)
+        return text
+
+    async def agenerate(self, parts, model=None, use_cache=True, deadline=None):
+        """generate() for the ASGI entry point; waits for admission without blocking the loop"""
+        model = model or self.default_model
+        key = prompt_key(model, parts) if self.cache and use_cache else None
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        try:
+            if self.admission:
+                async with self.admission.slot_async(lane_for(parts), timeout=_remaining(deadline)):
+                    text = await self._acall(model, parts, _timeout(deadline))
+            else:
+                text = await self._acall(model, parts, _timeout(deadline))
+        except Exception as e:
+            _raise_if_expired(deadline, e)
+            raise
+        if key and text:
+            self.cache.put(key, text)
+        return text
+
+    async def _acall(self, model, parts, timeout=None):
+        try:
+            text = (await self.backend.agenerate(model, parts, timeout)).strip()
+        except Exception:
+            self._record_outcome(parts, "error")
+            raise
+        self._record_outcome(parts, "ok")
+        return text
+
+    def _call(self, model, parts, timeout=None):
+        try:
+            text = self.backend.generate(model, parts, timeout).strip()
+        except Exception:
+            self._record_outcome(parts, "error")
+            raise
+        self._record_outcome(parts, "ok")
+        return text
+
+    def _record_outcome(self, parts, outcome):
+        if self.on_outcome:
+            self.on_outcome(lane_for(parts), outcome)
+
+    def stream(self, parts, model=None, use_cache=True, timings=None, deadline=None):
+        """Yield response chunks as they arrive.
+
+        A cached response is replayed as one chunk. Closing the generator early (client
+        disconnect) closes the backend stream, cancelling the upstream generation; so
+        does passing the `deadline`, which raises DeadlineExceeded.
+        `timings`, if given, is filled with ttft_ms/total_ms/cached.
+        """
+        model = model or self.default_model
+        timings = timings if timings is not None else {}
+        started = time.perf_counter()
+        key = prompt_key(model, parts) if self.cache and use_cache else None
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                timings.update(ttft_ms=0.0, total_ms=0.0, cached=True)
+                yield cached
+                return
+
+        lane = lane_for(parts) if self.admission else None
+        try:
+            timeout = _timeout(deadline)
+            token = self.admission.acquire(lane, timeout=timeout) if lane else None
+        except Exception as e:
+            _raise_if_expired(deadline, e)
+            raise
+        with self._lock:
+            self._streams["started"] += 1
+        chunks = []
+        outcome = "cancelled"
+        upstream = self.backend.stream(model, parts, timeout)
+        try:
+            for chunk in upstream:
+                if not chunks:
+                    timings["ttft_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                chunks.append(chunk)
+                yield chunk
+                if deadline is not None:
+                    deadline.check('llm stream')
+            outcome = "completed"
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if deadline is not None and deadline.expired():
+                raise DeadlineExceeded('llm stream') from e
+            outcome = "failed"
+            raise
+        finally:
+            upstream.close()
+            if lane:
+                self.admission.release(lane, token)
+            total_ms = round((time.perf_counter() - started) * 1000, 1)
+            timings.update(total_ms=total_ms, cached=False)
+            self._record_outcome(parts, {"completed": "ok", "failed": "error"}.get(outcome, outcome))
+            with self._lock:
+                self._streams[outcome] += 1
+                if outcome == "completed":
+                    self._total.append(total_ms)
+                    if "ttft_ms" in timings:
+                        self._ttft.append(timings["ttft_ms"])
+
+        text = "".join(chunks).strip()
+        if key and text:
+            self.cache.put(key, text)
+
+    def stats(self):
+        with self._lock:
+            streams = dict(self._streams)
+            ttft = sorted(self._ttft)
+            total = sorted(self._total)
+        if ttft:
+            streams["ttft_ms_p50"] = ttft[len(ttft) // 2]
+        if total:
+            streams["total_ms_p50"] = total[len(total) // 2]
+        return {
+            "backend": self.backend.name,
+            "available": self.backend.available,
+            "cache": self.cache.stats() if self.cache else {"enabled": False},
+            "streams": streams,
+        }
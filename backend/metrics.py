@@ -0,0 +1,157 @@
+# Metrics
+# Dependency-free counters, histograms and callback gauges rendered in the Prometheus
+# text exposition format. Recording is a dict lookup, a bisect and a few additions
+# under one lock, so it is cheap enough to leave on in production.
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, _format_labels(self.label_names, key), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels (values in seconds)"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       _format_labels(self.label_names, key, f'le="{_format_value(float(bound))}"'), cumulative)
+            yield self.name + '_bucket', _format_labels(self.label_names, key, 'le="+Inf"'), values[-1]
+            yield self.name + '_sum', _format_labels(self.label_names, key), round(values[-2], 6)
+            yield self.name + '_count', _format_labels(self.label_names, key), values[-1]
+
+
+class CallbackGauge:
+    """Gauge (or counter kept elsewhere) whose samples are read from a callback at scrape time.
+
+    The callback returns a list of (labels dict, value) pairs.
+    """
+
+    def __init__(self, name, help_text, label_names, callback, kind="gauge"):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.callback = callback
+
+    def samples(self):
+        try:
+            points = self.callback()
+        except Exception:
+            return
+        for labels, value in points:
+            key = tuple(labels.get(name, '') for name in self.label_names)
+            yield self.name, _format_labels(self.label_names, key), value
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together for /metrics"""
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self._add(Counter(self.prefix + name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help_text, label_names, buckets))
+
+    def gauge(self, name, help_text, label_names, callback):
+        return self._add(CallbackGauge(self.prefix + name, help_text, label_names, callback))
+
+    def callback_counter(self, name, help_text, label_names, callback):
+        """Expose a counter that another component already keeps"""
+        return self._add(CallbackGauge(self.prefix + name, help_text, label_names, callback, kind="counter"))
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
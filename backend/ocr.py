@@ -0,0 +1,171 @@
+# OCR engine
+# Preprocesses uploads for Tesseract (grayscale, downscale to a target DPI, optional
+# binarisation), splits tall images into overlapping strips, OCRs the strips in parallel
+# and merges the words back with a confidence score used to decide on the AI fallback.
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from providers import registry
+
+# pytesseract is imported on the first OCR call
+TESSERACT_AVAILABLE = registry.available('pytesseract')
+
+# Each Tesseract call already runs in its own process; keep it single-threaded so
+# parallel strips do not oversubscribe the CPU.
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+A4_LONG_SIDE_INCHES = 11.69
+
+
+def otsu_threshold(histogram):
+    """Otsu's threshold for a 256-bin grayscale histogram"""
+    total = sum(histogram)
+    weighted_total = sum(i * count for i, count in enumerate(histogram))
+    background = 0
+    weighted_background = 0.0
+    best_threshold = 127
+    best_variance = 0.0
+    for i, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        weighted_background += i * count
+        mean_background = weighted_background / background
+        mean_foreground = (weighted_total - weighted_background) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_variance = variance
+            best_threshold = i
+    return best_threshold
+
+
+class OCREngine:
+    """Tesseract pipeline with preprocessing, strip tiling and confidence scoring"""
+
+    def __init__(self, target_dpi=300, binarize=True, tile_height=1600, tile_overlap=120,
+                 workers=None, language='eng'):
+        self.target_dpi = target_dpi
+        self.binarize = binarize
+        self.tile_height = tile_height
+        self.tile_overlap = tile_overlap
+        self.language = language
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or min(4, os.cpu_count() or 1), thread_name_prefix='ocr'
+        )
+
+    # ---- preprocessing ----
+
+    def target_long_side(self, image):
+        """Long side in pixels that corresponds to the target DPI"""
+        dpi = image.info.get('dpi')
+        if dpi and dpi[0]:
+            return int(max(image.size) * self.target_dpi / float(dpi[0]))
+        # Phone photos carry no useful DPI; assume the page is A4
+        return int(A4_LONG_SIDE_INCHES * self.target_dpi)
+
+    def preprocess(self, image):
+        """Grayscale, honour EXIF rotation, downscale to the target DPI and binarise"""
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('L')
+
+        target = self.target_long_side(image)
+        long_side = max(image.size)
+        if long_side > target:
+            scale = target / long_side
+            image = image.resize(
+                (max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+                Image.LANCZOS
+            )
+
+        if self.binarize:
+            image = ImageOps.autocontrast(image, cutoff=1)
+            threshold = otsu_threshold(image.histogram())
+            image = image.point(lambda value: 255 if value > threshold else 0)
+        return image
+
+    # ---- tiling ----
+
+    def tiles(self, image):
+        """Overlapping horizontal strips as (image, top, own_top, own_bottom).
+
+        Each strip owns the band between the midpoints of its overlaps, so a word
+        seen twice is only kept by the strip that owns its centre line.
+        """
+        height = image.height
+        if height <= self.tile_height:
+            return [(image, 0, 0, height)]
+
+        step = self.tile_height - self.tile_overlap
+        tops = list(range(0, max(1, height - self.tile_overlap), step))
+        strips = []
+        for index, top in enumerate(tops):
+            bottom = min(height, top + self.tile_height)
+            own_top = 0 if index == 0 else top + self.tile_overlap // 2
+            own_bottom = height if index == len(tops) - 1 else top + step + self.tile_overlap // 2
+            strips.append((image.crop((0, top, image.width, bottom)), top, own_top, own_bottom))
+        return strips
+
+    def _ocr_strip(self, strip, top, own_top, own_bottom, timeout=None):
+        pytesseract = registry.load('pytesseract')
+        # timeout kills the tesseract process (RuntimeError) once a request's budget is spent
+        data = pytesseract.image_to_data(
+            strip, lang=self.language, output_type=pytesseract.Output.DICT, timeout=timeout or 0
+        )
+        words = []
+        for i, word in enumerate(data['text']):
+            word = word.strip()
+            if not word:
+                continue
+            center = top + data['top'][i] + data['height'][i] / 2
+            if not own_top <= center < own_bottom:
+                continue
+            words.append({
+                "text": word,
+                "conf": float(data['conf'][i]),
+                "line": (top, data['block_num'][i], data['par_num'][i], data['line_num'][i]),
+                "center": center,
+            })
+        return words
+
+    # ---- public API ----
+
+    def recognize(self, image, timeout=None):
+        """OCR an image; return {'text', 'confidence', 'words', 'tiles', 'elapsed_ms'}"""
+        started = time.perf_counter()
+        prepared = self.preprocess(image)
+        strips = self.tiles(prepared)
+
+        if len(strips) == 1:
+            results = [self._ocr_strip(*strips[0], timeout=timeout)]
+        else:
+            futures = [self._executor.submit(self._ocr_strip, *strip, timeout=timeout) for strip in strips]
+            results = [future.result() for future in futures]
+
+        lines = []
+        current_line = None
+        confidences = []
+        for words in results:
+            for word in words:
+                if word["line"] != current_line:
+                    current_line = word["line"]
+                    lines.append([])
+                lines[-1].append(word["text"])
+                if word["conf"] >= 0:
+                    confidences.append((word["conf"], len(word["text"])))
+
+        weight = sum(length for _, length in confidences)
+        confidence = sum(conf * length for conf, length in confidences) / weight if weight else 0.0
+        return {
+            "text": "\n".join(" ".join(line) for line in lines),
+            "confidence": round(confidence, 1),
+            "words": sum(len(words) for words in results),
+            "tiles": len(strips),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
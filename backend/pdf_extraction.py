@@ -0,0 +1,126 @@
+# PDF text extraction
+# Splits a PDF into page ranges, extracts them across a process pool and yields pages
+# in order as soon as each range finishes, so large textbooks can be streamed.
+
+import io
+import mmap
+import time
+
+from process_pools import SpawnedProcessPool
+from providers import registry
+
+# PyPDF2 is imported on the first PDF opened (also inside process-pool workers)
+PDF_AVAILABLE = registry.available('PyPDF2')
+
+
+def _pdf_reader(source):
+    return registry.load('PyPDF2').PdfReader(source)
+
+
+def count_pages(source):
+    """Number of pages in a PDF file path or file-like object"""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return len(_pdf_reader(source).pages)
+
+
+def extract_page_range(source, start, end):
+    """Extract pages [start, end) and return (page_number, text, elapsed_ms, error) tuples.
+
+    `source` is a file path (memory-mapped here), the PDF's bytes (as process-pool
+    workers receive an in-memory upload) or an already open file-like object.
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return _extract_pages(_pdf_reader(mapped), start, end)
+    if isinstance(source, bytes):
+        return _extract_pages(_pdf_reader(io.BytesIO(source)), start, end)
+    source.seek(0)
+    return _extract_pages(_pdf_reader(source), start, end)
+
+
+def _extract_pages(reader, start, end):
+    results = []
+    for page_num in range(start, end):
+        started = time.perf_counter()
+        try:
+            text = reader.pages[page_num].extract_text() or ""
+            error = None
+        except Exception as e:
+            text = ""
+            error = str(e)
+        results.append((page_num + 1, text, round((time.perf_counter() - started) * 1000, 2), error))
+    return results
+
+
+def _buffer_bytes(source):
+    """Contents of an in-memory upload, in a form that can be sent to pool workers"""
+    if hasattr(source, 'getvalue'):
+        return source.getvalue()
+    source.seek(0)
+    return source.read()
+
+
+class PDFExtractor:
+    """Page-chunked extractor with a page/byte budget and an optional process pool"""
+
+    def __init__(self, workers=2, pages_per_chunk=25, parallel_min_pages=40,
+                 max_pages=500, max_text_bytes=20 * 1024 * 1024):
+        self.workers = workers
+        self.pages_per_chunk = pages_per_chunk
+        self.parallel_min_pages = parallel_min_pages
+        self.max_pages = max_pages
+        self.max_text_bytes = max_text_bytes
+        self._pool = SpawnedProcessPool(workers)
+
+    def _get_pool(self):
+        return self._pool.get()
+
+    def iter_pages(self, source, num_pages, deadline=None):
+        """Yield page dicts in page order, stopping once the page or byte budget is spent
+        or the request `deadline` has passed.
+
+        Spilled uploads reach the process pool as a path; in-memory buffers are sent
+        as bytes (they are small, at most the spool size).
+        """
+        limit = min(num_pages, self.max_pages) if self.max_pages else num_pages
+        ranges = [(start, min(start + self.pages_per_chunk, limit))
+                  for start in range(0, limit, self.pages_per_chunk)]
+
+        if self.workers > 1 and limit >= self.parallel_min_pages:
+            pool = self._get_pool()
+            shared = source if isinstance(source, str) else _buffer_bytes(source)
+            futures = [pool.submit(extract_page_range, shared, start, end) for start, end in ranges]
+            chunks = (future.result(timeout=deadline.remaining() if deadline is not None else None)
+                      for future in futures)
+        else:
+            futures = []
+            chunks = (extract_page_range(source, start, end) for start, end in ranges)
+
+        text_bytes = 0
+        try:
+            for start, _ in ranges:
+                # Checked before each range is parsed (or awaited), so late ranges are never started
+                if deadline is not None and deadline.expired():
+                    yield {"budget_exceeded": "deadline", "page": start + 1}
+                    return
+                try:
+                    chunk = next(chunks)
+                except TimeoutError:
+                    yield {"budget_exceeded": "deadline", "page": start + 1}
+                    return
+                for page_number, text, elapsed_ms, error in chunk:
+                    text_bytes += len(text.encode('utf-8'))
+                    if self.max_text_bytes and text_bytes > self.max_text_bytes:
+                        yield {"budget_exceeded": "max_bytes", "page": page_number}
+                        return
+                    yield {"page": page_number, "text": text, "ms": elapsed_ms, "error": error}
+            if limit < num_pages:
+                yield {"budget_exceeded": "max_pages", "page": limit + 1}
+        finally:
+            # Drop ranges nobody will read (early stop or client disconnect)
+            for future in futures:
+                future.cancel()
+
+    def shutdown(self):
+        self._pool.shutdown()
@@ -0,0 +1,31 @@
+# Process pools
+# Lazily created process pools for CPU-heavy stages (PDF page ranges, very large
+# post-processing). Workers are spawned rather than forked, so they never inherit the
+# Flask process's threads, held locks or open sockets.
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+class SpawnedProcessPool:
+    """ProcessPoolExecutor with spawned workers, started on first use"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def get(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._pool
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
@@ -0,0 +1,125 @@
+# Lazy providers
+# Heavy optional dependencies (google.generativeai, pytesseract, PyPDF2, requests) are
+# imported on first use instead of at startup. Availability is answered from the import
+# system's module index without importing anything, and an optional warm-up loads them
+# in the background once the server is up.
+
+import importlib
+import importlib.util
+import threading
+import time
+
+
+class Provider:
+    """One lazily imported module"""
+
+    def __init__(self, name, module_name):
+        self.name = name
+        self.module_name = module_name
+        self._lock = threading.Lock()
+        self._module = None
+        self._available = None
+        self.load_ms = None
+        self.error = None
+
+    @property
+    def available(self):
+        """True if the module is installed (checked without importing it)"""
+        if self._available is None:
+            try:
+                self._available = importlib.util.find_spec(self.module_name) is not None
+            except (ImportError, ValueError):
+                self._available = False
+        return self._available
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def load(self):
+        """Import the module once and return it; raises ImportError if it is missing"""
+        module = self._module
+        if module is not None:
+            return module
+        with self._lock:
+            if self._module is None:
+                started = time.perf_counter()
+                try:
+                    self._module = importlib.import_module(self.module_name)
+                except ImportError as e:
+                    self._available = False
+                    self.error = str(e)
+                    raise
+                self.load_ms = round((time.perf_counter() - started) * 1000, 1)
+            return self._module
+
+    def stats(self):
+        return {"available": self.available, "loaded": self.loaded, "load_ms": self.load_ms, "error": self.error}
+
+
+class ProviderRegistry:
+    """Named providers plus a background warm-up"""
+
+    def __init__(self):
+        self._providers = {}
+        self._warmup_hooks = []
+        self._warmup_started = False
+        self._lock = threading.Lock()
+        self.warmup = {"state": "idle", "elapsed_ms": None}
+
+    def register(self, name, module_name):
+        self._providers[name] = Provider(name, module_name)
+        return self._providers[name]
+
+    def available(self, name):
+        return self._providers[name].available
+
+    def load(self, name):
+        return self._providers[name].load()
+
+    def add_warmup_hook(self, hook):
+        """Extra work for warm_up() after modules are loaded (e.g. creating client handles)"""
+        self._warmup_hooks.append(hook)
+
+    def warm_up(self, delay=0.0):
+        """Load every available provider and run warm-up hooks on a daemon thread (once)"""
+        if self._warmup_started:
+            return False
+        with self._lock:
+            if self._warmup_started:
+                return False
+            self._warmup_started = True
+
+        def run():
+            if delay:
+                time.sleep(delay)
+            self.warmup["state"] = "running"
+            started = time.perf_counter()
+            for provider in self._providers.values():
+                if provider.available:
+                    try:
+                        provider.load()
+                    except Exception as e:
+                        print(f"⚠️  Warm-up could not load {provider.name}: {e}")
+            for hook in self._warmup_hooks:
+                try:
+                    hook()
+                except Exception as e:
+                    print(f"⚠️  Warm-up hook failed: {e}")
+            self.warmup.update(state="done", elapsed_ms=round((time.perf_counter() - started) * 1000, 1))
+
+        threading.Thread(target=run, name='provider-warmup', daemon=True).start()
+        return True
+
+    def stats(self):
+        return {
+            "providers": {name: provider.stats() for name, provider in self._providers.items()},
+            "warmup": dict(self.warmup),
+        }
+
+
+registry = ProviderRegistry()
+registry.register('genai', 'google.generativeai')
+registry.register('pytesseract', 'pytesseract')
+registry.register('PyPDF2', 'PyPDF2')
+registry.register('requests', 'requests')
@@ -0,0 +1,108 @@
+# Single-flight request coalescing
+# Concurrent callers asking for the same key share one in-flight call and its result.
+
+import asyncio
+import threading
+
+
+class SingleFlightTimeout(Exception):
+    """Raised to a waiter whose per-key timeout expired before the shared call finished"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; duplicate callers wait for its outcome"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {"leaders": 0, "coalesced": 0, "timeouts": 0, "errors": 0}
+
+    def do(self, key, fn, timeout=None):
+        """Return fn() for key, sharing the result (or exception) with concurrent callers.
+
+        The first caller runs fn; later callers block for up to `timeout` seconds and
+        raise SingleFlightTimeout if the shared call has not finished by then.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self._stats["leaders"] += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self._stats["coalesced"] += 1
+                leader = False
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                with self._lock:
+                    self._stats["errors"] += 1
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+        elif not call.done.wait(timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise SingleFlightTimeout(f"Timed out after {timeout}s waiting for shared request")
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        """Snapshot of coalescing counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+
+class AsyncSingleFlight:
+    """Event-loop variant of SingleFlight: duplicate callers await the leader's task"""
+
+    def __init__(self):
+        self._calls = {}
+        self._stats = {"leaders": 0, "coalesced": 0, "timeouts": 0, "errors": 0}
+
+    async def do(self, key, coro_fn, timeout=None):
+        """Await coro_fn() for key, sharing its result (or exception) with concurrent callers"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn())
+            self._calls[key] = task
+            self._stats["leaders"] += 1
+            task.add_done_callback(lambda done: self._finish(key, done))
+            return await asyncio.shield(task)
+
+        self._stats["coalesced"] += 1
+        try:
+            # shield: a follower timing out or disconnecting must not cancel the shared call
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            raise SingleFlightTimeout(f"Timed out after {timeout}s waiting for shared request")
+
+    def _finish(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled() and task.exception() is not None:
+            self._stats["errors"] += 1
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["in_flight"] = len(self._calls)
+        return stats
@@ -0,0 +1,184 @@
+# Upload buffering
+# Keeps small uploads in RAM and spills large ones to unique, auto-deleted temp files,
+# so extraction reads straight from the request buffer instead of the uploads/ folder.
+
+import hashlib
+import io
+import mmap
+import tempfile
+import threading
+import time
+from collections import deque
+
+from flask import Request
+
+
+class SpooledUpload:
+    """Upload buffer held in RAM or in a *named* temp file.
+
+    The request's Content-Length decides up front: bodies larger than max_size are
+    written straight to disk. Bodies of unknown length (chunked uploads) start in memory
+    and are copied to disk once they outgrow it. The name lets process-pool workers open
+    large PDFs by path; the file is deleted as soon as it is closed (Flask closes request
+    files at teardown). The SHA-256 of the upload is computed as it is written, so the
+    extraction cache never re-reads it.
+    """
+
+    def __init__(self, max_size, expected_size=None, prefix='upload-', dir=None):
+        self.max_size = max_size
+        self._prefix = prefix
+        self._dir = dir
+        if expected_size is not None and expected_size > max_size:
+            self._file = self._disk_file()
+        else:
+            self._file = io.BytesIO()
+        self._digest = hashlib.sha256()
+        self._hashed = 0
+
+    def _disk_file(self):
+        return tempfile.NamedTemporaryFile(mode='w+b', prefix=self._prefix, dir=self._dir)
+
+    def write(self, s):
+        if self._digest is not None:
+            if self.tell() == self._hashed:
+                self._digest.update(s)
+                self._hashed += len(s)
+            else:
+                self._digest = None  # not a plain append: let the caller hash the contents
+        written = self._file.write(s)
+        if self.path is None and self._file.tell() > self.max_size:
+            self.rollover()
+        return written
+
+    def rollover(self):
+        """Move an in-memory buffer to a named temp file (no-op once on disk)"""
+        if self.path is not None:
+            return
+        memory_file = self._file
+        disk_file = self._disk_file()
+        disk_file.write(memory_file.getbuffer())
+        disk_file.seek(memory_file.tell())
+        self._file = disk_file
+        memory_file.close()
+
+    @property
+    def sha256(self):
+        """Hex SHA-256 of the written upload, or None if it was not written front to back"""
+        return self._digest.hexdigest() if self._digest is not None else None
+
+    @property
+    def path(self):
+        """Filesystem path once spilled to disk, otherwise None"""
+        return None if isinstance(self._file, io.BytesIO) else self._file.name
+
+    @property
+    def size(self):
+        position = self.tell()
+        self.seek(0, 2)
+        size = self.tell()
+        self.seek(position)
+        return size
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        self._file.close()
+
+    def __getattr__(self, name):
+        # readline, readinto, flush, closed, seekable, ... of the current buffer
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def make_upload_request_class(spool_max_bytes, temp_dir=None):
+    """Flask Request subclass whose file parts are SpooledUpload buffers"""
+
+    class UploadRequest(Request):
+        def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+            # total_content_length is the whole request body, an upper bound on this part
+            return SpooledUpload(spool_max_bytes, expected_size=total_content_length,
+                                 prefix='upload-', dir=temp_dir)
+
+    return UploadRequest
+
+
+def upload_source(stream):
+    """Best readable source for an upload buffer.
+
+    Spilled files are memory-mapped so parsers read pages from the OS cache without
+    another copy; in-memory buffers are returned as-is. Call release_source() afterwards.
+    """
+    stream.seek(0)
+    if isinstance(stream, SpooledUpload) and stream.path:
+        stream.flush()
+        return mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    return stream
+
+
+def release_source(source):
+    if isinstance(source, mmap.mmap):
+        source.close()
+
+
+def detach_upload(storage):
+    """Take ownership of an upload buffer so request teardown does not close it.
+
+    Needed by streamed responses, which keep reading after the view returns;
+    the caller must close the returned stream.
+    """
+    stream = storage.stream
+    storage.stream = io.BytesIO()
+    return stream
+
+
+class UploadIOStats:
+    """Per-request upload I/O byte counts for /health"""
+
+    def __init__(self, history=20):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=history)
+        self._totals = {"requests": 0, "bytes_received": 0, "bytes_spilled": 0}
+
+    def record(self, endpoint, streams):
+        received = 0
+        spilled = 0
+        for stream in streams:
+            size = stream.size if isinstance(stream, SpooledUpload) else None
+            if size is None:
+                continue
+            received += size
+            if stream.path:
+                spilled += size
+        entry = {
+            "endpoint": endpoint,
+            "bytes_received": received,
+            "bytes_spilled": spilled,
+            "timestamp": time.time(),
+        }
+        with self._lock:
+            self._recent.append(entry)
+            self._totals["requests"] += 1
+            self._totals["bytes_received"] += received
+            self._totals["bytes_spilled"] += spilled
+
+    def stats(self):
+        with self._lock:
+            return {"totals": dict(self._totals), "recent": list(self._recent)}